@@ -1,14 +1,51 @@
 import asyncio
 import aiohttp
-import json
 import random
+import sys
 import time
-from lxml import html
+from itertools import islice
+from page_extract import extract_page, PAGE_FIELDS
+from retry_scheduler import (
+    HostRetryBudget,
+    RetryScheduler,
+    host_of,
+    parse_retry_after,
+    retry_delay,
+)
+from host_control import HostController, AsyncHostLimiter, outcome_of_status, ERROR
+from url_stats import UrlStatsIndex
+from url_canon import DedupReport, dedup_docs
+from bloom_filter import BloomFilter
+from crawl_state import CrawlState, CheckpointedState, RECRAWL_TTL
+from sink import NdjsonSink
+from metrics import CrawlMetrics, aiohttp_trace_config
+from transport import make_connector, ConnectionReuse, interleave_by_host
+from http_cache import HttpCache
+from failures import (
+    failed_record,
+    kind_of_status,
+    kind_of_exception,
+    is_parse_failure,
+    RETRYABLE,
+    PARSE,
+    REDRIVE_WORKERS,
+    REDRIVE_MAX_RETRIES,
+    REDRIVE_BACKOFF_FACTOR,
+)
 
 MAX_CONCURRENCY = 20
 REQUEST_TIMEOUT = 10
 MAX_RETRIES = 2
 RETRY_BACKOFF_FACTOR = 2
+STREAM_MODE = True  # One session and a sliding window instead of per-batch runs
+EXTRACT_FIELDS = PAGE_FIELDS  # Title plus react_data fields, ["title"] for titles only
+# Fixed-memory set of the URLs read in this run instead of an exact one
+# (bloom_filter.py). Earlier runs are left to the crawl state and RECRAWL_TTL.
+USE_SEEN_FILTER = True
+METRICS_PATH = "crawl_metrics.prom"  # Prometheus text file, a ".json" path gives JSON
+USE_HTTP_CACHE = True  # Keep pages in http_cache/ and re-crawl with If-None-Match
+CACHE_OFFLINE = False  # Replay extraction from http_cache/ only, no requests at all
+REDRIVE = "--redrive" in sys.argv  # Only re-crawl URLs that failed retryably
 
 USER_AGENTS = [
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.1.1 Safari/605.1.15",
@@ -21,6 +58,13 @@ USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36 OPR/109.0.0.0",
 ]
 
+host_budget = HostRetryBudget()
+host_limiter = AsyncHostLimiter(HostController())
+url_stats = UrlStatsIndex()
+metrics = CrawlMetrics("async_crawl_glamira")
+connection_reuse = ConnectionReuse()
+http_cache = HttpCache()
+
 HEADERS_TEMPLATE = {
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
     "Accept-Language": "en-US,en;q=0.9",
@@ -32,77 +76,274 @@ HEADERS_TEMPLATE = {
 }
 
 
-async def fetch(session, sem, data, retry_count=0):
+# With a retry_scheduler (stream mode) a retryable failure comes back as a
+# "retry" record for the caller to schedule, instead of sleeping in this task
+async def fetch(session, sem, data, retry_count=0, retry_scheduler=None):
     url = data.get("url")
-    headers = {**HEADERS_TEMPLATE, "User-Agent": random.choice(USER_AGENTS)}
-    try:
-        async with sem:
-            async with session.get(
-                url, headers=headers, timeout=REQUEST_TIMEOUT
-            ) as resp:
-                status = resp.status
-                text = await resp.text(errors="ignore")
-                if status in [200, 201]:
-                    tree = html.fromstring(text)
-                    # Example: get <h1 class="page-title"> text
-                    title = tree.xpath('//h1[contains(@class, "page-title")]/text()')
-                    title_text = title[0].strip() if title else "No title found"
-                    return {
-                        "status": "success",
-                        "id": data.get("id"),
-                        "title": title_text,
-                        "url": url,
-                    }
-                elif (
-                    status in [403, 429, 500, 502, 503, 504]
-                    and retry_count < MAX_RETRIES
-                ):
-                    await asyncio.sleep(
-                        random.uniform(0.5, 1.5)
-                        * (RETRY_BACKOFF_FACTOR * (retry_count + 1))
-                    )
-                    return await fetch(session, sem, data, retry_count + 1)
-                else:
-                    return {
-                        "status": "failed",
-                        "id": data.get("id"),
-                        "reason": f"Status code {status}",
-                        "url": url,
-                    }
-    except Exception as e:
-        if retry_count < MAX_RETRIES:
-            await asyncio.sleep(
-                random.uniform(0.5, 1.5) * (RETRY_BACKOFF_FACTOR * (retry_count + 1))
-            )
-            return await fetch(session, sem, data, retry_count + 1)
-        return {
-            "status": "failed",
-            "id": data.get("id"),
-            "reason": str(e),
-            "url": url,
+    # SQLite, file I/O and (de)compression of the cache run in a worker
+    # thread, off the event loop
+    entry = (
+        await asyncio.to_thread(http_cache.lookup, url)
+        if USE_HTTP_CACHE or CACHE_OFFLINE
+        else None
+    )
+    if CACHE_OFFLINE:
+        page_data = (
+            await asyncio.to_thread(http_cache.page, entry, EXTRACT_FIELDS)
+            if entry
+            else None
+        )
+        if page_data is None:
+            return failed_record(data, RETRYABLE, "Not in the HTTP cache")
+        return {"status": "success", "id": data.get("id"), "url": url, **page_data}
+    validators = {}
+    if entry and entry.replayable(EXTRACT_FIELDS):
+        validators = entry.validators()
+
+    while True:
+        headers = {
+            **HEADERS_TEMPLATE,
+            "User-Agent": random.choice(USER_AGENTS),
+            **validators,
         }
+        retry_after = None
+        host = host_of(url)
+        outcome = None
+        # Host slot first, so a throttled host does not hold a semaphore slot
+        await host_limiter.acquire(host)
+        try:
+            async with sem:
+                start = time.perf_counter()
+                async with session.get(
+                    url, headers=headers, timeout=REQUEST_TIMEOUT
+                ) as resp:
+                    ttfb = time.perf_counter() - start
+                    status = resp.status
+                    outcome = outcome_of_status(status)
+                    text = await resp.text(errors="ignore")
+                    elapsed = time.perf_counter() - start
+                    url_stats.record(url, status in [200, 201, 304], elapsed)
+                    metrics.observe("ttfb", ttfb)
+                    metrics.observe("body", elapsed - ttfb)
+                    metrics.response(host, status)
+                    metrics.received(host, resp.content.total_bytes)
+                    page_data = None
+                    if status == 304 and entry:
+                        # Unchanged since it was cached, nothing to parse
+                        page_data = await asyncio.to_thread(
+                            http_cache.page, entry, EXTRACT_FIELDS
+                        )
+                        if page_data is None:
+                            # Nothing to replay (body gone meanwhile), the retry
+                            # asks again without validators
+                            await asyncio.to_thread(http_cache.forget, url)
+                            entry, validators = None, {}
+                    elif status in [200, 201]:
+                        parse_start = time.perf_counter()
+                        page_data = extract_page(text, EXTRACT_FIELDS)
+                        metrics.observe("parse", time.perf_counter() - parse_start)
+                        if USE_HTTP_CACHE:
+                            await asyncio.to_thread(
+                                http_cache.store,
+                                url,
+                                text,
+                                headers=resp.headers,
+                                fields=EXTRACT_FIELDS,
+                                page_data=page_data,
+                            )
+                    if page_data is not None and is_parse_failure(
+                        page_data, EXTRACT_FIELDS
+                    ):
+                        return failed_record(data, PARSE, "No react_data found", status)
+                    if page_data is not None:
+                        return {
+                            "status": "success",
+                            "id": data.get("id"),
+                            "url": url,
+                            **page_data,
+                        }
+                    elif (
+                        status in [304, 403, 429, 500, 502, 503, 504]
+                        and retry_count < MAX_RETRIES
+                    ):
+                        if status in [429, 503]:
+                            retry_after = parse_retry_after(
+                                resp.headers.get("Retry-After")
+                            )
+                        reason = f"Status code {status}"
+                        kind, code = RETRYABLE, status
+                    else:
+                        return failed_record(
+                            data,
+                            kind_of_status(status),
+                            f"Status code {status}",
+                            status,
+                        )
+        except Exception as e:
+            outcome = ERROR
+            url_stats.record(url, False)
+            metrics.response(host, None)
+            if retry_count >= MAX_RETRIES:
+                return failed_record(data, kind_of_exception(e), str(e))
+            reason = str(e)
+            kind, code = kind_of_exception(e), None
+        finally:
+            host_limiter.release(host, outcome)
+
+        if retry_scheduler is not None:
+            return {
+                "status": "retry",
+                "data": data,
+                "retry_after": retry_after,
+                "reason": reason,
+                "kind": kind,
+                "code": code,
+            }
+        if not host_budget.take(host_of(url)):
+            return failed_record(
+                data, kind, f"Host retry budget exhausted after: {reason}", code
+            )
+        # Wait outside the semaphore, the slot goes to another request meanwhile
+        retry_count += 1
+        delay = retry_delay(retry_count, RETRY_BACKOFF_FACTOR, retry_after)
+        metrics.retry(host)
+        metrics.observe("backoff", delay)
+        await asyncio.sleep(delay)
 
 
-async def batch_crawl_from_url(data_batch):
+async def batch_crawl_from_url(data_batch, crawl_state=None):
     sem = asyncio.Semaphore(MAX_CONCURRENCY)
-    async with aiohttp.ClientSession() as session:
-        tasks = [fetch(session, sem, data) for data in data_batch]
+    async with aiohttp.ClientSession(
+        connector=make_connector(MAX_CONCURRENCY),
+        trace_configs=[aiohttp_trace_config(metrics), connection_reuse.trace_config()],
+    ) as session:
+        # Tasks pass the semaphore in creation order, the hosts taking turns
+        tasks = [fetch(session, sem, data) for data in interleave_by_host(data_batch)]
         results = await asyncio.gather(*tasks)
+    if crawl_state:
+        for r in results:
+            crawl_state.record(r)
     result = [r for r in results if r["status"] == "success"]
     faulty_package = [r for r in results if r["status"] != "success"]
     return result, faulty_package
 
 
-def load_batches(file_pool, batch_size):
-    from json_processing import streaming_json, batching_data
+# Keep `window` requests in flight on one session for the whole input: a new item
+# starts as soon as any request finishes, and every record is written when it
+# completes instead of at the end of a batch. Retries wait on a RetryScheduler,
+# not in a task, so a URL backing off does not hold one of the window's places.
+# Reading the input (ijson, crawl state queries) and writing the records (sink
+# writes, state commits with fsync) block, they run in a worker thread.
+async def stream_crawl(
+    items, result_path, faulty_path, window=MAX_CONCURRENCY, crawl_state=None
+):
+    sem = asyncio.Semaphore(window)
+    items = interleave_by_host(items)
+    success_count = 0
+    faulty_count = 0
+
+    async with aiohttp.ClientSession(
+        connector=make_connector(window),
+        trace_configs=[aiohttp_trace_config(metrics), connection_reuse.trace_config()],
+    ) as session:
+        with NdjsonSink(result_path) as result_sink, NdjsonSink(
+            faulty_path
+        ) as faulty_sink:
+            if crawl_state:
+                # State commits follow the two sinks to disk
+                crawl_state = CheckpointedState(crawl_state, [result_sink, faulty_sink])
+            # Up to MAX_RETRIES retries after the first attempt, as in fetch
+            retry_scheduler = RetryScheduler(
+                MAX_RETRIES + 1, RETRY_BACKOFF_FACTOR, host_budget, metrics
+            )
+
+            def start(data):
+                pending.add(
+                    asyncio.create_task(fetch(session, sem, data, 0, retry_scheduler))
+                )
+
+            def save(records):
+                for record in records:
+                    if record["status"] == "success":
+                        result_sink.write(record)
+                    else:
+                        faulty_sink.write(record)
+                    if crawl_state:
+                        crawl_state.record(record)
 
-    package = streaming_json(file_pool)
-    for batch in batching_data(package, batch_size):
-        yield batch
+            pending = set()
+            try:
+                while True:
+                    # Retries whose backoff is over go ahead of new items
+                    for data in retry_scheduler.pop_due():
+                        start(data)
+                    if len(pending) < window:
+                        for data in await asyncio.to_thread(
+                            lambda count: list(islice(items, count)),
+                            window - len(pending),
+                        ):
+                            start(data)
+                    if not pending:
+                        if not retry_scheduler:
+                            break
+                        await asyncio.sleep(retry_scheduler.next_delay())
+                        continue
+
+                    metrics.queue_depth("in_flight", len(pending))
+                    done, pending = await asyncio.wait(
+                        pending,
+                        timeout=retry_scheduler.next_delay(),
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    records = []
+                    for task in done:
+                        record = task.result()
+                        if record["status"] == "retry":
+                            data = record["data"]
+                            if retry_scheduler.schedule(
+                                data.get("url"), data, record["retry_after"]
+                            ):
+                                continue
+                            record = failed_record(
+                                data,
+                                record["kind"],
+                                f"Retries exhausted after: {record['reason']}",
+                                record["code"],
+                            )
+                        records.append(record)
+                    if not records:
+                        continue
+
+                    crawled = success_count + faulty_count
+                    await asyncio.to_thread(save, records)
+                    for record in records:
+                        if record["status"] == "success":
+                            success_count += 1
+                        else:
+                            faulty_count += 1
+                    if crawled // 1000 < (success_count + faulty_count) // 1000:
+                        print(
+                            f"Crawled {success_count + faulty_count} URLs, "
+                            f"success: {success_count}, faulty: {faulty_count}"
+                        )
+            finally:
+                if crawl_state:
+                    await asyncio.to_thread(crawl_state.commit)
+
+    return success_count, faulty_count
+
+
+# Re-drive runs (--redrive) go slower and wait longer between retries
+def use_redrive_settings():
+    global MAX_CONCURRENCY, MAX_RETRIES, RETRY_BACKOFF_FACTOR
+    MAX_CONCURRENCY = REDRIVE_WORKERS
+    MAX_RETRIES = REDRIVE_MAX_RETRIES
+    RETRY_BACKOFF_FACTOR = REDRIVE_BACKOFF_FACTOR
 
 
 def main():
     import time
+    from json_processing import streaming_json, batched
 
     file_pool = [
         "view_product_detail_L.json",
@@ -112,25 +353,84 @@ def main():
     name_pool = [file_path + file for file in file_pool]
     batch_num = 0
     batch_size = 1000
+    url_report = DedupReport()
 
-    for batch in load_batches(name_pool, batch_size):
-        batch_num += 1
-        start_time = time.perf_counter()
-        result, faulty_package = asyncio.run(batch_crawl_from_url(batch))
-        end_time = time.perf_counter()
-
-        if faulty_package:
-            print(f"Faulty URLs: {len(faulty_package)}")
-            with open(
-                f"faulty_package_{batch_num}.json", "w", encoding="utf-8"
-            ) as file:
-                json.dump(faulty_package, file, ensure_ascii=False, indent=4)
-        if result:
-            print(f"Data crawled success: {len(result)}")
-            with open(f"result_{batch_num}.json", "w", encoding="utf-8") as file:
-                json.dump(result, file, ensure_ascii=False, indent=4)
-
-        print(f"Processing time for this batch: {end_time - start_time} seconds.")
+    # Records are committed as they arrive, a rerun skips URLs already crawled
+    crawl_state = CrawlState()
+    if REDRIVE:
+        # Only URLs that failed with a retryable kind, at re-drive pace
+        use_redrive_settings()
+        seen = None
+        docs = crawl_state.failed_docs()
+    else:
+        seen = BloomFilter() if USE_SEEN_FILTER else None
+        docs = crawl_state.pending_docs(
+            dedup_docs(streaming_json(name_pool), url_report, seen), RECRAWL_TTL
+        )
+    metrics.start_exporter(METRICS_PATH)
+    try:
+        if STREAM_MODE:
+            start_time = time.perf_counter()
+            success_count, faulty_count = asyncio.run(
+                stream_crawl(
+                    docs,
+                    "result.jsonl",
+                    "faulty_package.jsonl",
+                    window=MAX_CONCURRENCY,
+                    crawl_state=crawl_state,
+                )
+            )
+            end_time = time.perf_counter()
+            print(f"Data crawled success: {success_count}, faulty URLs: {faulty_count}")
+            print(url_report.summary())
+            print(f"Processing time: {end_time - start_time} seconds.")
+            print(host_limiter.controller.report())
+            print(connection_reuse.report())
+            url_stats.save()
+            if seen is not None:
+                print(seen.summary())
+            return
+
+        with NdjsonSink("result.jsonl") as result_sink, NdjsonSink(
+            "faulty_package.jsonl"
+        ) as faulty_sink:
+            state_writer = CheckpointedState(crawl_state, [result_sink, faulty_sink])
+            try:
+                for batch in batched(docs, batch_size):
+                    batch_num += 1
+                    start_time = time.perf_counter()
+                    result, faulty_package = asyncio.run(batch_crawl_from_url(batch))
+                    end_time = time.perf_counter()
+
+                    faulty_sink.write_many(faulty_package)
+                    result_sink.write_many(result)
+                    for record in result + faulty_package:
+                        state_writer.record(record)
+                    print(f"Batch {batch_num} faulty URLs: {len(faulty_package)}")
+                    print(f"Data crawled success: {len(result)}")
+
+                    print(
+                        f"Processing time for this batch: {end_time - start_time} seconds."
+                    )
+                    print(host_limiter.controller.report())
+                    print(connection_reuse.report())
+                    url_stats.save()
+            finally:
+                state_writer.commit()
+    except KeyboardInterrupt:
+        print("Interrupted, finished URLs are kept in the crawl state.")
+        return
+    finally:
+        print(crawl_state.summary())
+        print(crawl_state.failure_summary())
+        crawl_state.close()
+        metrics.export(METRICS_PATH)
+        if USE_HTTP_CACHE or CACHE_OFFLINE:
+            print(http_cache.summary())
+            http_cache.close()
+    print(url_report.summary())
+    if seen is not None:
+        print(seen.summary())
 
 
 if __name__ == "__main__":
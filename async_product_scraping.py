@@ -0,0 +1,413 @@
+import asyncio
+import aiohttp
+import codecs
+import logging
+import random
+import time
+from collections import deque
+from page_extract import PageScanner
+from crawl_runtime import (
+    REQUEST_TIMEOUT,
+    MAX_RETRIES,
+    RETRY_BACKOFF_FACTOR,
+    STREAM_CHUNK_SIZE,
+    DRAIN_MAX_BYTES,
+    HEDGE_INITIAL,
+    HEDGE_MAX_IN_FLIGHT,
+    HEDGE_PERCENTILE,
+    HEDGE_MIN_DELAY,
+    EXTRACT_FIELDS,
+    extract_page_data,
+    latency_tracker,
+    hedge_stats,
+    host_budget,
+    host_controller,
+    url_stats,
+    metrics,
+    http_cache,
+    USE_HTTP_CACHE,
+    CACHE_OFFLINE,
+)
+from retry_scheduler import RetryScheduler, parse_retry_after, host_of
+from host_control import AsyncHostLimiter, outcome_of_status, ERROR
+from product_record import ProductRecord
+from metrics import aiohttp_trace_config
+from transport import make_connector, ConnectionReuse
+from failures import (
+    failure,
+    kind_of_status,
+    kind_of_exception,
+    is_parse_failure,
+    RETRYABLE,
+    PARSE,
+    CANCELLED,
+)
+
+MAX_CONNECTIONS = 200  # Open connections shared by every product
+MAX_PRODUCTS_IN_FLIGHT = 100  # Số sản phẩm được crawl song song
+host_limiter = AsyncHostLimiter(host_controller)
+
+##''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+# asyncio version of main.product_scraping/request_data: same hedged racing,
+# same result and faulty records, but losing URLs are cancelled for real.
+
+
+async def product_scraping(session, id_url, headers_template=None, user_agents=None):
+    result = None
+    faulty_package = []
+    task_to_url = {}
+    requests_sent = 0
+    hedges = 0
+
+    # Candidate queue of (url, retry_count, previous user agent), best history first
+    candidates = deque()
+    for id, url_list in id_url.items():
+        candidates.extend((url, 0, None) for url in url_stats.rank(url_list))
+
+    def launch(count):
+        nonlocal requests_sent
+        launched = 0
+        while candidates and launched < count:
+            url, retry_count, prev_user_agent = candidates.popleft()
+            available_agents = [ua for ua in user_agents if ua != prev_user_agent]
+            if not available_agents:
+                available_agents = user_agents  # fallback if all are used
+            headers = {
+                **headers_template,
+                "User-Agent": random.choice(available_agents),
+            }
+            task = asyncio.create_task(request_data(session, url, headers, retry_count))
+            task_to_url[task] = url
+            requests_sent += 1
+            launched += 1
+        return launched
+
+    initial = HEDGE_INITIAL if HEDGE_INITIAL else len(candidates)
+    retry_scheduler = RetryScheduler(
+        MAX_RETRIES, RETRY_BACKOFF_FACTOR, host_budget, metrics
+    )
+
+    try:
+        while (task_to_url or candidates or retry_scheduler) and result is None:
+            # Retries whose backoff is over join the back of the candidate queue
+            candidates.extend(retry_scheduler.pop_due())
+            launch(initial - len(task_to_url))
+
+            if not task_to_url:
+                # Nothing in flight, only retries waiting for their due time
+                await asyncio.sleep(retry_scheduler.next_delay())
+                continue
+
+            hedge_delay = None
+            if HEDGE_INITIAL:
+                hedge_delay = latency_tracker.percentile(HEDGE_PERCENTILE)
+                hedge_delay = min(max(hedge_delay, HEDGE_MIN_DELAY), REQUEST_TIMEOUT)
+            timeout = hedge_delay or REQUEST_TIMEOUT
+            retry_due = retry_scheduler.next_delay()
+            if retry_due is not None and retry_due < timeout:
+                timeout = retry_due
+                hedge_delay = None
+            done_tasks, _ = await asyncio.wait(
+                task_to_url, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not done_tasks:
+                # Every in-flight URL is slower than the latency percentile,
+                # race one more candidate next to them
+                if hedge_delay and len(task_to_url) < HEDGE_MAX_IN_FLIGHT:
+                    candidates.extend(retry_scheduler.pop_due())
+                    hedges += launch(1)
+                continue
+
+            for task in done_tasks:
+                url = task_to_url.pop(task)
+                try:
+                    product_data = task.result()
+                except Exception as e:
+                    logging.error(f"Error processing: {e}")
+                    faulty_package.append(
+                        failure(url, kind_of_exception(e), reason=str(e))
+                    )
+                    continue
+
+                if "success" in product_data:
+                    result = product_data["success"]
+                    logging.info(
+                        f"Successfully added to result: {url}",
+                        extra={"category": "result", "url": url},
+                    )
+                    break
+
+                elif "retry" in product_data:
+                    data_to_retry = product_data.get("retry")
+                    retry_item = (
+                        data_to_retry,
+                        product_data.get("retry_count"),
+                        product_data["ua"],
+                    )
+                    if not retry_scheduler.schedule(
+                        data_to_retry, retry_item, product_data.get("retry_after")
+                    ):
+                        faulty_package.append(
+                            failure(
+                                data_to_retry,
+                                product_data.get("kind", RETRYABLE),
+                                product_data.get("status"),
+                                "Max retries reached",
+                            )
+                        )
+                        logging.warning(
+                            f"Max retries reached for {data_to_retry}",
+                            extra={"category": "max_retries", "url": data_to_retry},
+                        )
+                else:
+                    faulty_package.append(
+                        product_data.get("failed") or failure(url, CANCELLED)
+                    )
+                    logging.warning(
+                        f"Faulty result for id {id}: {product_data}",
+                        extra={"category": "faulty"},
+                    )
+    finally:
+        # First success wins: the other URLs of this product stop mid-request
+        for task in task_to_url:
+            task.cancel()
+
+    hedge_stats.record_product(requests_sent, hedges, result is not None)
+    return result, faulty_package
+
+
+async def request_data(session, url, headers, retry_count=0):
+    # SQLite, file I/O and (de)compression of the cache run in a worker
+    # thread, off the event loop
+    entry = (
+        await asyncio.to_thread(http_cache.lookup, url)
+        if USE_HTTP_CACHE or CACHE_OFFLINE
+        else None
+    )
+    if CACHE_OFFLINE:
+        page_data = (
+            await asyncio.to_thread(http_cache.page, entry, EXTRACT_FIELDS)
+            if entry
+            else None
+        )
+        if page_data is None:
+            return {"failed": failure(url, RETRYABLE, reason="Not in the HTTP cache")}
+        return {"success": ProductRecord.from_page(url, page_data)}
+    if entry and entry.replayable(EXTRACT_FIELDS):
+        headers = {**headers, **entry.validators()}
+
+    # Wait for a slot on this URL's host, the limit follows 403/429 feedback
+    host = host_of(url)
+    await host_limiter.acquire(host)
+    outcome = None
+    try:
+        start = time.perf_counter()
+        async with session.get(
+            url,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        ) as response:
+            ttfb = time.perf_counter() - start
+            metrics.observe("ttfb", ttfb)
+            metrics.response(host, response.status)
+            outcome = outcome_of_status(response.status)
+            if response.status == 304:
+                # Unchanged since it was cached: no body to read, nothing to parse
+                elapsed = time.perf_counter() - start
+                latency_tracker.record(elapsed)
+                url_stats.record(url, True, elapsed)
+                page_data = (
+                    await asyncio.to_thread(http_cache.page, entry, EXTRACT_FIELDS)
+                    if entry
+                    else None
+                )
+                if page_data is None:
+                    # Nothing to replay (body gone meanwhile): the retry asks
+                    # again without validators, a re-drive picks it up after
+                    await asyncio.to_thread(http_cache.forget, url)
+                    logging.warning(
+                        f"Nothing cached to answer 304 for {url}",
+                        extra={"category": "retryable", "host": host, "status": 304},
+                    )
+                    return {
+                        "retry": url,
+                        "ua": headers["User-Agent"],
+                        "retry_count": retry_count + 1,
+                        "status": 304,
+                        "kind": RETRYABLE,
+                    }
+                if is_parse_failure(page_data, EXTRACT_FIELDS):
+                    return {"failed": failure(url, PARSE, 304, "No react_data found")}
+                return {"success": ProductRecord.from_page(url, page_data)}
+
+            if response.status in [200, 201]:
+                html_text, complete = await read_until_extracted(response)
+                elapsed = time.perf_counter() - start
+                latency_tracker.record(elapsed)
+                url_stats.record(url, True, elapsed)
+                metrics.observe("body", elapsed - ttfb)
+                if not complete:
+                    await drain(response)  # After the timings, it is not page latency
+                metrics.received(host, response.content.total_bytes)
+
+                logging.info(
+                    f"Successed: {url}",
+                    extra={"category": "success", "host": host, "url": url},
+                )
+                parse_start = time.perf_counter()
+                page_data = extract_page_data(html_text)
+                metrics.observe("parse", time.perf_counter() - parse_start)
+                if USE_HTTP_CACHE:
+                    await asyncio.to_thread(
+                        http_cache.store,
+                        url,
+                        html_text,
+                        headers=response.headers,
+                        fields=EXTRACT_FIELDS,
+                        page_data=page_data,
+                        complete=complete,
+                    )
+                if is_parse_failure(page_data, EXTRACT_FIELDS):
+                    logging.warning(
+                        f"No react_data found: {url}",
+                        extra={"category": "no_react_data", "url": url},
+                    )
+                    return {
+                        "failed": failure(
+                            url, PARSE, response.status, "No react_data found"
+                        )
+                    }
+                product_data = ProductRecord.from_page(url, page_data)
+                return {
+                    "success": product_data,
+                }
+
+            elapsed = time.perf_counter() - start
+            latency_tracker.record(elapsed)
+            url_stats.record(url, False, elapsed)
+            if response.status in [403, 429, 500, 502, 503, 504]:
+                logging.warning(
+                    f"Retryable error {response.status} for {url}",
+                    extra={
+                        "category": "retryable",
+                        "host": host,
+                        "status": response.status,
+                    },
+                )
+                retry_after = None
+                if response.status in [429, 503]:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                return {
+                    "retry": url,
+                    "ua": headers["User-Agent"],
+                    "retry_count": retry_count + 1,
+                    "retry_after": retry_after,
+                    "status": response.status,
+                    "kind": RETRYABLE,
+                }
+            else:
+                logging.error(
+                    f"Non-retryable error {response.status} for {url}",
+                    extra={
+                        "category": "http_error",
+                        "host": host,
+                        "status": response.status,
+                    },
+                )
+                return {
+                    "failed": failure(
+                        url,
+                        kind_of_status(response.status),
+                        response.status,
+                        f"Status code {response.status}",
+                    )
+                }
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        outcome = ERROR
+        logging.error(
+            f"Exception occurred: {e}.",
+            extra={
+                "category": "exception",
+                "host": host_of(url),
+                "status": type(e).__name__,
+            },
+        )
+        url_stats.record(url, False)
+        metrics.response(host, None)
+        return {
+            "retry": url,
+            "ua": headers["User-Agent"],
+            "retry_count": retry_count + 1,
+            "kind": kind_of_exception(e),
+        }
+    finally:
+        host_limiter.release(host, outcome)
+
+
+# Stop reading the body as soon as everything in EXTRACT_FIELDS has arrived,
+# the flag says whether it was read to the end
+async def read_until_extracted(response):
+    decoder = codecs.getincrementaldecoder(response.charset or "utf-8")(
+        errors="replace"
+    )
+    text = ""
+    scanner = PageScanner(EXTRACT_FIELDS)
+
+    async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+        text += decoder.decode(chunk)
+        if scanner.feed(text):
+            return text, False
+
+    return text + decoder.decode(b"", final=True), True
+
+
+# Read and discard a short rest of a cut-off body, so the connection goes back
+# to the pool instead of being closed, see drain() in main.py. aiohttp counts
+# decoded bytes, so no Content-Length check up front, only the cap.
+async def drain(response):
+    start = response.content.total_bytes
+    async for _ in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+        if response.content.total_bytes - start > DRAIN_MAX_BYTES:
+            return False
+    return True
+
+
+# Keep up to MAX_PRODUCTS_IN_FLIGHT products racing on one session and call
+# on_result(product_id, result, faulty_package) as each product finishes. The
+# input stream (ijson, crawl state queries) and on_result (sink writes, state
+# commits with fsync) are blocking, they run in a worker thread one at a time.
+async def scrape_products(
+    id_url_stream, headers_template=None, user_agents=None, on_result=None
+):
+    connection_reuse = ConnectionReuse()
+    async with aiohttp.ClientSession(
+        connector=make_connector(MAX_CONNECTIONS),
+        trace_configs=[aiohttp_trace_config(metrics), connection_reuse.trace_config()],
+    ) as session:
+        in_flight = {}  # task -> product id
+        id_url_stream = iter(id_url_stream)
+        while True:
+            id_url = await asyncio.to_thread(next, id_url_stream, None)
+            if id_url is None:
+                break
+            task = asyncio.create_task(
+                product_scraping(session, id_url, headers_template, user_agents)
+            )
+            in_flight[task] = next(iter(id_url), None)
+            metrics.queue_depth("products_in_flight", len(in_flight))
+            while len(in_flight) >= MAX_PRODUCTS_IN_FLIGHT:
+                done, _ = await asyncio.wait(
+                    in_flight, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    await asyncio.to_thread(
+                        on_result, in_flight.pop(task), *task.result()
+                    )
+
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                await asyncio.to_thread(on_result, in_flight.pop(task), *task.result())
+
+    logging.info(f"Connection reuse:\n{connection_reuse.report()}")
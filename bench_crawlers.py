@@ -0,0 +1,307 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from mock_glamira import MockGlamira, MOCK_HOSTS, MOCK_PORT
+
+try:
+    import resource  # Not on Windows, peak RSS is reported as None there
+except ImportError:
+    resource = None
+
+BENCH_PRODUCTS = 200  # Products for main.py (both engines), one URL per host each
+BENCH_URLS = 600  # URLs for crawl_glamira.py / async_crawl_glamira.py
+MISSING_SHARE = 0.05  # URLs that answer 404
+# Runs of every crawler: (concurrency, request timeout). Concurrency is
+# MAX_WORKERS for the threaded crawlers, MAX_CONNECTIONS for main.py's async
+# engine and MAX_CONCURRENCY for async_crawl_glamira.
+SWEEP = [(5, 8), (10, 6), (20, 6), (40, 3)]
+CRAWLERS = ["main", "main_async", "crawl_glamira", "async_crawl_glamira"]
+BENCH_OUTPUT = "bench_crawlers.json"
+HEADERS = {"Accept": "text/html", "Accept-Language": "en-US,en;q=0.9"}
+USER_AGENTS = ["Mozilla/5.0 (X11; Linux x86_64; rv:124.0) Gecko/20100101 Firefox/124.0"]
+
+##-----------------------------------------------------------------------------------
+
+
+def product_urls(server, product_id):
+    urls = []
+    for index in range(len(MOCK_HOSTS)):
+        path = f"/product-{product_id}.html"
+        if random.random() < MISSING_SHARE:
+            path = f"/missing-{product_id}.html"
+        urls.append(server.url(index, path))
+    return urls
+
+
+# Same inputs for every run: {id: [urls]} products for main.py and {id, url}
+# docs for the two URL crawlers
+def make_inputs(server, seed=0):
+    random.seed(seed)
+    products = [
+        {str(product_id): product_urls(server, product_id)}
+        for product_id in range(BENCH_PRODUCTS)
+    ]
+    docs = []
+    while len(docs) < BENCH_URLS:
+        product_id = len(docs)
+        url = random.choice(product_urls(server, product_id))
+        docs.append({"id": str(product_id), "url": url})
+    return products, docs
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(share * len(values)), len(values) - 1)]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+##-----------------------------------------------------------------------------------
+
+
+# Client-side timing of every HTTP request the crawler sends, until the response
+# headers are in. Patched on the session classes so no crawler code changes.
+def time_requests(latencies):
+    import requests
+
+    send = requests.Session.request
+
+    def timed_request(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send(self, *args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    requests.Session.request = timed_request
+
+    try:
+        import aiohttp
+    except ImportError:
+        return
+    async_send = aiohttp.ClientSession._request
+
+    async def timed_async_request(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await async_send(self, *args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    aiohttp.ClientSession._request = timed_async_request
+
+
+def run_main(inputs, concurrency, timeout):
+    import main
+
+    main.MAX_WORKERS = concurrency
+    main.REQUEST_TIMEOUT = timeout
+    success = 0
+    for product_id, result, faulty_package in main.scrape_products(
+        iter(inputs["products"]), HEADERS, USER_AGENTS
+    ):
+        success += result is not None
+    return success, len(inputs["products"]), main.hedge_stats.products
+
+
+# ENGINE = "async" the way `python main.py` runs it: main.py executed as the
+# entry script, not importable as `main`, and the products counted again from
+# the entry script's own hedge stats, the ones main() reports
+def run_main_async(inputs, concurrency, timeout):
+    import asyncio
+    import runpy
+
+    entry = runpy.run_path(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+        run_name="bench_main",
+    )
+    import async_product_scraping
+
+    async_product_scraping.MAX_CONNECTIONS = concurrency
+    async_product_scraping.REQUEST_TIMEOUT = timeout
+    success = 0
+
+    def collect(product_id, result, faulty_package):
+        nonlocal success
+        success += result is not None
+
+    asyncio.run(
+        async_product_scraping.scrape_products(
+            iter(inputs["products"]), HEADERS, USER_AGENTS, collect
+        )
+    )
+    return success, len(inputs["products"]), entry["hedge_stats"].products
+
+
+def run_crawl_glamira(inputs, concurrency, timeout):
+    import crawl_glamira
+    from sink import NdjsonSink
+
+    crawl_glamira.MAX_WORKERS = concurrency
+    crawl_glamira.REQUEST_TIMEOUT = timeout
+    with NdjsonSink("result.jsonl") as result_sink, NdjsonSink(
+        "faulty_package.jsonl"
+    ) as faulty_sink:
+        crawl_glamira.batch_crawl_from_url(
+            inputs["docs"],
+            HEADERS,
+            USER_AGENTS,
+            result_sink=result_sink,
+            faulty_sink=faulty_sink,
+        )
+    return result_sink.count, len(inputs["docs"]), None
+
+
+def run_async_crawl_glamira(inputs, concurrency, timeout):
+    import asyncio
+    import async_crawl_glamira
+
+    async_crawl_glamira.MAX_CONCURRENCY = concurrency
+    async_crawl_glamira.REQUEST_TIMEOUT = timeout
+    success, faulty = asyncio.run(
+        async_crawl_glamira.stream_crawl(
+            inputs["docs"], "result.jsonl", "faulty_package.jsonl", window=concurrency
+        )
+    )
+    return success, len(inputs["docs"]), None
+
+
+RUNNERS = {
+    "main": run_main,
+    "main_async": run_main_async,
+    "crawl_glamira": run_crawl_glamira,
+    "async_crawl_glamira": run_async_crawl_glamira,
+}
+
+
+# One benchmark run inside a fresh process (own peak RSS, own module-level
+# host/url state), started with its work directory as cwd. Prints the
+# measurements as JSON on the last line.
+def child(crawler, concurrency, timeout, inputs_path):
+    with open(inputs_path, "r", encoding="utf-8") as file:
+        inputs = json.load(file)
+    latencies = []
+    time_requests(latencies)
+
+    start = time.perf_counter()
+    success, items, reported = RUNNERS[crawler](inputs, concurrency, timeout)
+    elapsed = time.perf_counter() - start
+
+    p50 = percentile(latencies, 0.5)
+    p99 = percentile(latencies, 0.99)
+    print(
+        json.dumps(
+            {
+                "crawler": crawler,
+                "concurrency": concurrency,
+                "timeout": timeout,
+                "items": items,
+                "success": success,
+                "reported_products": reported,
+                "requests": len(latencies),
+                "seconds": elapsed,
+                "throughput": success / elapsed if elapsed else None,
+                "p50_ms": p50 * 1000 if p50 is not None else None,
+                "p99_ms": p99 * 1000 if p99 is not None else None,
+                "requests_per_success": len(latencies) / success if success else None,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        )
+    )
+
+
+def run(crawler, concurrency, timeout, inputs_path):
+    repo = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = {**os.environ, "PYTHONPATH": repo}
+        completed = subprocess.run(
+            [
+                sys.executable,
+                os.path.join(repo, "bench_crawlers.py"),
+                "--child",
+                crawler,
+                str(concurrency),
+                str(timeout),
+                inputs_path,
+            ],
+            cwd=work_dir,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        print(completed.stderr[-2000:])
+        return None
+    return json.loads(lines[-1])
+
+
+def show(value, digits=1):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+##-----------------------------------------------------------------------------------
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        crawler, concurrency, timeout, inputs_path = sys.argv[2:6]
+        child(crawler, int(concurrency), float(timeout), inputs_path)
+        return
+
+    crawlers = sys.argv[1:] or CRAWLERS
+    server = MockGlamira(MOCK_PORT)
+    server.start()
+    products, docs = make_inputs(server)
+
+    results = []
+    with tempfile.TemporaryDirectory() as input_dir:
+        inputs_path = os.path.join(input_dir, "inputs.json")
+        with open(inputs_path, "w", encoding="utf-8") as file:
+            json.dump({"products": products, "docs": docs}, file)
+
+        print(
+            f"{'crawler':<20} {'conc':>5} {'timeout':>8} {'ok/items':>10} "
+            f"{'ok/s':>7} {'p50 ms':>8} {'p99 ms':>8} {'req/ok':>7} {'RSS MB':>7}"
+        )
+        for crawler in crawlers:
+            for concurrency, timeout in SWEEP:
+                result = run(crawler, concurrency, timeout, inputs_path)
+                if result is None:
+                    print(f"{crawler:<20} {concurrency:>5} {timeout:>8} failed")
+                    continue
+                results.append(result)
+                print(
+                    f"{crawler:<20} {concurrency:>5} {timeout:>8} "
+                    f"{str(result['success']) + '/' + str(result['items']):>10} "
+                    f"{show(result['throughput']):>7} {show(result['p50_ms']):>8} "
+                    f"{show(result['p99_ms']):>8} "
+                    f"{show(result['requests_per_success'], 2):>7} "
+                    f"{show(result['peak_rss_mb']):>7}"
+                )
+                reported = result["reported_products"]
+                if reported is not None and reported != result["items"]:
+                    # The crawler's reports would not match what it crawled
+                    print(f"    stats of the entry script saw {reported} products")
+
+    server.shutdown()
+    for (host, status), count in sorted(server.counts.items()):
+        print(f"{host:<16} {status}: {count}")
+    with open(BENCH_OUTPUT, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results saved to {BENCH_OUTPUT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from parse_pool import ParsePipeline, parse_title, parse_react_data
+from bench_react_data import HTML_GLOB, load_pages
+from react_data import keys_map
+
+THREADS = 10  # Same as crawl_glamira.MAX_WORKERS
+PAGES = 100  # Pages parsed per run, fixtures are repeated to reach it
+
+##-----------------------------------------------------------------------------------
+
+
+def parse_page(content):
+    return parse_title(content), parse_react_data(content, "utf-8", keys_map)
+
+
+# Every fetch thread parses its own page, like souping_data/request_data today
+def run_in_threads(pages):
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        return list(executor.map(parse_page, pages))
+
+
+# Fetch threads hand the page to the process pool and wait for the result
+def run_in_pipeline(pages, workers):
+    with ParsePipeline(workers=workers, queue_size=workers * 4) as pipeline:
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            return list(
+                executor.map(lambda content: pipeline.parse(parse_page, content), pages)
+            )
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+##-----------------------------------------------------------------------------------
+
+
+def main():
+    pattern = sys.argv[1] if len(sys.argv) > 1 else HTML_GLOB
+    fixtures = [text.encode("utf-8") for text in load_pages(pattern).values()]
+    pages = [fixtures[i % len(fixtures)] for i in range(PAGES)]
+    cores = os.cpu_count() or 1
+
+    elapsed = timed(run_in_threads, pages)
+    print(f"{THREADS} threads, no pool: {len(pages) / elapsed:8.1f} pages/s")
+
+    workers = 1
+    while True:
+        elapsed = timed(run_in_pipeline, pages, workers)
+        print(
+            f"{THREADS} threads, {workers:>2} parse processes: "
+            f"{len(pages) / elapsed:8.1f} pages/s"
+        )
+        if workers >= cores:
+            break
+        workers = min(workers * 2, cores)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import glob
+import json
+import re
+import sys
+import timeit
+from react_data import keys_map, extract_fields
+
+HTML_GLOB = "html\\*.html"  # Pages saved by souping_data (see crawl_glamira.py)
+REPEAT = 5
+
+##-----------------------------------------------------------------------------------
+
+
+# The regex extractor main.py used before react_data.py, kept as the baseline
+def legacy_extract_react_data(html_text):
+    match = re.search(r"var\s+react_data\s*=\s*(\{.*?\});", html_text, re.DOTALL)
+    if match:
+        json_text = match.group(1)
+        try:
+            data = json.loads(json_text)
+        except Exception:
+            json_text = json_text.replace("'", '"')
+            json_text = re.sub(r",\s*}", "}", json_text)
+            json_text = re.sub(r",\s*]", "]", json_text)
+            data = json.loads(json_text)
+        return data
+    return None
+
+
+# Fallback fixtures shaped like glamira product pages when no saved HTML exists
+def synthetic_pages():
+    react_data = {
+        "product_id": 110474,
+        "name": "Men's Pendant Viktor",
+        "sku": "Men-Viktor",
+        "price": "177.000000",
+        "gold_weight": "0.3978",
+        "collection": "symbols",
+        "options": [
+            {"label": f"alloy-{i}", "price": f"{i}.000000"} for i in range(300)
+        ],
+        "gender": "male",
+    }
+    padding = "<div class='row'><span>glamira</span></div>" * 3000
+    title = (
+        '<h1 class="page-title product">\n <span>Men&#039;s Pendant Viktor</span> </h1>'
+    )
+    body = json.dumps(react_data)
+    return {
+        "synthetic_plain": f"<html>{padding}<script>var react_data = {body};</script>{title}{padding}</html>",
+        "synthetic_trailing_comma": f"<script>var react_data = {body[:-1]},}};</script>{padding}",
+        "synthetic_brace_in_string": f'<script>var react_data = {{"note": "}};", {body[1:]};</script>{padding}',
+        "synthetic_no_react_data": f"<html>{padding}{padding}</html>",
+    }
+
+
+def load_pages(pattern):
+    pages = {}
+    for file_name in glob.glob(pattern):
+        with open(file_name, "r", encoding="utf-8", errors="replace") as file:
+            pages[file_name] = file.read()
+    return pages or synthetic_pages()
+
+
+def run_safely(function, html_text):
+    try:
+        return function(html_text)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def time_call(function, html_text):
+    timer = timeit.Timer(lambda: run_safely(function, html_text))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=REPEAT, number=number)) / number
+
+
+##-----------------------------------------------------------------------------------
+
+
+def main():
+    pattern = sys.argv[1] if len(sys.argv) > 1 else HTML_GLOB
+    pages = load_pages(pattern)
+
+    total_legacy = 0
+    total_new = 0
+    mismatches = 0
+    print(f"{'page':<40} {'size':>9} {'regex ms':>10} {'scan ms':>10} {'same':>6}")
+    for name, html_text in pages.items():
+        legacy = run_safely(legacy_extract_react_data, html_text)
+        if isinstance(legacy, dict) and "error" not in legacy:
+            legacy = {key: value for key, value in legacy.items() if key in keys_map}
+        new = run_safely(lambda text: extract_fields(text, keys_map), html_text)
+        same = legacy == new
+        mismatches += not same
+
+        legacy_time = time_call(legacy_extract_react_data, html_text)
+        new_time = time_call(lambda text: extract_fields(text, keys_map), html_text)
+        total_legacy += legacy_time
+        total_new += new_time
+        print(
+            f"{name[-40:]:<40} {len(html_text):>9} {legacy_time * 1000:>10.3f} "
+            f"{new_time * 1000:>10.3f} {str(same):>6}"
+        )
+        if not same:
+            print(f"    regex: {str(legacy)[:150]}")
+            print(f"    scan:  {str(new)[:150]}")
+
+    print(
+        f"Pages: {len(pages)}, different results: {mismatches}, "
+        f"regex total: {total_legacy * 1000:.3f} ms, scan total: {total_new * 1000:.3f} ms, "
+        f"speedup: {total_legacy / total_new:.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import sys
+import timeit
+import tracemalloc
+from title_parser import BACKENDS
+from bench_react_data import HTML_GLOB, load_pages
+
+REPEAT = 3
+
+##-----------------------------------------------------------------------------------
+
+
+def time_backend(function, text):
+    timer = timeit.Timer(lambda: function(text))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=REPEAT, number=number)) / number
+
+
+# Peak memory allocated while parsing one page. tracemalloc only sees Python
+# allocations, libxml2 memory used by the lxml backends is not counted.
+def memory_backend(function, text):
+    tracemalloc.start()
+    try:
+        function(text)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+##-----------------------------------------------------------------------------------
+
+
+def main():
+    pattern = sys.argv[1] if len(sys.argv) > 1 else HTML_GLOB
+    pages = load_pages(pattern)
+
+    print(
+        f"{'backend':<10} {'avg ms/page':>12} {'avg peak KiB':>13} {'same as bs4':>12}"
+    )
+    reference = {name: BACKENDS["bs4"](text) for name, text in pages.items()}
+    for backend, function in BACKENDS.items():
+        total_time = 0
+        total_peak = 0
+        same = 0
+        for name, text in pages.items():
+            total_time += time_backend(function, text)
+            total_peak += memory_backend(function, text)
+            same += function(text) == reference[name]
+        print(
+            f"{backend:<10} {total_time / len(pages) * 1000:>12.3f} "
+            f"{total_peak / len(pages) / 1024:>13.1f} {same:>6}/{len(pages)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import hashlib
+import math
+
+SEEN_FILTER_CAPACITY = 50_000_000  # URLs the filter is sized for (~90 MB at 0.1%)
+SEEN_FILTER_FP_RATE = 0.001  # Share of new URLs wrongly reported as already seen
+
+##-----------------------------------------------------------------------------------
+
+
+# Fixed-size set of seen URLs: `url in seen` may answer True for a URL never
+# added (at most fp_rate of the time, while under capacity) but never False
+# for one that was. Supports the same `in`/add() as a set, so dedup_docs can
+# take it as its `seen` argument. Every True answer is counted as a skip, with
+# a running estimate of how many of them were false positives.
+class BloomFilter:
+    def __init__(self, capacity=SEEN_FILTER_CAPACITY, fp_rate=SEEN_FILTER_FP_RATE):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.num_bits = max(int(-capacity * math.log(fp_rate) / math.log(2) ** 2), 8)
+        self.num_hashes = max(round(self.num_bits / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self.skipped = 0  # Lookups answered True
+        self.expected_false = 0.0  # Sum of the fp rate over lookups of new URLs
+
+    # Double hashing: k bit positions out of one 128-bit blake2b digest
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        new = False
+        for position in self.positions(item):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & mask:
+                self.bits[byte] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, item):
+        bits = self.bits
+        found = all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(item)
+        )
+        if found:
+            self.skipped += 1
+        else:
+            self.expected_false += self.current_fp_rate()
+        return found
+
+    def __len__(self):
+        return self.count
+
+    # False-positive rate for the current fill, grows past fp_rate over capacity
+    def current_fp_rate(self):
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** (
+            self.num_hashes
+        )
+
+    def summary(self):
+        summary = (
+            f"Seen filter: {self.count} URLs, {len(self.bits) / 1024**2:.1f} MB, "
+            f"false-positive rate {self.current_fp_rate():.5f}, "
+            f"skipped as seen: {self.skipped} "
+            f"(~{self.expected_false:.0f} of them possibly never seen)"
+        )
+        if self.count > self.capacity:
+            summary += f" (over capacity {self.capacity})"
+        return summary
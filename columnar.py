@@ -0,0 +1,153 @@
+import glob
+import os
+import time
+import uuid
+from product_record import FIELDS, FIELD_TYPES
+
+try:
+    import pyarrow as pa  # Optional, only needed for the columnar outputs
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+COLUMNAR_BATCH_SIZE = 10_000  # Records per row group / record batch
+COLUMNAR_PART_ROWS = 50_000  # Records per part file before the next one starts
+SUFFIXES = {"parquet": ".parquet", "arrow": ".arrow"}
+
+##-----------------------------------------------------------------------------------
+
+
+def product_schema():
+    types = {int: pa.int64(), float: pa.float64(), str: pa.string()}
+    return pa.schema([(field, types[FIELD_TYPES[field]]) for field in FIELDS])
+
+
+# Batched columnar writer for ProductRecord: records are buffered per column and
+# written as one Parquet row group / Arrow IPC record batch every `batch_size`.
+# Output goes to part files in `directory`, part-<run id>-<n>.parquet, so a
+# resumed run adds its products next to the earlier ones instead of truncating
+# them. A part is closed every `part_rows` records, and only a closed part is
+# readable after a kill: pending() counts the records not in one yet, and
+# checkpoint() closes the current part early (end of the run).
+class ColumnarWriter:
+    def __init__(
+        self,
+        directory,
+        format="parquet",
+        batch_size=COLUMNAR_BATCH_SIZE,
+        part_rows=COLUMNAR_PART_ROWS,
+    ):
+        if pa is None:
+            raise ValueError("Columnar output needs the pyarrow package")
+        if format not in SUFFIXES:
+            raise ValueError(f"Unknown columnar format: {format}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.format = format
+        self.batch_size = batch_size
+        self.part_rows = part_rows
+        self.schema = product_schema()
+        self.columns = {field: [] for field in FIELDS}
+        self.count = 0
+        # Start time orders the runs, the random suffix keeps two runs started
+        # in the same second apart
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.part = 0
+        self.part_count = 0  # Records written to the open part
+        self.writer = None  # Opened on the first batch of each part
+
+    def open_part(self):
+        self.part += 1
+        path = os.path.join(
+            self.directory,
+            f"part-{self.run_id}-{self.part:05d}{SUFFIXES[self.format]}",
+        )
+        if os.path.exists(path):
+            raise ValueError(f"{path} already exists")
+        if self.format == "parquet":
+            return pq.ParquetWriter(path, self.schema, compression="zstd")
+        return ipc.new_file(path, self.schema)
+
+    def write(self, record):
+        for field, column in self.columns.items():
+            column.append(getattr(record, field))
+        self.count += 1
+        if len(self.columns["url"]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.columns["url"]:
+            return
+        batch = pa.record_batch(
+            [self.columns[field] for field in FIELDS], schema=self.schema
+        )
+        if self.writer is None:
+            self.writer = self.open_part()
+        self.writer.write_batch(batch)
+        self.part_count += batch.num_rows
+        self.columns = {field: [] for field in FIELDS}
+        if self.part_count >= self.part_rows:
+            self.close_part()
+
+    def close_part(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.part_count = 0
+
+    # Records a kill would lose: buffered or in the part still open
+    def pending(self):
+        return len(self.columns["url"]) + self.part_count
+
+    # Write out the buffered records and close the part (footer included)
+    def checkpoint(self):
+        self.flush()
+        self.close_part()
+
+    def close(self):
+        self.checkpoint()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Part files of a ColumnarWriter directory in write order, or [path] for a file
+def columnar_parts(path):
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(
+        part
+        for suffix in SUFFIXES.values()
+        for part in glob.glob(os.path.join(path, "part-*" + suffix))
+    )
+
+
+# Whole file or part directory as a pyarrow Table, only the given columns are
+# read from Parquet
+def read_columnar(path, columns=None):
+    if pa is None:
+        raise ValueError("Reading columnar output needs the pyarrow package")
+    if os.path.isdir(path):
+        tables = [read_columnar(part, columns) for part in columnar_parts(path)]
+        if not tables:
+            return product_schema().empty_table().select(columns or FIELDS)
+        return pa.concat_tables(tables)
+    if path.endswith(".parquet"):
+        return pq.read_table(path, columns=columns)
+    with pa.memory_map(path) as source:
+        table = ipc.open_file(source).read_all()
+    return table.select(columns) if columns else table
+
+
+# Row dicts batch by batch, for consumers that do not want the whole table
+def iter_columnar(path, columns=None):
+    for part in columnar_parts(path):
+        if part.endswith(".parquet"):
+            for batch in pq.ParquetFile(part).iter_batches(columns=columns):
+                yield from batch.to_pylist()
+        else:
+            yield from read_columnar(part, columns).to_pylist()
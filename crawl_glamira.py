@@ -1,28 +1,119 @@
-import json  # LIb to work with JSON file
 import requests  # Lib to send HTTP request and receive HTML source code
 import time  # Time lib to measure execution time
 import random  # Randomizer lib to random the sleep time and randomly select user-agent
-from bs4 import BeautifulSoup  # Lib to read HTML code
+import sys
+from collections import deque
+from functools import partial
 from concurrent.futures import (
     ThreadPoolExecutor,
-    as_completed,
+    wait,
+    FIRST_COMPLETED,
 )  # Lib to create multi-thread runs
-from json_processing import stream_and_batch
+from json_processing import streaming_json, batched
+from url_canon import DedupReport, dedup_docs
+from bloom_filter import BloomFilter
+from crawl_state import CrawlState, CheckpointedState, RECRAWL_TTL
+from sink import NdjsonSink
+from parse_pool import ParsePipeline, parse_page
+from page_extract import extract_page, PAGE_FIELDS
+from retry_scheduler import RetryScheduler, HostRetryBudget, parse_retry_after, host_of
+from host_control import (
+    HostController,
+    outcome_of_status,
+    OK,
+    ERROR,
+    HOST_POLL_INTERVAL,
+)
+from url_stats import UrlStatsIndex
+from metrics import CrawlMetrics, track_connects
+from transport import make_session, pool_stats, reuse_report, install_dns_cache
+from http_cache import HttpCache
+from failures import (
+    failed_record,
+    kind_of_status,
+    kind_of_exception,
+    is_parse_failure,
+    RETRYABLE,
+    PARSE,
+    REDRIVE_WORKERS,
+    REDRIVE_MAX_RETRIES,
+    REDRIVE_BACKOFF_FACTOR,
+)
 
 MAX_WORKERS = 10
 REQUEST_TIMEOUT = 10  # Tăng timeout lên một chút để xử lý các trang load chậm
 MAX_RETRIES = 2  # Số lần thử lại tối đa cho một URL
 RETRY_BACKOFF_FACTOR = 2  # Hệ số nhân cho thời gian chờ giữa các lần retry
+PARSE_IN_PROCESSES = False  # Hand pages to a process pool for parsing (parse_pool.py)
+EXTRACT_FIELDS = PAGE_FIELDS  # Title plus react_data fields, ["title"] for titles only
+# Fixed-memory set of the URLs read in this run instead of an exact one
+# (bloom_filter.py). Earlier runs are left to the crawl state and RECRAWL_TTL.
+USE_SEEN_FILTER = True
+METRICS_PATH = "crawl_metrics.prom"  # Prometheus text file, a ".json" path gives JSON
+USE_HTTP_CACHE = True  # Keep pages in http_cache/ and re-crawl with If-None-Match
+CACHE_OFFLINE = False  # Replay extraction from http_cache/ only, no requests at all
+REDRIVE = "--redrive" in sys.argv  # Only re-crawl URLs that failed retryably
+host_budget = HostRetryBudget()
+host_controller = HostController()
+url_stats = UrlStatsIndex()
+metrics = CrawlMetrics("crawl_glamira")
+http_cache = HttpCache()
+track_connects(metrics)
 
 ##''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
 
 
-def souping_data(session, data=None, headers=None, retry_count=0):
+def souping_data(session, data=None, headers=None, retry_count=0, parse_pipeline=None):
     url = data.get("url")
 
+    entry = http_cache.lookup(url) if USE_HTTP_CACHE or CACHE_OFFLINE else None
+    if CACHE_OFFLINE:
+        page_data = http_cache.page(entry, EXTRACT_FIELDS) if entry else None
+        if page_data is None:
+            return failed_record(data, RETRYABLE, "Not in the HTTP cache")
+        return {"status": "success", "id": data.get("id"), "url": url, **page_data}
+    request_headers = headers
+    if entry and entry.replayable(EXTRACT_FIELDS):
+        request_headers = {**headers, **entry.validators()}
+
     try:
-        response = session.get(url, headers=headers, timeout=3)
+        start = time.perf_counter()
+        response = session.get(url, headers=request_headers, timeout=REQUEST_TIMEOUT)
+        elapsed = time.perf_counter() - start
+        url_stats.record(url, response.status_code in [200, 201, 304], elapsed)
+        host = host_of(url)
+        # elapsed stops at the response headers, the rest is the body download
+        ttfb = response.elapsed.total_seconds()
+        metrics.observe("ttfb", ttfb)
+        metrics.observe("body", max(elapsed - ttfb, 0))
+        metrics.response(host, response.status_code)
+        metrics.received(host, response.raw.tell())
 
+        if response.status_code == 304:
+            # Unchanged since it was cached: nothing downloaded, nothing to parse
+            page_data = http_cache.page(entry, EXTRACT_FIELDS) if entry else None
+            if page_data is None:
+                # Nothing to replay (body gone meanwhile): the retry asks again
+                # without validators
+                http_cache.forget(url)
+                return {
+                    "status": "retry",
+                    "data": data,
+                    "headers": headers,
+                    "retry_count": retry_count + 1,
+                    "code": response.status_code,
+                    "kind": RETRYABLE,
+                }
+            if is_parse_failure(page_data, EXTRACT_FIELDS):
+                return failed_record(
+                    data, PARSE, "No react_data found", response.status_code
+                )
+            return {
+                "status": "success",
+                "id": data.get("id"),
+                "url": url,
+                **page_data,
+            }
         if response.status_code in [200, 201]:
             # short_url = re.sub(r'[\\/*?:"<>|]', "_", url[:100])
             # file_name = f"D:\\glamira-data\\html\\{short_url}.html"
@@ -32,122 +123,246 @@ def souping_data(session, data=None, headers=None, retry_count=0):
             #     html_doc.write(response.text)
             # print("HTML file saved.")
             # print("Success.")
-            soup = BeautifulSoup(response.text, "html.parser")
-            page_title = soup.find("h1", class_="page-title")
-            title_text = (
-                page_title.get_text(strip=True) if page_title else "No title found"
-            )
+            parse_start = time.perf_counter()
+            if parse_pipeline:
+                # Parse in a worker process, off the GIL-bound I/O threads
+                page_data = parse_pipeline.parse(
+                    parse_page, response.content, response.encoding, EXTRACT_FIELDS
+                )
+            else:
+                page_data = extract_page(response.text, EXTRACT_FIELDS)
+            metrics.observe("parse", time.perf_counter() - parse_start)
+            if USE_HTTP_CACHE:
+                http_cache.store(
+                    url,
+                    response.content,
+                    response.encoding,
+                    response.headers,
+                    EXTRACT_FIELDS,
+                    page_data,
+                )
+            if is_parse_failure(page_data, EXTRACT_FIELDS):
+                return failed_record(
+                    data, PARSE, "No react_data found", response.status_code
+                )
             return {
                 "status": "success",
                 "id": data.get("id"),
-                "title": title_text,
                 "url": url,
+                **page_data,
             }
         elif response.status_code in [403, 429, 500, 502, 503, 504]:
             # print("403 occurred, will retry later.")
+            retry_after = None
+            if response.status_code in [429, 503]:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
             return {
                 "status": "retry",
                 "data": data,
                 "headers": headers,
                 "retry_count": retry_count + 1,
+                "retry_after": retry_after,
+                "code": response.status_code,
+                "kind": RETRYABLE,
             }
         else:
             # print(f"{response.status_code} occurred: {response.reason}.")
-            return {
-                "status": "failed",
-                "id": data.get("id"),
-                "reason": f"Status code {response.status_code}",
-                "url": url,
-            }
+            return failed_record(
+                data,
+                kind_of_status(response.status_code),
+                f"Status code {response.status_code}",
+                response.status_code,
+            )
     except requests.exceptions.RequestException as e:
         # print(f"Exception occurred: {e}.\n")
+        url_stats.record(url, False)
+        metrics.response(host_of(url), None)
         return {
             "status": "retry",
             "data": data,
             "headers": headers,
             "retry_count": retry_count + 1,
+            "kind": kind_of_exception(e),
         }
 
 
-def batch_crawl_from_url(data_batch=None, headers_template=None, user_agents=None):
+# Done callback of every souping_data future: give the host slot back and feed
+# the response into the host's AIMD limit
+def release_host_slot(host, future):
+    if future.cancelled():
+        host_controller.release(host)
+        return
+    try:
+        crawled_data = future.result()
+    except Exception:
+        host_controller.release(host, ERROR)
+        return
+    if crawled_data.get("status") == "retry":
+        host_controller.release(host, outcome_of_status(crawled_data.get("code")))
+    else:
+        host_controller.release(host, OK)
+
+
+def batch_crawl_from_url(
+    data_batch=None,
+    headers_template=None,
+    user_agents=None,
+    parse_pipeline=None,
+    crawl_state=None,
+    result_sink=None,
+    faulty_sink=None,
+    session=None,
+):
+    # A session passed in keeps its warm connections from one batch to the next
+    if session is None:
+        with make_session(MAX_WORKERS) as own_session:
+            return batch_crawl_from_url(
+                data_batch,
+                headers_template,
+                user_agents,
+                parse_pipeline,
+                crawl_state,
+                result_sink,
+                faulty_sink,
+                own_session,
+            )
+
     result = []
     faulty_package = []
 
-    with requests.Session() as session:
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = {}
-            try:
-                for data in data_batch:
-                    headers = {
-                        **headers_template,
-                        "User-Agent": random.choice(user_agents),
-                    }
-                    future = executor.submit(souping_data, session, data, headers)
+    # Final record of a URL, written out and committed to the crawl state as soon
+    # as it is known. With sinks the records are not kept in the returned lists.
+    def keep(record):
+        success = record.get("status") == "success"
+        sink = result_sink if success else faulty_sink
+        if sink:
+            sink.write(record)
+        else:
+            (result if success else faulty_package).append(record)
+        if crawl_state:
+            crawl_state.record(record)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {}
+        # Work waiting for a slot on its host: host -> (data, headers, retry_count)
+        pending = {}
+        for data in data_batch:
+            headers = {
+                **headers_template,
+                "User-Agent": random.choice(user_agents),
+            }
+            pending.setdefault(host_of(data.get("url")), deque()).append(
+                (data, headers, 0)
+            )
+
+        # Submit round-robin over hosts, as far as each host's limit allows
+        def fill():
+            for host in list(pending):
+                queue = pending[host]
+                while (
+                    queue
+                    and len(futures) < MAX_WORKERS
+                    and host_controller.try_acquire(host)
+                ):
+                    data, headers, retry_count = queue.popleft()
+                    future = executor.submit(
+                        souping_data,
+                        session,
+                        data,
+                        headers,
+                        retry_count,
+                        parse_pipeline,
+                    )
+                    future.add_done_callback(partial(release_host_slot, host))
                     futures[future] = data
+                if not queue:
+                    del pending[host]
+
+        retry_scheduler = RetryScheduler(
+            MAX_RETRIES, RETRY_BACKOFF_FACTOR, host_budget, metrics
+        )
+        while futures or pending or retry_scheduler:
+            # Retries whose backoff is over go back in line for their host
+            for (
+                data_to_retry,
+                new_headers,
+                retry_count,
+            ) in retry_scheduler.pop_due():
+                pending.setdefault(host_of(data_to_retry.get("url")), deque()).append(
+                    (data_to_retry, new_headers, retry_count)
+                )
+            try:
+                fill()
             except Exception as e:
                 print(f"Error during submission: {e}")
-                return result, faulty_package
+                break
+            metrics.queue_depth("in_flight", len(futures))
+            metrics.queue_depth(
+                "waiting_for_host", sum(len(queue) for queue in pending.values())
+            )
+            metrics.queue_depth("retries", len(retry_scheduler))
 
-            while futures:
-                done_futures = as_completed(futures)
+            if not futures:
+                # Nothing in flight: wait for a due retry or a free host slot
+                delay = retry_scheduler.next_delay()
+                if pending:
+                    delay = min(delay or HOST_POLL_INTERVAL, HOST_POLL_INTERVAL)
+                time.sleep(delay or 0)
+                continue
 
-                try:
-                    # Take the next future in completed futures list
-                    # and remove that from the list
-                    future = next(done_futures)
-                    original_data = futures.pop(future)
+            timeout = retry_scheduler.next_delay()
+            if pending:
+                timeout = min(timeout or HOST_POLL_INTERVAL, HOST_POLL_INTERVAL)
+            # Wake up for the next due retry even if no future finished
+            done_futures, _ = wait(
+                futures, timeout=timeout, return_when=FIRST_COMPLETED
+            )
 
+            for future in done_futures:
+                original_data = futures.pop(future)
+                try:
                     crawled_data = future.result()
 
                     if crawled_data.get("status") == "success":
-                        result.append(crawled_data)
+                        keep(crawled_data)
                     elif crawled_data.get("status") == "retry":
-                        retry_count = crawled_data.get("retry_count")
-                        if retry_count < MAX_RETRIES:
-                            sleep_time = random.uniform(0.5, 1.5) * (
-                                RETRY_BACKOFF_FACTOR * retry_count
-                            )
-                            time.sleep(sleep_time)
-
-                            # retry submitting task
-                            data_to_retry = crawled_data.get("data")
-                            new_headers = crawled_data.get("headers")
-                            new_future = executor.submit(
-                                souping_data,
-                                session,
-                                data_to_retry,
-                                new_headers,
-                                retry_count,
-                            )
-                            futures[new_future] = data_to_retry
-                        else:
-                            # print(f"ERROR: Max retries reached for {crawled_data['data']['url']}. Giving up.")
-                            faulty_package.append(
-                                {
-                                    "status": "failed",
-                                    "id": crawled_data["data"].get("id"),
-                                    "reason": "Max retries reached",
-                                    "url": crawled_data["data"].get("url"),
-                                }
+                        data_to_retry = crawled_data.get("data")
+                        retry_item = (
+                            data_to_retry,
+                            crawled_data.get("headers"),
+                            crawled_data.get("retry_count"),
+                        )
+                        if not retry_scheduler.schedule(
+                            data_to_retry.get("url"),
+                            retry_item,
+                            crawled_data.get("retry_after"),
+                        ):
+                            keep(
+                                failed_record(
+                                    data_to_retry,
+                                    crawled_data.get("kind", RETRYABLE),
+                                    "Max retries reached",
+                                    crawled_data.get("code"),
+                                )
                             )
                     elif crawled_data.get("status") == "failed":
-                        faulty_package.append(crawled_data)
+                        keep(crawled_data)
 
                 except Exception as e:
-                    original_data = futures[future]
                     print(f"Error processing: {e}")
-                    faulty_package.append(
-                        {
-                            "status": "failed",
-                            "id": original_data.get("id"),
-                            "reason": str(e),
-                            "url": original_data.get("url"),
-                        }
-                    )
+                    keep(failed_record(original_data, kind_of_exception(e), str(e)))
 
     return result, faulty_package
 
 
+# Re-drive runs (--redrive) go slower and wait longer between retries
+def use_redrive_settings():
+    global MAX_WORKERS, MAX_RETRIES, RETRY_BACKOFF_FACTOR
+    MAX_WORKERS = REDRIVE_WORKERS
+    MAX_RETRIES = REDRIVE_MAX_RETRIES
+    RETRY_BACKOFF_FACTOR = REDRIVE_BACKOFF_FACTOR
+
+
 ##''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
 def main():
     user_agents = [
@@ -184,29 +399,73 @@ def main():
     file_path = "D:\\glamira-data\\"
     name_pool = [file_path + file for file in file_pool]
     batch_num = 0
-    # batch_1000 = stream_and_batch(name_pool, 1000)
-    for batch in stream_and_batch(name_pool, 1000):
-        batch_num += 1
-        start_time = time.perf_counter()
+    parse_pipeline = ParsePipeline() if PARSE_IN_PROCESSES else None
+    url_report = DedupReport()
+    crawl_state = CrawlState()
+    if REDRIVE:
+        # Only URLs that failed with a retryable kind, at re-drive pace
+        use_redrive_settings()
+        seen = None
+        docs = crawl_state.failed_docs()
+    else:
+        seen = BloomFilter() if USE_SEEN_FILTER else None
+        docs = dedup_docs(streaming_json(name_pool), url_report, seen)
+        # URLs crawled in an earlier run and still fresh are not fetched again
+        docs = crawl_state.pending_docs(docs, RECRAWL_TTL)
+    result_sink = NdjsonSink("result.jsonl")
+    faulty_sink = NdjsonSink("faulty_package.jsonl")
+    # State commits follow the two sinks to disk
+    state_writer = CheckpointedState(crawl_state, [result_sink, faulty_sink])
+    metrics.start_exporter(METRICS_PATH)
+    install_dns_cache()
+    # One session for every batch, connections stay warm between batches
+    session = make_session(MAX_WORKERS)
+    try:
+        for batch in batched(docs, 1000):
+            batch_num += 1
+            start_time = time.perf_counter()
+            success_before, faulty_before = result_sink.count, faulty_sink.count
 
-        result, faulty_package = batch_crawl_from_url(
-            batch, headers_template, user_agents
-        )
+            batch_crawl_from_url(
+                batch,
+                headers_template,
+                user_agents,
+                parse_pipeline,
+                state_writer,
+                result_sink,
+                faulty_sink,
+                session,
+            )
+
+            end_time = time.perf_counter()
 
-        end_time = time.perf_counter()
+            print(f"Batch {batch_num} faulty URLs: {faulty_sink.count - faulty_before}")
+            print(f"Data crawled success: {result_sink.count - success_before}")
 
-        if faulty_package:
-            print(f"Faulty URLs: {len(faulty_package)}")
-            with open(
-                f"faulty_package_{batch_num}.json", "w", encoding="utf-8"
-            ) as file:
-                json.dump(faulty_package, file, ensure_ascii=False, indent=4)
-        if result:
-            print(f"Data crawled success: {len(result)}")
-            with open(f"result_{batch_num}.json", "w", encoding="utf-8") as file:
-                json.dump(result, file, ensure_ascii=False, indent=4)
+            print(f"Processing time for this batch: {end_time - start_time} seconds.")
+            print(host_controller.report())
+            print(reuse_report(pool_stats(session)))
+            url_stats.save()
+    except KeyboardInterrupt:
+        print("Interrupted, finished URLs are kept in the crawl state.")
+    finally:
+        session.close()
+        state_writer.commit()
+        result_sink.close()
+        faulty_sink.close()
+        print(crawl_state.summary())
+        print(crawl_state.failure_summary())
+        crawl_state.close()
+        metrics.export(METRICS_PATH)
+        if USE_HTTP_CACHE or CACHE_OFFLINE:
+            print(http_cache.summary())
+            http_cache.close()
 
-        print(f"Processing time for this batch: {end_time - start_time} seconds.")
+    print(url_report.summary())
+    if seen is not None:
+        print(seen.summary())
+    if parse_pipeline:
+        parse_pipeline.close()
 
 
 ##''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
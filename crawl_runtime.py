@@ -0,0 +1,41 @@
+from hedging import LatencyTracker, HedgeStats
+from page_extract import extract_page, PAGE_FIELDS
+from retry_scheduler import HostRetryBudget
+from host_control import HostController
+from url_stats import UrlStatsIndex
+from metrics import CrawlMetrics, track_connects
+from http_cache import HttpCache
+
+# Settings and shared state of the product scraper, for both of its engines:
+# main.py (threads) and async_product_scraping.py (aiohttp). They live here and
+# not in main.py, because `python main.py` runs it as __main__ and an
+# `import main` from the async engine would build a second, unused copy.
+REQUEST_TIMEOUT = 12  # Tăng timeout lên một chút để xử lý các trang load chậm
+MAX_RETRIES = 3  # Số lần thử lại tối đa cho một URL
+RETRY_BACKOFF_FACTOR = 2  # Hệ số nhân cho thời gian chờ giữa các lần retry
+STREAM_CHUNK_SIZE = 16 * 1024
+# Rest of a cut-off body still read to keep its keep-alive connection: 256 KB
+# is ~25 ms at 10 MB/s, less than a new TCP+TLS handshake to a remote host
+DRAIN_MAX_BYTES = 256 * 1024
+HEDGE_INITIAL = 2  # URLs launched at once per product, None fires every URL at once
+HEDGE_MAX_IN_FLIGHT = 4  # Max URLs racing for one product
+HEDGE_PERCENTILE = 0.9  # Launch another URL once in-flight ones pass this latency
+HEDGE_MIN_DELAY = 1.0  # Seconds, also used until enough latencies are recorded
+EXTRACT_FIELDS = PAGE_FIELDS  # Title and react_data fields taken from each page
+USE_HTTP_CACHE = True  # Keep pages in http_cache/ and re-crawl with If-None-Match
+CACHE_OFFLINE = False  # Replay extraction from http_cache/ only, no requests at all
+latency_tracker = LatencyTracker(default=HEDGE_MIN_DELAY)
+hedge_stats = HedgeStats()
+host_budget = HostRetryBudget()
+host_controller = HostController()
+url_stats = UrlStatsIndex()
+metrics = CrawlMetrics("main")
+http_cache = HttpCache()
+track_connects(metrics)
+
+##''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+
+# Title and react_data fields in one pass over the page, see page_extract.py
+def extract_page_data(html_text):
+    return extract_page(html_text, EXTRACT_FIELDS)
@@ -0,0 +1,276 @@
+import json
+import sqlite3
+import threading
+import time
+from failures import REDRIVE_KINDS
+
+STATE_DB_PATH = "crawl_state.db"
+RECRAWL_TTL = 7 * 24 * 3600  # Seconds until a crawled item is due again, None = never
+STATE_COMMIT_EVERY = 1000  # Items written out between two CheckpointedState commits
+
+SUCCESS = "success"
+FAILED = "failed"
+
+##-----------------------------------------------------------------------------------
+
+
+# SQLite record of what has been crawled: one row per product and per URL with
+# status, attempts and last success. Results are committed as they arrive (or
+# right behind the outputs, see CheckpointedState), so the next run after a
+# crash or Ctrl-C skips finished work.
+class CrawlState:
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS products (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_attempt REAL,
+                    last_success REAL,
+                    result TEXT
+                )""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT PRIMARY KEY,
+                    product_id TEXT,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_attempt REAL,
+                    last_success REAL,
+                    detail TEXT,
+                    kind TEXT
+                )""")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(urls)")]
+            if "kind" not in columns:
+                # State files written before failures were classified
+                self.conn.execute("ALTER TABLE urls ADD COLUMN kind TEXT")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS urls_kind ON urls (kind)")
+
+    # True when the product was never crawled, failed last time or is older than ttl
+    def product_due(self, product_id, ttl=RECRAWL_TTL):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, last_success FROM products WHERE id = ?",
+                (str(product_id),),
+            ).fetchone()
+        return self.due(row, ttl)
+
+    def url_due(self, url, ttl=RECRAWL_TTL):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, last_success FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+        return self.due(row, ttl)
+
+    @staticmethod
+    def due(row, ttl):
+        if row is None or row[0] != SUCCESS:
+            return True
+        return ttl is not None and time.time() - row[1] > ttl
+
+    # One finished product of product_scraping: the product row, the winning URL
+    # and every faulty URL, in a single transaction
+    def record_product(self, product_id, result, faulty_package):
+        now = time.time()
+        product_id = str(product_id)
+        status = SUCCESS if result else FAILED
+        with self.lock, self.conn:
+            self.conn.execute(
+                """INSERT INTO products (id, status, attempts, last_attempt, last_success, result)
+                VALUES (?, ?, 1, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    status = excluded.status,
+                    attempts = attempts + 1,
+                    last_attempt = excluded.last_attempt,
+                    last_success = COALESCE(excluded.last_success, last_success),
+                    result = COALESCE(excluded.result, result)""",
+                (
+                    product_id,
+                    status,
+                    now,
+                    now if result else None,
+                    json.dumps(result, ensure_ascii=False) if result else None,
+                ),
+            )
+            if result:
+                self.upsert_url(result.get("url"), product_id, SUCCESS, now)
+            for entry in faulty_package:
+                url = entry.get("url") or next(iter(entry.values()), None)
+                if isinstance(url, str):
+                    self.upsert_url(url, product_id, FAILED, now, entry)
+
+    # One finished URL of the glamira crawlers, the record is kept as detail
+    def record_url(self, url, product_id, success, record=None):
+        with self.lock, self.conn:
+            self.upsert_url(
+                url,
+                None if product_id is None else str(product_id),
+                SUCCESS if success else FAILED,
+                time.time(),
+                record,
+            )
+
+    # Final record of the glamira crawlers ({"status", "id", "url", ...}). A page
+    # that also gave its react_data fields counts as a crawled product, so
+    # main.py does not fetch that product again.
+    def record(self, record):
+        success = record.get("status") == "success"
+        if success and record.get("product_id") is not None:
+            product = {key: value for key, value in record.items() if key != "status"}
+            self.record_product(record.get("id"), product, [])
+        else:
+            self.record_url(record.get("url"), record.get("id"), success, record)
+
+    # Failed URLs keep the failure kind of their detail record (failures.py)
+    def upsert_url(self, url, product_id, status, now, detail=None):
+        self.conn.execute(
+            """INSERT INTO urls (url, product_id, status, attempts, last_attempt, last_success, detail, kind)
+            VALUES (?, ?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET
+                product_id = COALESCE(excluded.product_id, product_id),
+                status = excluded.status,
+                attempts = attempts + 1,
+                last_attempt = excluded.last_attempt,
+                last_success = COALESCE(excluded.last_success, last_success),
+                detail = excluded.detail,
+                kind = excluded.kind""",
+            (
+                url,
+                product_id,
+                status,
+                now,
+                now if status == SUCCESS else None,
+                json.dumps(detail, ensure_ascii=False) if detail else None,
+                detail.get("kind") if detail and status == FAILED else None,
+            ),
+        )
+
+    # product_dict stream without the products that are done and still fresh
+    def pending_products(self, id_url_stream, ttl=RECRAWL_TTL):
+        skipped = 0
+        for id_url in id_url_stream:
+            if all(not self.product_due(id, ttl) for id in id_url):
+                skipped += 1
+                continue
+            yield id_url
+        print(f"Skipped {skipped} products already crawled.")
+
+    # Crawl input stream ({"id", "url", ...}) without URLs done and still fresh
+    def pending_docs(self, docs, ttl=RECRAWL_TTL):
+        skipped = 0
+        for doc in docs:
+            if not self.url_due(doc.get("url"), ttl):
+                skipped += 1
+                continue
+            yield doc
+        print(f"Skipped {skipped} URLs already crawled.")
+
+    # Re-drive input for the glamira crawlers: {"id", "url"} of every URL whose
+    # last attempt failed with one of `kinds`, unless its product has a result
+    def failed_docs(self, kinds=REDRIVE_KINDS):
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT product_id, url FROM urls WHERE status = ?
+                AND kind IN ({", ".join("?" * len(kinds))})
+                AND NOT EXISTS (SELECT 1 FROM products
+                    WHERE products.id = urls.product_id AND products.status = ?)""",
+                (FAILED, *kinds, SUCCESS),
+            ).fetchall()
+        for product_id, url in rows:
+            yield {"id": product_id, "url": url}
+
+    # Re-drive input for main.py: {product_id: [urls]} of products still without
+    # a result, with only their URLs that failed with one of `kinds`
+    def failed_products(self, kinds=REDRIVE_KINDS):
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT urls.product_id, urls.url FROM urls
+                JOIN products ON products.id = urls.product_id
+                WHERE products.status = ? AND urls.status = ?
+                AND urls.kind IN ({", ".join("?" * len(kinds))})
+                ORDER BY urls.product_id""",
+                (FAILED, FAILED, *kinds),
+            ).fetchall()
+        products = {}
+        for product_id, url in rows:
+            products.setdefault(product_id, []).append(url)
+        for product_id, url_list in products.items():
+            yield {product_id: url_list}
+
+    def failure_summary(self):
+        with self.lock:
+            counts = self.conn.execute(
+                "SELECT kind, COUNT(*) FROM urls WHERE status = ? GROUP BY kind",
+                (FAILED,),
+            ).fetchall()
+        return "Failed URLs by kind: " + ", ".join(
+            f"{kind or 'unknown'} {count}" for kind, count in sorted(counts, key=str)
+        )
+
+    def summary(self):
+        with self.lock:
+            lines = []
+            for table in ["products", "urls"]:
+                counts = dict(
+                    self.conn.execute(
+                        f"SELECT status, COUNT(*) FROM {table} GROUP BY status"
+                    ).fetchall()
+                )
+                lines.append(
+                    f"{table}: {counts.get(SUCCESS, 0)} success, "
+                    f"{counts.get(FAILED, 0)} failed"
+                )
+            return f"Crawl state ({self.path}): " + ", ".join(lines)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# Crawl state writes held back until the output they describe is on disk:
+# record()/record_product() calls are queued, and every `every` items the sinks
+# are checkpointed (flushed and fsynced) before the queue is committed. A hard
+# kill can lose output that the state never heard of, which the next run
+# fetches again, but never marks an item done whose output line is missing.
+# A sink with pending() (ColumnarWriter) only gets its output on disk by
+# closing a part, so the queue also waits until it has nothing pending.
+class CheckpointedState:
+    def __init__(self, crawl_state, sinks, every=STATE_COMMIT_EVERY):
+        self.crawl_state = crawl_state
+        self.sinks = sinks
+        self.every = every
+        self.queue = []
+        self.lock = threading.Lock()
+
+    def record(self, record):
+        self.add(self.crawl_state.record, record)
+
+    def record_product(self, product_id, result, faulty_package):
+        self.add(self.crawl_state.record_product, product_id, result, faulty_package)
+
+    def add(self, method, *args):
+        with self.lock:
+            self.queue.append((method, args))
+            if len(self.queue) >= self.every and not self.sinks_pending():
+                self.commit_locked()
+
+    def sinks_pending(self):
+        return any(sink.pending() for sink in self.sinks if hasattr(sink, "pending"))
+
+    # Call before closing the sinks, and only once everything was written to them
+    def commit(self):
+        with self.lock:
+            self.commit_locked()
+
+    def commit_locked(self):
+        if not self.queue:
+            return
+        for sink in self.sinks:
+            sink.checkpoint()
+        for method, args in self.queue:
+            method(*args)
+        self.queue = []
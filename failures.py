@@ -0,0 +1,57 @@
+from title_parser import NO_TITLE
+from page_extract import TITLE
+
+PERMANENT = "permanent"  # 404/410 and other 4xx, retrying will not help
+RETRYABLE = "retryable"  # 403/429/5xx and connection errors
+TIMEOUT = "timeout"
+PARSE = "parse"  # Page came back but none of the wanted fields were in it
+CANCELLED = "cancelled"  # Dropped because another URL of the product won
+REDRIVE_KINDS = [RETRYABLE, TIMEOUT]  # What a re-drive run fetches again
+
+# Re-drive runs go slower and wait longer than a full crawl: the hosts that
+# failed were mostly throttling
+REDRIVE_WORKERS = 4
+REDRIVE_MAX_RETRIES = 5
+REDRIVE_BACKOFF_FACTOR = 3
+
+##-----------------------------------------------------------------------------------
+
+
+def kind_of_status(status):
+    if status in [403, 429] or (status is not None and status >= 500):
+        return RETRYABLE
+    return PERMANENT
+
+
+# requests' Timeout does not derive from TimeoutError, asyncio's and aiohttp's do
+def kind_of_exception(error):
+    if isinstance(error, TimeoutError) or "Timeout" in type(error).__name__:
+        return TIMEOUT
+    return RETRYABLE
+
+
+# True when the page did not give what was asked for: no react_data fields
+# when any were requested (a page-title heading alone is not a product),
+# otherwise no title (the title parser returns NO_TITLE instead of None)
+def is_parse_failure(page_data, fields):
+    keys = [field for field in fields if field != TITLE]
+    if keys:
+        return all(page_data.get(key) is None for key in keys)
+    return page_data.get(TITLE) in [None, "", NO_TITLE]
+
+
+# Typed faulty record, the same shape from every crawler
+def failure(url, kind, status=None, reason=None):
+    return {"url": url, "kind": kind, "status": status, "reason": reason}
+
+
+# Final record of a URL in the glamira crawlers, typed the same way
+def failed_record(data, kind, reason, code=None):
+    return {
+        "status": "failed",
+        "id": data.get("id"),
+        "reason": reason,
+        "url": data.get("url"),
+        "kind": kind,
+        "code": code,
+    }
@@ -1,6 +1,6 @@
 from pymongo import MongoClient
-import json
 from tqdm import tqdm
+from sink import NdjsonSink
 
 ##-----------------------------------------------------------------------------------
 
@@ -53,21 +53,6 @@ def query_documents(collection, query, projection):
         print(f"Error during query from MongoDB: {e}")
 
 
-# Save any yielded data to JSON
-def save_to_json(streaming_data, name, total_docs):
-    filename = f"{name}.json"
-    try:
-        with open(filename, "w", encoding="utf-8") as file:
-            for doc in tqdm(
-                streaming_data, total=total_docs, desc=f"Saving {filename}"
-            ):
-                json.dump(doc, file, ensure_ascii=False)
-                file.write("\n")
-        print(f"Saved {total_docs} documents to {filename}.")
-    except Exception as e:
-        print(f"Error saving {filename}: {e}")
-
-
 ##-----------------------------------------------------------------------------------
 
 
@@ -122,7 +107,13 @@ def main():
             total_docs = collection.count_documents(query)
             print(f"Total {value} documents to filter: {total_docs}")
             stream_data = query_documents(collection, query, projection)
-            save_to_json(stream_data, value, total_docs)
+            # One document per line, written as the cursor streams
+            filename = f"{value}.json"
+            with NdjsonSink(filename, rotate_bytes=None, append=False) as sink:
+                sink.write_many(
+                    tqdm(stream_data, total=total_docs, desc=f"Saving {filename}")
+                )
+            print(f"Saved {sink.count} documents to {filename}.")
 
     client.close()
     print("Processing complete. MongoDB connection closed.")
@@ -0,0 +1,81 @@
+import threading
+from collections import deque
+
+##-----------------------------------------------------------------------------------
+
+
+# Rolling window of request latencies, used to decide when an in-flight URL is
+# slow enough that another candidate URL should be launched next to it
+class LatencyTracker:
+    def __init__(self, window=500, min_samples=20, default=None):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.default = default
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q):
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return self.default
+            ordered = sorted(self.samples)
+        index = min(int(q * len(ordered)), len(ordered) - 1)
+        return ordered[index]
+
+
+# Requests handed to a shared worker pool and not finished yet. With more of
+# them than workers the rest wait in the pool's queue, and a hedge submitted
+# then would only wait behind the request it was meant to overtake.
+class WorkerLoad:
+    def __init__(self):
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def submitted(self):
+        with self.lock:
+            self.pending += 1
+
+    # Done callback of every submitted future, cancelled ones included
+    def finished(self, future=None):
+        with self.lock:
+            self.pending -= 1
+
+    def has_idle_worker(self, workers):
+        with self.lock:
+            return self.pending < workers
+
+
+# Count how many requests are spent for each product that ends with a result
+class HedgeStats:
+    def __init__(self):
+        self.products = 0
+        self.products_succeeded = 0
+        self.requests = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def record_product(self, requests_sent, hedges, success):
+        with self.lock:
+            self.products += 1
+            self.requests += requests_sent
+            self.hedges += hedges
+            if success:
+                self.products_succeeded += 1
+
+    def requests_per_success(self):
+        with self.lock:
+            if not self.products_succeeded:
+                return None
+            return self.requests / self.products_succeeded
+
+    def summary(self):
+        per_success = self.requests_per_success()
+        per_success = f"{per_success:.2f}" if per_success is not None else "n/a"
+        return (
+            f"Products: {self.products}, succeeded: {self.products_succeeded}, "
+            f"requests: {self.requests}, hedged launches: {self.hedges}, "
+            f"requests per successful product: {per_success}"
+        )
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+HOST_INITIAL_LIMIT = 4  # Concurrent requests per host at the start
+HOST_MIN_LIMIT = 1
+HOST_MAX_LIMIT = 32
+HOST_INCREASE = 1.0  # Additive increase: +1 slot after a full window of successes
+HOST_DECREASE = 0.5  # Multiplicative decrease on 403/429
+HOST_COOLDOWN = 2.0  # Seconds between two decreases, one burst of 403s = one cut
+HOST_RATE_WINDOW = 30  # Seconds used for the live requests/s figure
+HOST_POLL_INTERVAL = 0.2  # How often a blocked submitter looks for a free host slot
+
+THROTTLED = "throttled"
+OK = "ok"
+ERROR = "error"
+
+##-----------------------------------------------------------------------------------
+
+
+def outcome_of_status(status):
+    if status in [403, 429]:
+        return THROTTLED
+    if status is None or status >= 500:
+        return ERROR
+    return OK
+
+
+class HostState:
+    def __init__(self):
+        self.limit = float(HOST_INITIAL_LIMIT)
+        self.in_flight = 0
+        self.ok = 0
+        self.throttled = 0
+        self.errors = 0
+        self.last_decrease = 0.0
+        self.finished = deque()  # Completion times inside HOST_RATE_WINDOW
+
+
+# AIMD concurrency per host: every glamira country domain grows its own limit
+# while it answers normally and halves it when it starts sending 403/429
+class HostController:
+    def __init__(self):
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+
+    def state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState()
+        return state
+
+    def try_acquire(self, host):
+        with self.lock:
+            return self.try_acquire_locked(host)
+
+    def acquire(self, host, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.try_acquire_locked(host), timeout=timeout
+            )
+
+    def try_acquire_locked(self, host):
+        state = self.state(host)
+        if state.in_flight >= int(state.limit):
+            return False
+        state.in_flight += 1
+        return True
+
+    # outcome None frees the slot without touching the limit (cancelled request)
+    def release(self, host, outcome=None):
+        now = time.monotonic()
+        with self.condition:
+            state = self.state(host)
+            state.in_flight = max(state.in_flight - 1, 0)
+            if outcome == OK:
+                state.ok += 1
+                state.limit = min(
+                    state.limit + HOST_INCREASE / state.limit, HOST_MAX_LIMIT
+                )
+            elif outcome == THROTTLED:
+                state.throttled += 1
+                if now - state.last_decrease >= HOST_COOLDOWN:
+                    state.limit = max(state.limit * HOST_DECREASE, HOST_MIN_LIMIT)
+                    state.last_decrease = now
+            elif outcome == ERROR:
+                state.errors += 1
+            if outcome is not None:
+                state.finished.append(now)
+            self.condition.notify_all()
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            snapshot = {}
+            for host, state in self.hosts.items():
+                while state.finished and now - state.finished[0] > HOST_RATE_WINDOW:
+                    state.finished.popleft()
+                snapshot[host] = {
+                    "limit": round(state.limit, 2),
+                    "in_flight": state.in_flight,
+                    "ok": state.ok,
+                    "throttled": state.throttled,
+                    "errors": state.errors,
+                    "requests_per_second": round(
+                        len(state.finished) / HOST_RATE_WINDOW, 2
+                    ),
+                }
+            return snapshot
+
+    def report(self):
+        lines = []
+        for host, stats in sorted(self.snapshot().items()):
+            lines.append(
+                f"{host}: limit {stats['limit']}, in flight {stats['in_flight']}, "
+                f"{stats['requests_per_second']} req/s, ok {stats['ok']}, "
+                f"throttled {stats['throttled']}, errors {stats['errors']}"
+            )
+        return "\n".join(lines)
+
+    # Log the per-host rates every `interval` seconds from a daemon thread
+    def start_reporter(self, interval=30):
+        def run():
+            while True:
+                time.sleep(interval)
+                report = self.report()
+                if report:
+                    logging.info(f"Per-host rates:\n{report}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+# asyncio front for a HostController, for the aiohttp crawlers
+class AsyncHostLimiter:
+    def __init__(self, controller):
+        self.controller = controller
+        self.condition = None
+        self.loop = None
+        self.notify_tasks = set()  # The loop only keeps weak references to tasks
+
+    async def acquire(self, host):
+        # asyncio.run() per batch means a new loop, and a Condition is loop-bound
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.condition = asyncio.Condition()
+            self.loop = loop
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.controller.try_acquire(host))
+
+    # Not a coroutine, so it is safe in a finally block of a cancelled task
+    def release(self, host, outcome=None):
+        self.controller.release(host, outcome)
+        if self.condition is not None and not self.loop.is_closed():
+            task = self.loop.create_task(self.notify())
+            self.notify_tasks.add(task)
+            task.add_done_callback(self.notify_tasks.discard)
+
+    async def notify(self):
+        async with self.condition:
+            self.condition.notify_all()
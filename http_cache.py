@@ -0,0 +1,313 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from url_canon import canonical_url
+from page_extract import extract_page, PageScanner
+from parse_pool import to_text
+
+try:
+    import zstandard  # Optional, gzip is used for the bodies without it
+except ImportError:
+    zstandard = None
+
+CACHE_DIR = "http_cache"
+CACHE_MAX_BYTES = 2 * 1024**3  # Compressed bodies kept on disk before LRU eviction
+CACHE_EVICT_TO = 0.9  # Eviction stops once the cache is back under this share
+
+##-----------------------------------------------------------------------------------
+
+
+def compress(body):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=9).compress(body), ".zst"
+    return gzip.compress(body), ".gz"
+
+
+def decompress(data, suffix):
+    if suffix == ".zst":
+        if zstandard is None:
+            raise ValueError("Reading a .zst cache entry needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+# One cached page: validators, how the body was stored and, when known, the
+# fields already extracted from it
+class CacheEntry:
+    __slots__ = ["url", "digest", "suffix", "encoding", "etag", "last_modified"]
+    __slots__ += ["complete", "fields", "page_data"]
+
+    def __init__(self, *row):
+        for name, value in zip(self.__slots__, row):
+            setattr(self, name, value)
+
+    # If-None-Match / If-Modified-Since for a re-crawl of this page
+    def validators(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    # The stored fields were extracted with (at least) the ones asked for
+    def covers(self, fields):
+        if self.fields is None or self.page_data is None:
+            return False
+        return set(fields) <= set(json.loads(self.fields))
+
+    # page() can surely answer for these fields: stored ones, or a body read to
+    # the end. Only then are validators sent; a cut-off body is not scanned on
+    # every request, its page is fetched whole once and stored again.
+    def replayable(self, fields):
+        return self.covers(fields) or bool(self.complete)
+
+
+def fields_key(fields):
+    return json.dumps(sorted(fields))
+
+
+# On-disk HTTP cache under request_data / souping_data / fetch. Bodies are
+# stored compressed and content-addressed (blobs/<sha256>), so the same page
+# under several URLs is kept once. A SQLite index maps the canonical URL to its
+# body, ETag/Last-Modified and the extracted fields, and evicts the least
+# recently used pages once the bodies pass max_bytes.
+class HttpCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = None  # Opened on first use, importing a crawler creates nothing
+
+    def connect(self):
+        if self.conn is not None:
+            return self.conn
+        os.makedirs(os.path.join(self.directory, "blobs"), exist_ok=True)
+        conn = sqlite3.connect(
+            os.path.join(self.directory, "index.db"), check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    encoding TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    complete INTEGER NOT NULL,
+                    fields TEXT,
+                    page_data TEXT,
+                    stored_at REAL,
+                    used_at REAL
+                )""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    suffix TEXT NOT NULL,
+                    size INTEGER NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_used ON pages (used_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_digest ON pages (digest)")
+        self.conn = conn
+        return conn
+
+    def blob_path(self, digest, suffix):
+        return os.path.join(self.directory, "blobs", digest[:2], digest + suffix)
+
+    def lookup(self, url):
+        url = canonical_url(url)
+        with self.lock:
+            row = (
+                self.connect()
+                .execute(
+                    """SELECT url, pages.digest, suffix, encoding, etag, last_modified,
+                    complete, fields, page_data FROM pages JOIN blobs USING (digest)
+                    WHERE url = ?""",
+                    (url,),
+                )
+                .fetchone()
+            )
+        return CacheEntry(*row) if row else None
+
+    def body(self, entry):
+        path = self.blob_path(entry.digest, entry.suffix)
+        try:
+            with open(path, "rb") as file:
+                return decompress(file.read(), entry.suffix)
+        except FileNotFoundError:
+            return None
+
+    # Fields of a cached page: stored ones when they were extracted with the
+    # same fields or more, otherwise the body is parsed again (offline replay
+    # after an extraction change). None when that cannot be done: the body is
+    # gone, or it was cut off before the fields asked for.
+    def page(self, entry, fields):
+        if entry.covers(fields):
+            stored = json.loads(entry.page_data)
+            page_data = {key: stored[key] for key in fields if key in stored}
+        else:
+            body = self.body(entry)
+            if body is None:
+                return None
+            text = to_text(body, entry.encoding)
+            # A cut-off body still answers when the fields asked for are in it
+            if not entry.complete and not PageScanner(fields).feed(text):
+                return None
+            page_data = extract_page(text, fields)
+            with self.lock, self.connect():
+                self.conn.execute(
+                    "UPDATE pages SET fields = ?, page_data = ? WHERE url = ?",
+                    (
+                        fields_key(fields),
+                        json.dumps(page_data, ensure_ascii=False),
+                        entry.url,
+                    ),
+                )
+        self.touch(entry.url)
+        return page_data
+
+    def touch(self, url):
+        with self.lock, self.connect():
+            self.conn.execute(
+                "UPDATE pages SET used_at = ? WHERE url = ?",
+                (time.time(), canonical_url(url)),
+            )
+
+    # A 200 response. `body` is bytes (or text, stored as UTF-8); complete=False
+    # for a streamed body that was cut off once the wanted fields had arrived.
+    def store(
+        self,
+        url,
+        body,
+        encoding=None,
+        headers=None,
+        fields=None,
+        page_data=None,
+        complete=True,
+    ):
+        if isinstance(body, str):
+            body, encoding = body.encode("utf-8"), "utf-8"
+        headers = headers or {}
+        url = canonical_url(url)
+        digest = hashlib.sha256(body).hexdigest()
+        data, suffix = compress(body)  # Outside the lock, other threads keep going
+        if page_data is not None:
+            page_data = json.dumps(page_data, ensure_ascii=False)
+        now = time.time()
+        with self.lock:
+            conn = self.connect()
+            stored = conn.execute(
+                "SELECT suffix FROM blobs WHERE digest = ?", (digest,)
+            ).fetchone()
+            if stored is None:
+                path = self.blob_path(digest, suffix)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", "wb") as file:
+                    file.write(data)
+                os.replace(path + ".tmp", path)
+            previous = conn.execute(
+                "SELECT digest FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            with conn:
+                if stored is None:
+                    conn.execute(
+                        "INSERT INTO blobs (digest, suffix, size) VALUES (?, ?, ?)",
+                        (digest, suffix, len(data)),
+                    )
+                conn.execute(
+                    """INSERT OR REPLACE INTO pages (url, digest, encoding, etag,
+                    last_modified, complete, fields, page_data, stored_at, used_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (
+                        url,
+                        digest,
+                        encoding,
+                        headers.get("ETag"),
+                        headers.get("Last-Modified"),
+                        int(complete),
+                        fields_key(fields) if page_data is not None else None,
+                        page_data,
+                        now,
+                        now,
+                    ),
+                )
+                if previous and previous[0] != digest:
+                    self.drop_unused_blob_locked(previous[0])  # The page changed
+            if stored is None:
+                self.evict_locked()
+
+    # Drop a page that could not answer a 304, its retry goes out without
+    # validators and gets the whole body
+    def forget(self, url):
+        url = canonical_url(url)
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute(
+                "SELECT digest FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return
+            with conn:
+                conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+                self.drop_unused_blob_locked(row[0])
+
+    def size(self):
+        with self.lock:
+            return self.size_locked()
+
+    def size_locked(self):
+        row = self.connect().execute("SELECT SUM(size) FROM blobs").fetchone()
+        return row[0] or 0
+
+    # Delete a body no page points to any more, returns the bytes freed
+    def drop_unused_blob_locked(self, digest):
+        conn = self.conn
+        if conn.execute("SELECT 1 FROM pages WHERE digest = ?", (digest,)).fetchone():
+            return 0
+        blob = conn.execute(
+            "SELECT suffix, size FROM blobs WHERE digest = ?", (digest,)
+        ).fetchone()
+        if blob is None:
+            return 0
+        conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        try:
+            os.remove(self.blob_path(digest, blob[0]))
+        except FileNotFoundError:
+            pass
+        return blob[1]
+
+    # Drop the least recently used pages until the bodies fit again
+    def evict_locked(self):
+        total = self.size_locked()
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * CACHE_EVICT_TO
+        conn = self.conn
+        with conn:
+            for url, digest in conn.execute(
+                "SELECT url, digest FROM pages ORDER BY used_at"
+            ).fetchall():
+                conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+                total -= self.drop_unused_blob_locked(digest)
+                if total <= target:
+                    break
+
+    def summary(self):
+        with self.lock:
+            pages = self.connect().execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            blobs = self.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+            size = self.size_locked()
+        return (
+            f"HTTP cache: {pages} pages, {blobs} distinct bodies, "
+            f"{size / 1024**2:.1f} MB on disk"
+        )
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
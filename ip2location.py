@@ -1,7 +1,6 @@
 from pymongo import MongoClient
 import IP2Location
-import os
-import json
+from sink import NdjsonSink
 
 
 def init_mongoDB(uri):
@@ -77,18 +76,6 @@ def convert_ip2location(ip_list, ip_db):
     return enriched_data
 
 
-def save_to_json(data, data_num, output_dir="data_batches"):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    file_path = os.path.join(output_dir, f"ip_location_batch_{data_num}.json")
-    try:
-        with open(file_path, "w") as f:
-            json.dump(data, f, indent=2)
-        print(f"Saved batch {data_num} to {file_path}")
-    except Exception as e:
-        print(f"Error saving batch {data_num} to JSON: {e}")
-
-
 def main():
     # Pagination variables
     MONGODB_PORT = 27072
@@ -108,6 +95,8 @@ def main():
     # Process IPs by batch
     processed_count = 0
     batch_num = 0
+    # Every batch is appended to one NDJSON file, rotated by size
+    ip_sink = NdjsonSink("data_batches/ip_location.jsonl", append=False)
 
     for batch in batch_query_mongodb(coll, batch_size=1000):
         batch_num += 1
@@ -119,7 +108,11 @@ def main():
         print(f"Processed {processed_count} unique IPs so far.")
 
         # Save data into json
-        save_to_json(enriched_ip_data, batch_num)
+        ip_sink.write_many(enriched_ip_data)
+        ip_sink.flush()
+        print(f"Saved batch {batch_num} to {ip_sink.current_path}")
+
+    ip_sink.close()
 
     # lose the MongoDB connection
     client.close()
@@ -2,13 +2,34 @@ import ijson  # Lib to parse large JSON file
 import time  # Time lib to measure execution time
 import os
 import json
+import heapq
+import itertools
+import tempfile
+from urllib.parse import urlsplit
+from url_canon import canonical_url, DedupReport
+from url_table import save_compact_batch
+from sink import NdjsonSink, read_records
+
+GROUP_RUN_SIZE = (
+    500_000  # (id, url) pairs held in memory before a sorted run is spilled
+)
+PRODUCT_URL_CAP = 100  # Max candidate URLs kept per product
+PRODUCT_BATCH_SIZE = 5000  # Products per product_dict batch file
+COMPACT_BATCHES = True  # Write batch_{n}.cjson (url_table.py) instead of plain JSON
 
 ##-----------------------------------------------------------------------------------
 
 
-# Read from json file pool and streaming to batching_data function
+# Read from json file pool and stream the documents one by one. NDJSON
+# outputs of sink.NdjsonSink (.jsonl, .jsonl.gz, .jsonl.zst) are read line by line.
 def streaming_json(file_pool):
     for file_path in file_pool:
+        if ".jsonl" in os.path.basename(file_path):
+            try:
+                yield from read_records(file_path)
+            except Exception as e:
+                print(f"Error reading file {file_path}: {e}")
+            continue
         try:
             with open(file_path, "r", encoding="utf-8") as file:
                 data = ijson.items(file, "item")
@@ -17,49 +38,132 @@ def streaming_json(file_pool):
             print(f"Error reading file {file_path}: {e}")
 
 
-# receiving file from streaming_json and put data into batches
-def batching_data(file_path, batch_size):
-    data = []
-    batch_no = 0
-    try:
-        with open(file_path, "r", encoding="utf-8") as file:
-            documents = ijson.items(file, "item")
-            for doc in documents:
-                data.append(doc)
-                if len(data) == batch_size:
-                    batch_no += 1
-                    yield data.copy(), batch_no
-                    data.clear()
-            if data:
-                batch_no += 1
-                yield data.copy(), batch_no
-                data.clear()
-    except Exception as e:
-        print(f"Error openning file: {e}")
-
-
-def product_id_paginate(doc, product_dict):
+def batched(docs, batch_size):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# URLs are canonicalized (url_canon.py) so tracking params and query order
+# do not take up the PRODUCT_URL_CAP slots of a product with copies of the same page
+def product_id_paginate(doc, product_dict, report=None):
     id = doc["id"]
-    url = doc["url"]
-    if id in product_dict and len(product_dict[id]) < 100:
-        product_dict[id].append(url)
-    elif id in product_dict and len(product_dict[id]) > 100:
-        pass
-    else:
-        product_dict[id] = [url]
+    url = canonical_url(doc["url"], report)
+    if report is not None:
+        report.seen += 1
+    url_list = product_dict.setdefault(id, [])
+    if len(url_list) < PRODUCT_URL_CAP and url not in url_list:
+        url_list.append(url)
+        if report is not None:
+            report.kept += 1
     return product_dict
 
 
-def save_to_json(data, output_dir=None, save_name=None):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    file_path = os.path.join(output_dir, f"batch_{save_name}.json")
-    try:
-        with open(file_path, "w") as f:
-            json.dump(data, f, indent=2)
-        print(f"Saved to {file_path}")
-    except Exception as e:
-        print(f"Error saving to JSON: {e}")
+# Spill one sorted, duplicate-free run of (id, url) pairs to disk. Ids are
+# strings here, so 123 and "123" from different source files sort and group
+# as the same product.
+def write_run(pairs, run_dir, run_no):
+    pairs.sort()
+    run_path = os.path.join(run_dir, f"run_{run_no}.jsonl")
+    with open(run_path, "w", encoding="utf-8") as file:
+        for pair, _ in itertools.groupby(pairs):
+            file.write(json.dumps(pair, ensure_ascii=False) + "\n")
+    return run_path
+
+
+def read_run(run_path):
+    with open(run_path, "r", encoding="utf-8") as file:
+        for line in file:
+            yield json.loads(line)
+
+
+# Up to `cap` URLs taken round-robin over hosts, so a product keeps candidates on
+# many country domains instead of its first `cap` URLs from one or two of them
+def sample_by_host(by_host, cap=PRODUCT_URL_CAP):
+    queues = [iter(urls) for host, urls in sorted(by_host.items())]
+    sample = []
+    while queues and len(sample) < cap:
+        for queue in list(queues):
+            url = next(queue, None)
+            if url is None:
+                queues.remove(queue)
+            elif len(sample) < cap:
+                sample.append(url)
+    return sample
+
+
+# Merge the sorted runs and yield {id: [urls]} per product, in id order. Only
+# one product's URLs are in memory, at most `cap` per host.
+def merge_runs(run_paths, cap=PRODUCT_URL_CAP):
+    merged = heapq.merge(
+        *(read_run(path) for path in run_paths),
+        key=lambda pair: (str(pair[0]), pair[1]),
+    )
+    for id, group in itertools.groupby(merged, key=lambda pair: str(pair[0])):
+        by_host = {}
+        previous = None
+        for _, url in group:
+            if url == previous:
+                continue  # Same pair in two runs
+            previous = url
+            urls = by_host.setdefault(urlsplit(url).hostname or "", [])
+            if len(urls) < cap:
+                urls.append(url)
+        yield {f"{id}": sample_by_host(by_host, cap)}
+
+
+# Out-of-core replacement for the in-memory product_id_paginate + final.json pass:
+# canonical (id, url) pairs are sorted in runs of GROUP_RUN_SIZE and spilled to
+# a temp directory, the runs are merged by product id and the product_dict
+# batch files are written straight from the merge, in bounded memory
+def group_by_product(
+    file_pool,
+    output_dir,
+    batch_size=PRODUCT_BATCH_SIZE,
+    cap=PRODUCT_URL_CAP,
+    run_size=GROUP_RUN_SIZE,
+    report=None,
+    compact=False,
+):
+    os.makedirs(output_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=output_dir) as run_dir:
+        run_paths = []
+        pairs = []
+        for doc in streaming_json(file_pool):
+            if report is not None:
+                report.seen += 1
+            pairs.append((str(doc["id"]), canonical_url(doc["url"], report)))
+            if len(pairs) >= run_size:
+                run_paths.append(write_run(pairs, run_dir, len(run_paths)))
+                pairs = []
+        if pairs:
+            run_paths.append(write_run(pairs, run_dir, len(run_paths)))
+            pairs = []
+
+        batch_no = 0
+        product_count = 0
+        for batch in batched(merge_runs(run_paths, cap), batch_size):
+            batch_no += 1
+            product_count += len(batch)
+            if report is not None:
+                report.kept += sum(
+                    len(urls) for item in batch for urls in item.values()
+                )
+            if compact:
+                # Interned URL tables instead of full strings, see url_table.py
+                save_compact_batch(
+                    batch, os.path.join(output_dir, f"batch_{batch_no}.cjson")
+                )
+            else:
+                batch_path = os.path.join(output_dir, f"batch_{batch_no}.jsonl")
+                with NdjsonSink(batch_path, rotate_bytes=None, append=False) as sink:
+                    sink.write_many(batch)
+    return product_count, batch_no
 
 
 ##-----------------------------------------------------------------------------------
@@ -88,27 +192,16 @@ def main():
         {"id": "1236", "url": "url6"},
     ]
     """
-    # product_id = {}
-    # output_dir = "product_dict\\"
-    # final = []
-
-    # start = time.perf_counter()
-    # for doc in streaming_json(name_pool):
-    #     result = product_id_paginate(doc, product_dict=product_id)
-
-    # for id in result.keys():
-    #     result[id].sort()
-
-    # for id, url_list in result.items():
-    #     final.append({f"{id}": url_list})
-
-    # save_to_json(final, output_dir)
-
-    for data, batch_no in batching_data("product_dict\\final.json", 5000):
-        save_to_json(data, output_dir="product_dict", save_name=f"{batch_no}")
-
-    # end = time.perf_counter()
-    # print(f"Total processing time: {end - start} seconds.")
+    start = time.perf_counter()
+    report = DedupReport()
+    product_count, batch_count = group_by_product(
+        name_pool, "product_dict", report=report, compact=COMPACT_BATCHES
+    )
+    print(f"{product_count} products written to {batch_count} batch files.")
+    print(report.summary())
+
+    end = time.perf_counter()
+    print(f"Total processing time: {end - start} seconds.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+import json
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_PATH = "scraping_glamira.log"
+LOG_JSON = True  # One JSON object per line instead of the plain text format
+LOG_LEVEL = logging.INFO
+# Share of records kept per category, the rest are dropped in the calling thread
+LOG_SAMPLE_RATES = {"success": 0.01, "result": 0.1}
+# Categories never logged one by one: counted per (host, status) and written as
+# one summary line per key every LOG_AGGREGATE_INTERVAL seconds
+LOG_AGGREGATE = ["retryable", "exception"]
+LOG_AGGREGATE_INTERVAL = 10
+TEXT_FORMAT = "%(asctime)s %(levelname)s: %(message)s"
+JSON_FIELDS = ["category", "host", "status", "url", "count", "sample_every"]
+
+##-----------------------------------------------------------------------------------
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for field in JSON_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# Runs in the worker thread before the record is queued, so a dropped record
+# costs one dict update. Records are matched on their `category` extra field,
+# records without one always pass.
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_rates=None, aggregate=None):
+        super().__init__()
+        self.every = {
+            category: max(round(1 / rate), 1) if rate > 0 else 0
+            for category, rate in (sample_rates or {}).items()
+        }
+        self.aggregate = set(aggregate or [])
+        self.seen = {}  # category -> records seen
+        self.counts = {}  # (category, host, status) -> records since the last flush
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        category = getattr(record, "category", None)
+        if category is None:
+            return True
+        if category in self.aggregate:
+            key = (
+                category,
+                getattr(record, "host", None),
+                getattr(record, "status", None),
+            )
+            with self.lock:
+                self.counts[key] = self.counts.get(key, 0) + 1
+            return False
+        every = self.every.get(category)
+        if every is None:
+            return True
+        if every == 0:
+            return False
+        with self.lock:
+            seen = self.seen[category] = self.seen.get(category, 0) + 1
+        if seen % every:
+            return False
+        record.sample_every = every  # One line stands for this many records
+        return True
+
+    def take_counts(self):
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+
+# Logging that never blocks a crawl thread on the file: every handler on the
+# root logger is replaced by a QueueHandler, and a QueueListener thread does the
+# formatting and writing. stop() flushes the aggregates and drains the queue.
+class LogPipeline:
+    def __init__(
+        self,
+        path=LOG_PATH,
+        json_format=LOG_JSON,
+        level=LOG_LEVEL,
+        sample_rates=LOG_SAMPLE_RATES,
+        aggregate=LOG_AGGREGATE,
+        interval=LOG_AGGREGATE_INTERVAL,
+    ):
+        file_handler = logging.FileHandler(path, encoding="utf-8")
+        file_handler.setFormatter(
+            JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+        )
+        self.queue = queue.SimpleQueue()
+        self.listener = QueueListener(self.queue, file_handler)
+        self.sampler = SamplingFilter(sample_rates, aggregate)
+        self.queue_handler = QueueHandler(self.queue)
+        self.queue_handler.addFilter(self.sampler)
+        self.interval = interval
+        self.level = level
+        self.stopped = threading.Event()
+        self.logger = logging.getLogger("log_pipeline")
+
+    def start(self):
+        root = logging.getLogger()
+        self.previous = root.handlers[:], root.level
+        root.handlers = [self.queue_handler]
+        root.setLevel(self.level)
+        self.listener.start()
+        if self.sampler.aggregate:
+            thread = threading.Thread(target=self.run_aggregator, daemon=True)
+            thread.start()
+        return self
+
+    def run_aggregator(self):
+        while not self.stopped.wait(self.interval):
+            self.flush_aggregates()
+
+    # Summary lines skip the sampler, they go straight onto the queue
+    def flush_aggregates(self):
+        for (category, host, status), count in sorted(
+            self.sampler.take_counts().items(), key=str
+        ):
+            record = self.logger.makeRecord(
+                self.logger.name,
+                logging.WARNING,
+                __file__,
+                0,
+                f"{count} x {category} {status or ''} from {host} in the last "
+                f"{self.interval}s",
+                None,
+                None,
+                extra={
+                    "category": f"{category}_summary",
+                    "host": host,
+                    "status": status,
+                    "count": count,
+                },
+            )
+            self.queue.put_nowait(record)
+
+    def stop(self):
+        self.stopped.set()
+        self.flush_aggregates()
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        root = logging.getLogger()
+        root.handlers, level = self.previous
+        root.setLevel(level)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
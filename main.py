@@ -1,233 +1,576 @@
-import json  # LIb to work with JSON file
 import requests  # Lib to send HTTP request and receive HTML source code
 import time  # Time lib to measure execution time
 import random  # Randomizer lib to random the sleep time and randomly select user-agent
 import logging
-import re
+import codecs
+import sys
 from concurrent.futures import (
     ThreadPoolExecutor,
     as_completed,
-    TimeoutError,
+    wait,
+    FIRST_COMPLETED,
+    CancelledError,
 )  # Lib to create multi-thread runs
 from threading import Event
-from json_processing import streaming_json, save_to_json
-
-MAX_WORKERS = 6
-REQUEST_TIMEOUT = 12  # Tăng timeout lên một chút để xử lý các trang load chậm
-MAX_RETRIES = 3  # Số lần thử lại tối đa cho một URL
-RETRY_BACKOFF_FACTOR = 2  # Hệ số nhân cho thời gian chờ giữa các lần retry
-keys_map = [
-    "product_id",
-    "name",
-    "sku",
-    "attribute_set_id",
-    "attribute_set",
-    "type_id",
-    "price",
-    "min_price",
-    "max_price",
-    "min_price_format",
-    "max_price_format",
-    "gold_weight",
-    "none_metal_weight",
-    "fixed_silver_weight",
-    "material_design",
-    "qty",
-    "collection",
-    "collection_id",
-    "product_type",
-    "product_type_value",
-    "category",
-    "category_name",
-    "store_code",
-    "show_popup_quantity_eternity",
-    "visible_contents",
-    "gender",
-]
-logging.basicConfig(
-    filename="scraping_glamira.log",
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s: %(message)s",
+from collections import deque
+from functools import partial
+from json_processing import streaming_json
+from page_extract import PageScanner
+from hedging import WorkerLoad
+from parse_pool import ParsePipeline, parse_page, to_text
+from retry_scheduler import RetryScheduler, parse_retry_after, host_of
+from host_control import (
+    outcome_of_status,
+    OK,
+    ERROR,
+    HOST_POLL_INTERVAL,
 )
-stop_all_workers = Event()
+from url_canon import DedupReport, dedup_products
+from url_table import stream_compact_products
+from crawl_state import CrawlState, CheckpointedState, RECRAWL_TTL
+from sink import NdjsonSink
+from product_record import ProductRecord
+from log_pipeline import LogPipeline
+from transport import make_session, pool_stats, reuse_report, install_dns_cache
+from crawl_runtime import (
+    REQUEST_TIMEOUT,
+    MAX_RETRIES,
+    RETRY_BACKOFF_FACTOR,
+    STREAM_CHUNK_SIZE,
+    DRAIN_MAX_BYTES,
+    HEDGE_INITIAL,
+    HEDGE_MAX_IN_FLIGHT,
+    HEDGE_PERCENTILE,
+    HEDGE_MIN_DELAY,
+    EXTRACT_FIELDS,
+    USE_HTTP_CACHE,
+    CACHE_OFFLINE,
+    latency_tracker,
+    hedge_stats,
+    host_budget,
+    host_controller,
+    url_stats,
+    metrics,
+    http_cache,
+    extract_page_data,
+)
+from failures import (
+    failure,
+    kind_of_status,
+    kind_of_exception,
+    is_parse_failure,
+    RETRYABLE,
+    PARSE,
+    CANCELLED,
+    REDRIVE_WORKERS,
+    REDRIVE_MAX_RETRIES,
+    REDRIVE_BACKOFF_FACTOR,
+)
+
+# Request, retry, hedging and HTTP cache settings shared with the async engine
+# are in crawl_runtime.py
+ENGINE = (
+    "threads"  # "threads" (requests) or "async" (aiohttp, async_product_scraping.py)
+)
+MAX_WORKERS = 6  # URL threads, shared by every product in flight
+MAX_PRODUCTS_IN_FLIGHT = 4  # Số sản phẩm được crawl song song
+STREAM_RESPONSE = True  # Stop downloading once EXTRACT_FIELDS have been read
+PARSE_IN_PROCESSES = False  # Hand pages to a process pool for parsing (parse_pool.py)
+HOST_REPORT_INTERVAL = 30  # Seconds between per-host rate lines in the log
+COMPACT_URLS = True  # Read .cjson batches as interned CompactUrlList (url_table.py)
+RESULT_FORMAT = "jsonl"  # "jsonl", or "parquet"/"arrow" via columnar.py (needs pyarrow)
+METRICS_PATH = "crawl_metrics.prom"  # Prometheus text file, a ".json" path gives JSON
+LOG_QUEUE = True  # Background log writer with sampling (log_pipeline.py)
+REDRIVE = "--redrive" in sys.argv  # Only re-crawl URLs that failed retryably
+worker_load = WorkerLoad()  # Requests submitted to the URL threads, not done yet
 ##''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
 
 
-def product_scraping(id_url, headers_template=None, user_agents=None):
+def product_scraping(
+    id_url,
+    headers_template=None,
+    user_agents=None,
+    session=None,
+    executor=None,
+    parse_pipeline=None,
+):
+    # Each product gets its own stop event (cancellation scope), so a success for
+    # this product only cancels this product's remaining URLs. The session and
+    # executor can be shared between many products running at the same time.
+    if session is None or executor is None:
+        with make_session(MAX_WORKERS) as own_session:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as own_executor:
+                return product_scraping(
+                    id_url,
+                    headers_template,
+                    user_agents,
+                    own_session,
+                    own_executor,
+                    parse_pipeline,
+                )
+
     result = None
     faulty_package = []
-
-    with requests.Session() as session:
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_id = {}
-            for id, url_list in id_url.items():
-                if stop_all_workers.is_set():
-                    break  # Break the loop if stop signal is already set
-
-                for url in url_list:
-                    try:
-                        headers = {
-                            **headers_template,
-                            "User-Agent": random.choice(user_agents),
-                        }
-
-                        future = executor.submit(
-                            request_data, session, url, headers, stop_all_workers
-                        )
-                        future_to_id[future] = future
-                    except Exception as e:
-                        print(f"Error during submission: {e}")
-                        logging.error(f"Error during submission: {e}")
-                        return result, faulty_package
-
-            while future_to_id:
-                if stop_all_workers.is_set():
-                    break  # Break the loop if stop signal is already set
-
-                try:
-                    done_futures = as_completed(future_to_id, timeout=REQUEST_TIMEOUT)
-                    for future in done_futures:
-                        original_data = future_to_id.pop(future)
-                        product_data = future.result()
-
-                        if "success" in product_data:
-                            result = product_data["success"]
-                            logging.info(f"Successfully added to result: {url}")
-                            stop_all_workers.set()
-                            for f in future_to_id:
-                                f.cancel()
-                            future_to_id.clear()
-                            break
-
-                        elif "retry" in product_data:
-                            retry_count = product_data.get("retry_count")
-
-                            if retry_count < MAX_RETRIES:
-                                sleep_time = random.uniform(0.5, 1.5) * (
-                                    RETRY_BACKOFF_FACTOR**retry_count
-                                )
-                                time.sleep(sleep_time)
-
-                                # retry submitting task
-                                data_to_retry = product_data.get("retry")
-                                prev_user_agent = product_data["ua"]
-                                available_agents = [
-                                    ua for ua in user_agents if ua != prev_user_agent
-                                ]
-                                if not available_agents:
-                                    available_agents = (
-                                        user_agents  # fallback if all are used
-                                    )
-
-                                new_headers = {
-                                    **headers_template,
-                                    "User-Agent": random.choice(available_agents),
-                                }
-                                new_future = executor.submit(
-                                    request_data,
-                                    session,
-                                    data_to_retry,
-                                    new_headers,
-                                    stop_all_workers,
-                                    retry_count,
-                                )
-                                future_to_id[new_future] = data_to_retry
-                            else:
-                                faulty_package.append(product_data["failed"])
-                                logging.warning(
-                                    f"Max retries reached for {data_to_retry}"
-                                )
-                        else:
-                            faulty_package.append(product_data)
-                            logging.warning(
-                                f"Faulty result for id {id}: {product_data}"
-                            )
-                    if stop_all_workers.is_set():
-                        break  # Break the loop if stop signal is already set
-
-                except TimeoutError:
-                    # Timeout reached, check if stop_all_workers is set
-                    print("Timeout for this url, waiting for futures to complete...")
-                    # if stop_all_workers.is_set():
-                    #     break
-                    continue
-                except Exception as e:
-                    original_data = product_data
-                    logging.error(f"Error processing: {e}")
+    stop_event = Event()
+    future_to_url = {}
+    requests_sent = 0
+    hedges = 0
+
+    # Candidate queue of (url, retry_count, previous user agent), hosts and URL
+    # patterns with the best success/latency history first
+    candidates = deque()
+    for id, url_list in id_url.items():
+        candidates.extend((url, 0, None) for url in url_stats.rank(url_list))
+
+    started = {}  # URL -> when a worker began its request
+
+    def run_request(url, *args):
+        started[url] = time.perf_counter()
+        return request_data(session, url, *args)
+
+    # Take the first candidate whose host has a free slot in host_controller
+    def next_candidate():
+        for index, candidate in enumerate(candidates):
+            if host_controller.try_acquire(host_of(candidate[0])):
+                del candidates[index]
+                return candidate
+        return None
+
+    def launch(count):
+        nonlocal requests_sent
+        launched = 0
+        while candidates and launched < count:
+            candidate = next_candidate()
+            if candidate is None:
+                break  # Every candidate host is at its limit
+            url, retry_count, prev_user_agent = candidate
+            available_agents = [ua for ua in user_agents if ua != prev_user_agent]
+            if not available_agents:
+                available_agents = user_agents  # fallback if all are used
+            headers = {
+                **headers_template,
+                "User-Agent": random.choice(available_agents),
+            }
+            future = executor.submit(
+                run_request,
+                url,
+                headers,
+                stop_event,
+                retry_count,
+                parse_pipeline,
+            )
+            future.add_done_callback(partial(release_host_slot, host_of(url)))
+            worker_load.submitted()
+            future.add_done_callback(worker_load.finished)
+            future_to_url[future] = url
+            requests_sent += 1
+            launched += 1
+        return launched
+
+    initial = HEDGE_INITIAL if HEDGE_INITIAL else len(candidates)
+    retry_scheduler = RetryScheduler(
+        MAX_RETRIES, RETRY_BACKOFF_FACTOR, host_budget, metrics
+    )
+
+    while (future_to_url or candidates or retry_scheduler) and not stop_event.is_set():
+        # Retries whose backoff is over join the back of the candidate queue
+        candidates.extend(retry_scheduler.pop_due())
+        try:
+            launch(initial - len(future_to_url))
+        except Exception as e:
+            print(f"Error during submission: {e}")
+            logging.error(f"Error during submission: {e}")
+            break
+
+        if not future_to_url:
+            # Nothing in flight: retries wait for their due time, candidates
+            # wait for a slot on their host
+            delay = retry_scheduler.next_delay()
+            if candidates:
+                delay = min(delay or HOST_POLL_INTERVAL, HOST_POLL_INTERVAL)
+            stop_event.wait(delay)
+            continue
+
+        hedge_delay = None
+        if HEDGE_INITIAL:
+            hedge_delay = latency_tracker.percentile(HEDGE_PERCENTILE)
+            hedge_delay = min(max(hedge_delay, HEDGE_MIN_DELAY), REQUEST_TIMEOUT)
+        timeout = hedge_delay or REQUEST_TIMEOUT
+        if hedge_delay:
+            # Hedge clock from when a worker began the youngest request, one
+            # still queued behind other products' requests is not slow yet
+            now = time.perf_counter()
+            youngest = min(
+                now - started.get(url, now) for url in future_to_url.values()
+            )
+            timeout = max(hedge_delay - youngest, HOST_POLL_INTERVAL)
+        retry_due = retry_scheduler.next_delay()
+        if retry_due is not None and retry_due < timeout:
+            timeout = retry_due
+            hedge_delay = None
+        done_futures, _ = wait(
+            future_to_url, timeout=timeout, return_when=FIRST_COMPLETED
+        )
+
+        if not done_futures:
+            # Every in-flight URL has run past the latency percentile, race one
+            # more candidate next to them if a worker is free to start it now
+            now = time.perf_counter()
+            youngest = min(
+                now - started.get(url, now) for url in future_to_url.values()
+            )
+            if (
+                hedge_delay
+                and youngest >= hedge_delay
+                and len(future_to_url) < HEDGE_MAX_IN_FLIGHT
+                and worker_load.has_idle_worker(MAX_WORKERS)
+            ):
+                candidates.extend(retry_scheduler.pop_due())
+                hedges += launch(1)
+            continue
+
+        for future in done_futures:
+            url = future_to_url.pop(future)
+            try:
+                product_data = future.result()
+            except CancelledError:
+                continue
+            except Exception as e:
+                logging.error(f"Error processing: {e}")
+                faulty_package.append(failure(url, kind_of_exception(e), reason=str(e)))
+                continue
+
+            if "success" in product_data:
+                result = product_data["success"]
+                logging.info(
+                    f"Successfully added to result: {url}",
+                    extra={"category": "result", "url": url},
+                )
+                stop_event.set()
+                break
+
+            elif "retry" in product_data:
+                data_to_retry = product_data.get("retry")
+                retry_item = (
+                    data_to_retry,
+                    product_data.get("retry_count"),
+                    product_data["ua"],
+                )
+                # Filed on the timer heap, the loop keeps handling other URLs
+                if not retry_scheduler.schedule(
+                    data_to_retry, retry_item, product_data.get("retry_after")
+                ):
                     faulty_package.append(
-                        {
-                            f"{e}": original_data.items(),
-                        }
+                        failure(
+                            data_to_retry,
+                            product_data.get("kind", RETRYABLE),
+                            product_data.get("status"),
+                            "Max retries reached",
+                        )
+                    )
+                    logging.warning(
+                        f"Max retries reached for {data_to_retry}",
+                        extra={"category": "max_retries", "url": data_to_retry},
                     )
-                    continue
-    # Cancel any remaining futures if a success was found
-    if stop_all_workers.is_set():
-        for future in future_to_id:
-            future.cancel()
+            else:
+                faulty_package.append(
+                    product_data.get("failed") or failure(url, CANCELLED)
+                )
+                logging.warning(
+                    f"Faulty result for id {id}: {product_data}",
+                    extra={"category": "faulty"},
+                )
+
+    # Cancel the remaining URLs of this product only, running ones see stop_event
+    stop_event.set()
+    for future in future_to_url:
+        future.cancel()
+    hedge_stats.record_product(requests_sent, hedges, result is not None)
     return result, faulty_package
 
 
-def request_data(session, url, headers, stop_event, retry_count=0):
+# Done callback of every request_data future: give the host slot back and feed
+# the response into the host's AIMD limit
+def release_host_slot(host, future):
+    if future.cancelled():
+        host_controller.release(host)
+        return
+    try:
+        product_data = future.result()
+    except Exception:
+        host_controller.release(host, ERROR)
+        return
+    if "retry" in product_data:
+        host_controller.release(host, outcome_of_status(product_data.get("status")))
+    elif "cancelled" in product_data:
+        host_controller.release(host)
+    else:
+        host_controller.release(host, OK)
+
+
+# Keep up to MAX_PRODUCTS_IN_FLIGHT products racing on one shared session and
+# URL thread pool, yield (product_id, result, faulty_package) as each finishes
+def scrape_products(id_url_stream, headers_template=None, user_agents=None):
+    parse_pipeline = ParsePipeline() if PARSE_IN_PROCESSES else None
+    session = make_session(MAX_WORKERS)
+    try:
+        with session:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                with ThreadPoolExecutor(
+                    max_workers=MAX_PRODUCTS_IN_FLIGHT
+                ) as product_executor:
+                    in_flight = {}  # future -> product id
+                    for id_url in id_url_stream:
+                        future = product_executor.submit(
+                            product_scraping,
+                            id_url,
+                            headers_template,
+                            user_agents,
+                            session,
+                            executor,
+                            parse_pipeline,
+                        )
+                        in_flight[future] = next(iter(id_url), None)
+                        metrics.queue_depth("products_in_flight", len(in_flight))
+                        if len(in_flight) >= MAX_PRODUCTS_IN_FLIGHT:
+                            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                yield (in_flight.pop(future), *future.result())
+
+                    for future in as_completed(in_flight):
+                        yield (in_flight[future], *future.result())
+    finally:
+        logging.info(f"Connection reuse:\n{reuse_report(pool_stats(session))}")
+        if parse_pipeline:
+            parse_pipeline.close()
+
+
+def request_data(session, url, headers, stop_event, retry_count=0, parse_pipeline=None):
     if stop_event.is_set():
         return {"cancelled": url}  # Immediately return if the stop event is set
 
+    entry = http_cache.lookup(url) if USE_HTTP_CACHE or CACHE_OFFLINE else None
+    if CACHE_OFFLINE:
+        page_data = http_cache.page(entry, EXTRACT_FIELDS) if entry else None
+        if page_data is None:
+            return {"failed": failure(url, RETRYABLE, reason="Not in the HTTP cache")}
+        return {"success": ProductRecord.from_page(url, page_data)}
+    if entry and entry.replayable(EXTRACT_FIELDS):
+        headers = {**headers, **entry.validators()}
+
     try:
-        response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
-
-        if response.status_code in [200, 201]:
-            product_data = {"url": url}
-            logging.info(f"Successed: {url}")
-            react_data = extract_react_data(response.text)
-            if react_data:
-                for key, value in react_data.items():
-                    if key in keys_map:
-                        product_data[key] = value
-            else:
-                product_data.append({"value": "nothing found"})
-            return {
-                "success": product_data,
-            }
+        start = time.perf_counter()
+        response = session.get(
+            url, headers=headers, timeout=REQUEST_TIMEOUT, stream=STREAM_RESPONSE
+        )
+        host = host_of(url)
+        # elapsed stops at the response headers, before any of the body is read
+        ttfb = response.elapsed.total_seconds()
+        metrics.observe("ttfb", ttfb)
+        metrics.response(host, response.status_code)
 
-        elif response.status_code in [403, 429, 500, 502, 503, 504]:
-            logging.warning(f"Retryable error {response.status_code} for {url}")
-            return {
-                "retry": url,
-                "ua": headers["User-Agent"],
-                "retry_count": retry_count + 1,
-            }
-        else:
-            logging.error(f"Non-retryable error {response.status_code} for {url}")
-            return {f"{response.status_code}": url}
+        try:
+            if response.status_code == 304:
+                # Unchanged since it was cached: no body to read, nothing to parse
+                elapsed = time.perf_counter() - start
+                latency_tracker.record(elapsed)
+                url_stats.record(url, True, elapsed)
+                page_data = http_cache.page(entry, EXTRACT_FIELDS) if entry else None
+                if page_data is None:
+                    # Nothing to replay (body gone meanwhile): the retry asks
+                    # again without validators
+                    http_cache.forget(url)
+                    logging.warning(
+                        f"Nothing cached to answer 304 for {url}",
+                        extra={"category": "retryable", "host": host, "status": 304},
+                    )
+                    return {
+                        "retry": url,
+                        "ua": headers["User-Agent"],
+                        "retry_count": retry_count + 1,
+                        "status": 304,
+                        "kind": RETRYABLE,
+                    }
+                if is_parse_failure(page_data, EXTRACT_FIELDS):
+                    return {"failed": failure(url, PARSE, 304, "No react_data found")}
+                return {"success": ProductRecord.from_page(url, page_data)}
+
+            if response.status_code in [200, 201]:
+                complete = True
+                if STREAM_RESPONSE:
+                    content, complete = read_until_extracted(response, stop_event)
+                    if content is None:
+                        metrics.received(host, response.raw.tell())
+                        return {"cancelled": url}  # A sibling URL already won
+                else:
+                    content = response.content
+                elapsed = time.perf_counter() - start
+                latency_tracker.record(elapsed)
+                url_stats.record(url, True, elapsed)
+                metrics.observe("body", max(elapsed - ttfb, 0))
+                if not complete:
+                    drain(response)  # After the timings, it is not page latency
+                metrics.received(host, response.raw.tell())
+
+                logging.info(
+                    f"Successed: {url}",
+                    extra={"category": "success", "host": host, "url": url},
+                )
+                parse_start = time.perf_counter()
+                if parse_pipeline:
+                    # Parse in a worker process, off the GIL-bound I/O threads
+                    page_data = parse_pipeline.parse(
+                        parse_page, content, response.encoding, EXTRACT_FIELDS
+                    )
+                else:
+                    page_data = extract_page_data(to_text(content, response.encoding))
+                metrics.observe("parse", time.perf_counter() - parse_start)
+                if USE_HTTP_CACHE:
+                    # A streamed body may stop right after the wanted fields
+                    http_cache.store(
+                        url,
+                        content,
+                        response.encoding,
+                        response.headers,
+                        EXTRACT_FIELDS,
+                        page_data,
+                        complete=complete,
+                    )
+                if is_parse_failure(page_data, EXTRACT_FIELDS):
+                    logging.warning(
+                        f"No react_data found: {url}",
+                        extra={"category": "no_react_data", "url": url},
+                    )
+                    return {
+                        "failed": failure(
+                            url, PARSE, response.status_code, "No react_data found"
+                        )
+                    }
+                product_data = ProductRecord.from_page(url, page_data)
+                return {
+                    "success": product_data,
+                }
+
+            elapsed = time.perf_counter() - start
+            latency_tracker.record(elapsed)
+            url_stats.record(url, False, elapsed)
+            if response.status_code in [403, 429, 500, 502, 503, 504]:
+                logging.warning(
+                    f"Retryable error {response.status_code} for {url}",
+                    extra={
+                        "category": "retryable",
+                        "host": host,
+                        "status": response.status_code,
+                    },
+                )
+                retry_after = None
+                if response.status_code in [429, 503]:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                return {
+                    "retry": url,
+                    "ua": headers["User-Agent"],
+                    "retry_count": retry_count + 1,
+                    "retry_after": retry_after,
+                    "status": response.status_code,
+                    "kind": RETRYABLE,
+                }
+            else:
+                logging.error(
+                    f"Non-retryable error {response.status_code} for {url}",
+                    extra={
+                        "category": "http_error",
+                        "host": host,
+                        "status": response.status_code,
+                    },
+                )
+                return {
+                    "failed": failure(
+                        url,
+                        kind_of_status(response.status_code),
+                        response.status_code,
+                        f"Status code {response.status_code}",
+                    )
+                }
+        finally:
+            # Drops the connection if the body was not read (or drained) to the end
+            response.close()
     except requests.exceptions.RequestException as e:
-        logging.error(f"Exception occurred: {e}.")
+        logging.error(
+            f"Exception occurred: {e}.",
+            extra={
+                "category": "exception",
+                "host": host_of(url),
+                "status": type(e).__name__,
+            },
+        )
+        url_stats.record(url, False)
+        metrics.response(host_of(url), None)
         return {
             "retry": url,
             "ua": headers["User-Agent"],
             "retry_count": retry_count + 1,
+            "kind": kind_of_exception(e),
         }
 
 
-def extract_react_data(html_text):
-    match = re.search(r"var\s+react_data\s*=\s*(\{.*?\});", html_text, re.DOTALL)
-    if match:
-        json_text = match.group(1)
-        # Sometimes JS uses single quotes or has trailing commas; fix if needed
-        try:
-            data = json.loads(json_text)
-        except Exception:
-            # Try to fix common JS-to-JSON issues
-            json_text = json_text.replace("'", '"')
-            json_text = re.sub(r",\s*}", "}", json_text)
-            json_text = re.sub(r",\s*]", "]", json_text)
-            data = json.loads(json_text)
-        return data
-    return None
+# Read a streamed response chunk by chunk and stop as soon as everything in
+# EXTRACT_FIELDS has arrived, or return None when the product's stop_event fires.
+# The flag says whether the body was read to the end.
+def read_until_extracted(response, stop_event):
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(
+        errors="replace"
+    )
+    text = ""
+    scanner = PageScanner(EXTRACT_FIELDS)
+
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+        if stop_event.is_set():
+            return None, False
+
+        text += decoder.decode(chunk)
+        if scanner.feed(text):
+            return text, False
+
+    return text + decoder.decode(b"", final=True), True
+
+
+# Read and discard the rest of a body cut off by read_until_extracted, so its
+# keep-alive connection goes back to the pool instead of being closed. Only
+# for a short rest: past DRAIN_MAX_BYTES a new connection (one handshake) is
+# cheaper than downloading the page to the end, and the connection is dropped.
+def drain(response):
+    length = response.headers.get("Content-Length", "")
+    if length.isdigit() and int(length) - response.raw.tell() > DRAIN_MAX_BYTES:
+        return False
+    start = response.raw.tell()
+    for _ in response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+        if response.raw.tell() - start > DRAIN_MAX_BYTES:
+            return False
+    return True
 
 
 ##''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
 
 
+# Re-drive runs fetch only the URLs the crawl state has as failed with a
+# retryable kind (failures.REDRIVE_KINDS), with fewer workers and longer backoff
+def use_redrive_settings():
+    global MAX_WORKERS, MAX_RETRIES, RETRY_BACKOFF_FACTOR
+    MAX_WORKERS = REDRIVE_WORKERS
+    MAX_RETRIES = REDRIVE_MAX_RETRIES
+    RETRY_BACKOFF_FACTOR = REDRIVE_BACKOFF_FACTOR
+
+
 def main():
+    if LOG_QUEUE:
+        log_pipeline = LogPipeline().start()
+    else:
+        logging.basicConfig(
+            filename="scraping_glamira.log",
+            level=logging.INFO,
+            format="%(asctime)s %(levelname)s: %(message)s",
+        )
+
     user_agents = [
         "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.1.1 Safari/605.1.15",
         "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.97 Safari/537.36",
@@ -253,31 +596,97 @@ def main():
     faulty_output_dir = "faulty\\"
     result_output_dir = "result\\"
 
-    global stop_all_workers
-    stop_all_workers.clear()
-
-    final_result = []
-    final_faulty = []
-
-    for id_url in streaming_json(test_path):
-        start_time = time.perf_counter()
-
-        result, faulty_package = product_scraping(id_url, headers_template, user_agents)
+    # Every finished product is appended to the outputs right away and committed
+    # to the state store once the outputs are on disk, a rerun after a crash or
+    # Ctrl-C only crawls products that are not done yet
+    crawl_state = CrawlState()
+    if RESULT_FORMAT == "jsonl":
+        result_sink = NdjsonSink(result_output_dir + "NEW_result.jsonl")
+    else:
+        from columnar import ColumnarWriter
+
+        # Part files of every run side by side in the NEW_result directory
+        result_sink = ColumnarWriter(
+            result_output_dir + "NEW_result", format=RESULT_FORMAT
+        )
+    faulty_sink = NdjsonSink(faulty_output_dir + "NEW_faulty.jsonl")
+    state_writer = CheckpointedState(crawl_state, [result_sink, faulty_sink])
+    product_count = 0
+
+    def collect(product_id, result, faulty_package):
+        nonlocal product_count
         print(result)
-        stop_all_workers.clear()
-
-        final_result.append(result)
-        final_faulty.append(faulty_package)
-
-        end_time = time.perf_counter()
-        print(f"Processing time for this batch: {end_time - start_time} seconds.")
-
-    if final_faulty:
-        print(f"Faulty URLs: {len(final_faulty)}")
-        save_to_json(final_faulty, output_dir=faulty_output_dir, save_name="NEW_faulty")
-    if final_result:
-        print(f"Data crawled success: {len(final_result)}")
-        save_to_json(final_result, output_dir=result_output_dir, save_name="NEW_result")
+        product_count += 1
+        if result:
+            # ProductRecord as is for the columnar writer, as a dict for NDJSON
+            result_sink.write(result if RESULT_FORMAT != "jsonl" else result.to_dict())
+        if faulty_package:
+            faulty_sink.write({"product_id": product_id, "faulty": faulty_package})
+        state_writer.record_product(
+            product_id, result.to_dict() if result else None, faulty_package
+        )
+
+    # Same page under tracking params or another query order is fetched once
+    url_report = DedupReport()
+    if REDRIVE:
+        use_redrive_settings()
+        id_url_stream = crawl_state.failed_products()
+    elif COMPACT_URLS:
+        id_url_stream = stream_compact_products(test_path, url_report)
+    else:
+        id_url_stream = dedup_products(streaming_json(test_path), url_report)
+    if not REDRIVE:
+        id_url_stream = crawl_state.pending_products(id_url_stream, RECRAWL_TTL)
+
+    install_dns_cache()
+    host_controller.start_reporter(HOST_REPORT_INTERVAL)
+    metrics.start_exporter(METRICS_PATH)
+    start_time = time.perf_counter()
+    try:
+        if ENGINE == "async":
+            import asyncio
+            import async_product_scraping
+
+            if REDRIVE:
+                async_product_scraping.MAX_RETRIES = REDRIVE_MAX_RETRIES
+                async_product_scraping.RETRY_BACKOFF_FACTOR = REDRIVE_BACKOFF_FACTOR
+                async_product_scraping.MAX_PRODUCTS_IN_FLIGHT = REDRIVE_WORKERS
+            asyncio.run(
+                async_product_scraping.scrape_products(
+                    id_url_stream, headers_template, user_agents, collect
+                )
+            )
+        else:
+            for product_id, result, faulty_package in scrape_products(
+                id_url_stream, headers_template, user_agents
+            ):
+                collect(product_id, result, faulty_package)
+    except KeyboardInterrupt:
+        print("Interrupted, finished products are kept in the crawl state.")
+    finally:
+        state_writer.commit()
+        result_sink.close()
+        faulty_sink.close()
+        print(crawl_state.summary())
+        print(crawl_state.failure_summary())
+        crawl_state.close()
+        metrics.export(METRICS_PATH)
+        if USE_HTTP_CACHE or CACHE_OFFLINE:
+            print(http_cache.summary())
+            http_cache.close()
+        if LOG_QUEUE:
+            log_pipeline.stop()
+
+    end_time = time.perf_counter()
+    url_stats.save()
+    print(url_report.summary())
+    print(hedge_stats.summary())
+    print(host_controller.report())
+    print(
+        f"Processing time for {product_count} products: {end_time - start_time} seconds."
+    )
+    print(f"Products with faulty URLs: {faulty_sink.count}")
+    print(f"Data crawled success: {result_sink.count}")
 
 
 ##''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
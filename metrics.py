@@ -0,0 +1,212 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+METRICS_INTERVAL = 15  # Seconds between two exports of the metrics file
+# Upper bounds in seconds, one histogram per phase
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60]
+# connect: opening a new connection (TLS included), ttfb: request sent -> headers in
+# (connect included), body: headers -> body read, parse: page extraction,
+# backoff: wait before a retry
+PHASES = ["connect", "ttfb", "body", "parse", "backoff"]
+
+##-----------------------------------------------------------------------------------
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Upper bound of the bucket holding the q-quantile, None without samples
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+# Counters and histograms of one crawler, fed from request_data / souping_data
+# / fetch. Every update is a dict or list increment under one lock, the
+# formatting and file writes happen in export() off the hot path.
+class CrawlMetrics:
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.responses = {}  # (host, status) -> count, status "error" = no response
+        self.bytes = {}  # host -> body bytes received
+        self.retries = {}  # host -> retries scheduled
+        self.queues = {}  # queue name -> current depth
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def observe(self, phase, seconds):
+        with self.lock:
+            self.phases[phase].observe(seconds)
+
+    def response(self, host, status):
+        key = (host, status if status is not None else "error")
+        with self.lock:
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def received(self, host, nbytes):
+        with self.lock:
+            self.bytes[host] = self.bytes.get(host, 0) + nbytes
+
+    def retry(self, host):
+        with self.lock:
+            self.retries[host] = self.retries.get(host, 0) + 1
+
+    def queue_depth(self, name, depth):
+        self.queues[name] = depth  # Plain assignment, the GIL keeps it whole
+
+    def snapshot(self):
+        with self.lock:
+            phases = {
+                phase: {
+                    "buckets": histogram.buckets,
+                    "counts": list(histogram.counts),
+                    "sum": histogram.sum,
+                    "count": histogram.count,
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                }
+                for phase, histogram in self.phases.items()
+            }
+            responses = {}
+            for (host, status), count in self.responses.items():
+                responses.setdefault(host, {})[str(status)] = count
+            return {
+                "crawler": self.crawler,
+                "time": time.time(),
+                "uptime": time.time() - self.started,
+                "phases": phases,
+                "responses": responses,
+                "bytes": dict(self.bytes),
+                "retries": dict(self.retries),
+                "queues": dict(self.queues),
+            }
+
+    # Prometheus text exposition format, for node_exporter's textfile collector
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        crawler = f'crawler="{self.crawler}"'
+        lines = ["# TYPE glamira_phase_seconds histogram"]
+        for phase, histogram in snapshot["phases"].items():
+            labels = f'{crawler},phase="{phase}"'
+            cumulative = 0
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                cumulative += count
+                lines.append(
+                    f'glamira_phase_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'glamira_phase_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}'
+            )
+            lines.append(f"glamira_phase_seconds_sum{{{labels}}} {histogram['sum']}")
+            lines.append(
+                f"glamira_phase_seconds_count{{{labels}}} {histogram['count']}"
+            )
+
+        lines.append("# TYPE glamira_responses_total counter")
+        for host, statuses in sorted(snapshot["responses"].items()):
+            for status, count in sorted(statuses.items()):
+                lines.append(
+                    f'glamira_responses_total{{{crawler},host="{host}",status="{status}"}} {count}'
+                )
+        lines.append("# TYPE glamira_body_bytes_total counter")
+        for host, count in sorted(snapshot["bytes"].items()):
+            lines.append(f'glamira_body_bytes_total{{{crawler},host="{host}"}} {count}')
+        lines.append("# TYPE glamira_retries_total counter")
+        for host, count in sorted(snapshot["retries"].items()):
+            lines.append(f'glamira_retries_total{{{crawler},host="{host}"}} {count}')
+        lines.append("# TYPE glamira_queue_depth gauge")
+        for name, depth in sorted(snapshot["queues"].items()):
+            lines.append(f'glamira_queue_depth{{{crawler},queue="{name}"}} {depth}')
+        return "\n".join(lines) + "\n"
+
+    # Whole file replaced at once, a scraper never reads half a snapshot.
+    # ".json" paths get the JSON snapshot, anything else Prometheus text.
+    def export(self, path):
+        if path.endswith(".json"):
+            text = json.dumps(self.snapshot(), indent=2)
+        else:
+            text = self.to_prometheus()
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temp_path, path)
+
+    # Export every `interval` seconds from a daemon thread
+    def start_exporter(self, path, interval=METRICS_INTERVAL):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.export(path)
+                except OSError as e:
+                    print(f"Metrics export failed: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+##-----------------------------------------------------------------------------------
+
+connect_metrics = []  # CrawlMetrics fed by the patched urllib3 connect()
+
+
+# requests does not say whether a request opened a new connection or how long
+# that took, so urllib3's connect() is timed for every CrawlMetrics registered here
+def track_connects(metrics):
+    if metrics in connect_metrics:
+        return
+    connect_metrics.append(metrics)
+    if len(connect_metrics) > 1:
+        return
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+
+    for connection_class in [HTTPConnection, HTTPSConnection]:
+        connect = connection_class.connect
+
+        def timed_connect(self, connect=connect):
+            start = time.perf_counter()
+            try:
+                return connect(self)
+            finally:
+                elapsed = time.perf_counter() - start
+                for metrics in connect_metrics:
+                    metrics.observe("connect", elapsed)
+
+        connection_class.connect = timed_connect
+
+
+# Same for aiohttp, through its tracing signals
+def aiohttp_trace_config(metrics):
+    import aiohttp
+
+    async def on_connection_create_start(session, context, params):
+        context.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(session, context, params):
+        metrics.observe("connect", time.perf_counter() - context.connect_start)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
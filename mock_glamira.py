@@ -0,0 +1,155 @@
+import random
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bench_react_data import HTML_GLOB, load_pages
+from react_data import find_object_start
+
+MOCK_PORT = 8765
+SLOW_BODY_CHUNK = 8 * 1024  # Bytes sent per step of a slow body
+SLOW_BODY_SECONDS = 1.0  # Time a slow body takes from first to last byte
+INJECTED_STATUSES = {"403": [403], "429": [429], "5xx": [500, 502, 503]}
+# One profile per fake country domain. Each is served on its own loopback
+# address (127.0.0.2, 127.0.0.3, ...) so host_of() tells them apart without DNS.
+# latency: (median seconds, lognormal sigma) before the headers are sent,
+# "403"/"429"/"5xx": share of requests answered with that error,
+# slow_body: share of pages sent over SLOW_BODY_SECONDS.
+MOCK_HOSTS = [
+    {"host": "www.glamira.de", "latency": (0.40, 0.8), "403": 0.60, "429": 0.05},
+    {"host": "www.glamira.fr", "latency": (0.25, 0.6), "403": 0.15, "5xx": 0.05},
+    {"host": "www.glamira.sk", "latency": (0.15, 0.4), "slow_body": 0.10},
+    {"host": "www.glamira.ee", "latency": (0.10, 0.3)},
+    {"host": "www.glamira.dk", "latency": (0.20, 0.5), "429": 0.10, "5xx": 0.02},
+]
+
+##-----------------------------------------------------------------------------------
+
+
+def host_address(index):
+    return f"127.0.0.{index + 2}"
+
+
+# Recorded pages (HTML_GLOB) with a react_data object, synthetic ones otherwise
+def react_data_pages(pattern=HTML_GLOB):
+    pages = [
+        text.encode("utf-8")
+        for text in load_pages(pattern).values()
+        if find_object_start(text) >= 0
+    ]
+    return pages
+
+
+# Stand-in for the glamira country sites: every request gets the latency of
+# its host's profile, then maybe an injected 403/429/5xx, then a product page,
+# sometimes dribbled out slowly. Paths containing "missing" answer 404, a
+# matching If-None-Match gets a 304.
+class MockGlamira(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=MOCK_PORT, hosts=None, pages=None):
+        self.profiles = {
+            host_address(index): profile
+            for index, profile in enumerate(hosts or MOCK_HOSTS)
+        }
+        self.pages = pages or react_data_pages()
+        self.counts = Counter()  # (host, status) -> requests
+        self.lock = threading.Lock()
+        super().__init__(("", port), MockHandler)
+
+    def url(self, index, path):
+        return f"http://{host_address(index)}:{self.server_address[1]}{path}"
+
+    def count(self, host, status):
+        with self.lock:
+            self.counts[host, status] += 1
+
+    def handle_error(self, request, client_address):
+        pass  # Clients hang up mid-body all the time (cancelled/hedged requests)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        address = self.connection.getsockname()[0]
+        profile = self.server.profiles.get(address, {})
+        host = profile.get("host", address)
+
+        median, sigma = profile.get("latency", (0.1, 0.0))
+        time.sleep(median * random.lognormvariate(0, sigma))
+
+        status = 200
+        draw = random.random()
+        for key, codes in INJECTED_STATUSES.items():
+            if draw < profile.get(key, 0):
+                status = random.choice(codes)
+                break
+            draw -= profile.get(key, 0)
+        if status == 200 and "missing" in self.path:
+            status = 404
+
+        if status != 200:
+            self.server.count(host, status)
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        # Same page for the same path on every request, so ETags can match
+        pages = self.server.pages
+        body = pages[zlib.crc32(self.path.encode()) % len(pages)]
+        etag = f'"{zlib.crc32(body):08x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.server.count(host, 304)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.server.count(host, 200)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if random.random() < profile.get("slow_body", 0):
+            step = SLOW_BODY_SECONDS * SLOW_BODY_CHUNK / len(body)
+            for start in range(0, len(body), SLOW_BODY_CHUNK):
+                self.wfile.write(body[start : start + SLOW_BODY_CHUNK])
+                self.wfile.flush()
+                time.sleep(step)
+        else:
+            self.wfile.write(body)
+
+
+##-----------------------------------------------------------------------------------
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else MOCK_PORT
+    server = MockGlamira(port)
+    for index, profile in enumerate(MOCK_HOSTS):
+        print(f"{profile['host']:<16} {server.url(index, '/')}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    for (host, status), count in sorted(server.counts.items()):
+        print(f"{host:<16} {status}: {count}")
+
+
+if __name__ == "__main__":
+    main()
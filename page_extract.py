@@ -0,0 +1,53 @@
+import re
+from react_data import keys_map, extract_fields, ReactDataScanner
+from title_parser import extract_title, TITLE_CLASS
+
+TITLE = "title"
+PAGE_FIELDS = [TITLE, *keys_map]  # What every crawler pulls out of a fetched page
+# A whole <h1 ...> start tag with page-title as one of its classes, so the text
+# "page-title" in CSS or a script does not count
+TITLE_TAG = re.compile(
+    rf"""<h1\b[^>]*?\bclass\s*=\s*["']?[^"'>]*?(?<![\w-]){re.escape(TITLE_CLASS)}(?![\w-])[^>]*>""",
+    re.IGNORECASE,
+)
+TAG_OVERLAP = 1024  # Characters searched again, a start tag can span two chunks
+
+##-----------------------------------------------------------------------------------
+
+
+# Everything wanted from one product page in one go: the <h1 class="page-title">
+# text under "title" plus the react_data fields, so no page is fetched twice
+def extract_page(text, fields=None, title_backend=None):
+    fields = PAGE_FIELDS if fields is None else fields
+    data = {}
+    keys = [field for field in fields if field != TITLE]
+    if keys:
+        data.update(extract_fields(text, keys) or {})
+    if TITLE in fields:
+        data[TITLE] = extract_title(text, title_backend)
+    return data
+
+
+# Incremental check for streamed pages: feed() the text read so far, True once
+# everything extract_page needs has arrived (react_data closed, title closed)
+class PageScanner:
+    def __init__(self, fields=None):
+        fields = PAGE_FIELDS if fields is None else fields
+        self.react_data = ReactDataScanner() if set(fields) - {TITLE} else None
+        self.need_title = TITLE in fields
+        self.title_pos = -1
+        self.pos = 0
+
+    def title_done(self, text):
+        if self.title_pos < 0:
+            match = TITLE_TAG.search(text, self.pos)
+            if match is None:
+                self.pos = max(len(text) - TAG_OVERLAP, 0)
+                return False
+            self.title_pos = match.end()
+        return text.find("</h1", self.title_pos) >= 0
+
+    def feed(self, text):
+        if self.react_data and not self.react_data.feed(text):
+            return False
+        return not self.need_title or self.title_done(text)
@@ -0,0 +1,65 @@
+import os
+from threading import BoundedSemaphore
+from concurrent.futures import ProcessPoolExecutor
+from title_parser import extract_title
+from react_data import extract_fields
+from page_extract import extract_page
+
+PARSE_WORKERS = os.cpu_count() or 2  # Số process dùng để parse HTML
+PARSE_QUEUE_SIZE = PARSE_WORKERS * 4  # Pages waiting before fetch threads block
+
+##-----------------------------------------------------------------------------------
+# Parse functions run inside worker processes, so they have to stay top-level
+# (picklable) and only import what they need.
+
+
+def to_text(content, encoding=None):
+    if isinstance(content, bytes):
+        return content.decode(encoding or "utf-8", errors="replace")
+    return content
+
+
+def parse_title(content, encoding=None, backend=None):
+    return extract_title(to_text(content, encoding), backend)
+
+
+def parse_react_data(content, encoding=None, keys=None):
+    return extract_fields(to_text(content, encoding), keys)
+
+
+def parse_page(content, encoding=None, fields=None):
+    return extract_page(to_text(content, encoding), fields)
+
+
+##-----------------------------------------------------------------------------------
+
+
+# Bounded parsing stage: fetch threads hand raw pages to a process pool so the
+# CPU work runs outside the GIL. When PARSE_QUEUE_SIZE pages are waiting, submit()
+# blocks the fetch thread until a parser frees a slot (backpressure).
+class ParsePipeline:
+    def __init__(self, workers=PARSE_WORKERS, queue_size=PARSE_QUEUE_SIZE):
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.slots = BoundedSemaphore(queue_size)
+
+    def submit(self, function, *args):
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(function, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def parse(self, function, *args):
+        return self.submit(function, *args).result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,62 @@
+import json
+from react_data import keys_map
+
+# Typed keys_map fields, everything else in keys_map is kept as text
+NUMERIC_FIELDS = {
+    "product_id": int,
+    "attribute_set_id": int,
+    "price": float,
+    "min_price": float,
+    "max_price": float,
+    "gold_weight": float,
+    "none_metal_weight": float,
+    "fixed_silver_weight": float,
+    "qty": float,
+}
+FIELDS = ["url", "title", *keys_map]
+FIELD_TYPES = {field: NUMERIC_FIELDS.get(field, str) for field in FIELDS}
+
+##-----------------------------------------------------------------------------------
+
+
+# "177.000000" -> 177.0, "" / None / garbage -> None. Lists and objects
+# (category, visible_contents, ...) are kept as their JSON text.
+def convert(value, field_type):
+    if value is None or value == "":
+        return None
+    if field_type is str:
+        if isinstance(value, str):
+            return value
+        return json.dumps(value, ensure_ascii=False)
+    try:
+        if field_type is int:
+            return int(float(value))
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# One crawled product with the fixed FIELDS schema: no per-record dict, numeric
+# fields already typed, missing fields None
+class ProductRecord:
+    __slots__ = FIELDS
+
+    def __init__(self, url, **fields):
+        self.url = url
+        for field in FIELDS[1:]:
+            setattr(self, field, convert(fields.get(field), FIELD_TYPES[field]))
+
+    # From the dict of page_extract.extract_page (title and react_data fields)
+    @classmethod
+    def from_page(cls, url, page_data):
+        return cls(url, **(page_data or {}))
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def __repr__(self):
+        return f"ProductRecord({self.url!r}, product_id={self.product_id!r})"
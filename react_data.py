@@ -0,0 +1,189 @@
+import json
+import re
+
+keys_map = [
+    "product_id",
+    "name",
+    "sku",
+    "attribute_set_id",
+    "attribute_set",
+    "type_id",
+    "price",
+    "min_price",
+    "max_price",
+    "min_price_format",
+    "max_price_format",
+    "gold_weight",
+    "none_metal_weight",
+    "fixed_silver_weight",
+    "material_design",
+    "qty",
+    "collection",
+    "collection_id",
+    "product_type",
+    "product_type_value",
+    "category",
+    "category_name",
+    "store_code",
+    "show_popup_quantity_eternity",
+    "visible_contents",
+    "gender",
+]
+
+MARKER = "react_data"
+MARKER_TAIL = re.compile(r"\s*=\s*\{")
+# Everything up to the next bracket, whole strings included, in one regex call.
+# A lone quote left after it means the string is not finished (partial buffer).
+SKIP = re.compile(
+    r"""(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|[^"'{}\[\]]+)*""", re.DOTALL
+)
+KEY = re.compile(r"""[\s,]*("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')\s*:\s*""", re.DOTALL)
+SCALAR = re.compile(r"""\s*(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|[^,}\]"']*)""")
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+decoder = json.JSONDecoder()
+
+##-----------------------------------------------------------------------------------
+
+
+# Find the "{" that opens `var react_data = {...}` with a plain substring search,
+# return its index or -1
+def find_object_start(text, start=0):
+    index = text.find(MARKER, start)
+    while index >= 0:
+        before = text[max(index - 8, 0) : index]
+        match = MARKER_TAIL.match(text, index + len(MARKER))
+        if match and before.rstrip().endswith("var"):
+            return match.end() - 1
+        index = text.find(MARKER, index + len(MARKER))
+    return -1
+
+
+# Walk braces/brackets from `pos` with the current `depth`.
+# Return (pos, depth, end): end is the index after the closing "}" or -1 when
+# the buffer stops before the object is complete (then resume from pos, depth).
+def scan_object(text, pos, depth=0):
+    length = len(text)
+    while True:
+        pos = SKIP.match(text, pos).end()
+        if pos >= length:
+            return length, depth, -1
+        char = text[pos]
+        if char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return pos + 1, 0, pos + 1
+        else:
+            return pos, depth, -1
+        pos += 1
+
+
+# Return the (start, end) span of the react_data object or None
+def find_react_data(text, start=0):
+    object_start = find_object_start(text, start)
+    if object_start < 0:
+        return None
+    _, _, end = scan_object(text, object_start)
+    if end < 0:
+        return None
+    return object_start, end
+
+
+# Incremental version of find_react_data for streamed pages: feed() it the
+# decoded text read so far, it resumes where the previous call stopped
+class ReactDataScanner:
+    def __init__(self):
+        self.object_start = -1
+        self.object_end = -1
+        self.pos = 0
+        self.depth = 0
+
+    def feed(self, text):
+        if self.object_end >= 0:
+            return True
+        if self.object_start < 0:
+            # The marker can be split between two chunks
+            self.object_start = find_object_start(text, max(self.pos - 32, 0))
+            if self.object_start < 0:
+                self.pos = len(text)
+                return False
+            self.pos = self.object_start
+        self.pos, self.depth, self.object_end = scan_object(text, self.pos, self.depth)
+        return self.object_end >= 0
+
+
+# Same JS-to-JSON fixes extract_react_data always did, on one value only
+def decode_loose(value_text):
+    value_text = value_text.strip().rstrip(",").strip()
+    value_text = value_text.replace("'", '"')
+    value_text = TRAILING_COMMA.sub(r"\1", value_text)
+    return json.loads(value_text)
+
+
+# End of the nested object/array at `pos`: the C decoder when it is strict
+# JSON, the bracket scan otherwise. -1 when the buffer stops inside it.
+def skip_nested(text, pos):
+    try:
+        return decoder.raw_decode(text, pos)[1]
+    except ValueError:
+        return scan_object(text, pos)[2]
+
+
+# Yield (key, value_start, value_end) for the top level of the object starting
+# at `object_start`, up to its closing "}" or the end of the buffer. Values are
+# only yielded once something follows them, a cut-off number is never returned.
+def top_level_fields(text, object_start):
+    length = len(text)
+    pos = object_start + 1
+    while True:
+        match = KEY.match(text, pos)
+        if not match or match.end() >= length:
+            return
+        value_start = match.end()
+        if text[value_start] in "{[":
+            value_end = skip_nested(text, value_start)
+            if value_end < 0:
+                return
+        else:
+            value_end = SCALAR.match(text, value_start).end()
+            if value_end >= length:
+                return
+        yield match.group(1)[1:-1], value_start, value_end
+        pos = value_end
+
+
+# Decode only the wanted top-level fields of react_data, None if not found.
+# Strict JSON goes through the C decoder in one pass; JS-style objects (single
+# quotes, trailing commas) fall back to a top-level field walk that decodes the
+# wanted fields one by one and stops once all of them are found.
+def extract_fields(text, keys=None, span=None):
+    object_start = span[0] if span else find_object_start(text)
+    if object_start < 0:
+        return None
+    try:
+        data, _ = decoder.raw_decode(text, object_start)
+        if keys is None:
+            return data
+        return {key: data[key] for key in keys if key in data}
+    except ValueError:
+        pass
+
+    wanted = set(keys) if keys is not None else None
+    data = {}
+    for key, value_start, value_end in top_level_fields(text, object_start):
+        if wanted is not None and key not in wanted:
+            continue
+        try:
+            value, end = decoder.raw_decode(text, value_start)
+            if end > value_end:
+                raise ValueError("Value runs past the next key")
+        except ValueError:
+            try:
+                value = decode_loose(text[value_start:value_end])
+            except ValueError:
+                continue
+        data[key] = value
+        if wanted is not None and len(data) == len(wanted):
+            break
+    return data
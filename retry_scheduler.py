@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+MAX_HOST_RETRIES = 300  # Retries allowed per host inside HOST_RETRY_WINDOW
+HOST_RETRY_WINDOW = 60  # Seconds
+MAX_RETRY_AFTER = 120  # Never wait longer than this for a Retry-After header
+
+##-----------------------------------------------------------------------------------
+
+
+def host_of(url):
+    return urlsplit(url).hostname or ""
+
+
+# Retry-After is either a number of seconds or an HTTP date, None if missing/invalid
+def parse_retry_after(value):
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(int(value), MAX_RETRY_AFTER)
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return min(max(retry_at - time.time(), 0), MAX_RETRY_AFTER)
+
+
+def backoff_delay(retry_count, backoff_factor):
+    return random.uniform(0.5, 1.5) * (backoff_factor**retry_count)
+
+
+# Delay before the next attempt: the server's Retry-After when it sent one,
+# jittered exponential backoff otherwise
+def retry_delay(retry_count, backoff_factor, retry_after=None):
+    if retry_after is not None:
+        return retry_after
+    return backoff_delay(retry_count, backoff_factor)
+
+
+# Sliding-window retry budget per host, shared by every scheduler/crawler so a
+# host that keeps failing cannot eat the whole run with retries
+class HostRetryBudget:
+    def __init__(self, max_retries=MAX_HOST_RETRIES, window=HOST_RETRY_WINDOW):
+        self.max_retries = max_retries
+        self.window = window
+        self.retries = {}
+        self.lock = threading.Lock()
+
+    def take(self, host):
+        now = time.monotonic()
+        with self.lock:
+            stamps = self.retries.setdefault(host, deque())
+            while stamps and now - stamps[0] > self.window:
+                stamps.popleft()
+            if len(stamps) >= self.max_retries:
+                return False
+            stamps.append(now)
+            return True
+
+
+# Timer heap of retries: schedule() files an item for later instead of sleeping,
+# pop_due() hands back the items whose time has come and next_delay() says how
+# long the consumer may wait for results before the next retry is due
+class RetryScheduler:
+    def __init__(self, max_retries, backoff_factor, host_budget=None, metrics=None):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.host_budget = host_budget
+        self.metrics = metrics  # CrawlMetrics, gets every retry and its backoff
+        self.heap = []
+        self.attempts = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    # Return False when the URL or its host has no retries left. Like the
+    # crawlers' MAX_RETRIES, max_retries counts failed attempts of the URL.
+    def schedule(self, url, item, retry_after=None):
+        with self.lock:
+            attempts = self.attempts.get(url, 0) + 1
+            if attempts >= self.max_retries:
+                return False
+            if self.host_budget and not self.host_budget.take(host_of(url)):
+                return False
+            self.attempts[url] = attempts
+            delay = retry_delay(attempts, self.backoff_factor, retry_after)
+            if self.metrics:
+                self.metrics.retry(host_of(url))
+                self.metrics.observe("backoff", delay)
+            heapq.heappush(
+                self.heap, (time.monotonic() + delay, next(self.counter), item)
+            )
+            return True
+
+    def pop_due(self):
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap)[2])
+        return due
+
+    def next_delay(self):
+        with self.lock:
+            if not self.heap:
+                return None
+            return max(self.heap[0][0] - time.monotonic(), 0)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.heap)
@@ -0,0 +1,167 @@
+import gzip
+import io
+import json
+import os
+import threading
+
+try:
+    import zstandard  # Optional, only needed for compression="zstd"
+except ImportError:
+    zstandard = None
+
+SINK_FLUSH_EVERY = 1000  # Records buffered between two flushes
+SINK_FSYNC = False  # fsync after every flush, survives a power cut not just a crash
+SINK_COMPRESSION = None  # None, "gzip" or "zstd"
+SINK_ROTATE_BYTES = (
+    256 * 1024**2
+)  # New part once a file passes this on disk, None = never
+
+SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+##-----------------------------------------------------------------------------------
+
+
+# Append-only NDJSON output shared by every crawler and export script: one record
+# per line as soon as it is known, flushed every `flush_every` records, optionally
+# compressed, and rotated to path.1.jsonl, path.2.jsonl, ... once the part passes
+# `rotate_bytes` on disk (compressed bytes for a compressed sink), checked at
+# every flush. append=False starts over: parts left by an earlier run are removed.
+class NdjsonSink:
+    def __init__(
+        self,
+        path,
+        compression=SINK_COMPRESSION,
+        flush_every=SINK_FLUSH_EVERY,
+        fsync=SINK_FSYNC,
+        rotate_bytes=SINK_ROTATE_BYTES,
+        append=True,
+    ):
+        if compression not in SUFFIXES:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("compression='zstd' needs the zstandard package")
+        self.path = path
+        self.compression = compression
+        self.flush_every = flush_every
+        self.fsync = fsync
+        self.rotate_bytes = rotate_bytes
+        self.count = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Appending continues in the last part an earlier run wrote, starting
+        # over removes that run's parts (part 0 is truncated by open)
+        self.part = 0
+        while os.path.exists(self.part_path(self.part + 1)):
+            self.part += 1
+            if not append:
+                os.remove(self.part_path(self.part))
+        if not append:
+            self.part = 0
+        self.open(append)
+
+    def part_path(self, part):
+        path = self.path
+        if part:
+            stem, extension = os.path.splitext(path)
+            path = f"{stem}.{part}{extension}"
+        return path + SUFFIXES[self.compression]
+
+    # File the next record goes to, changes when the sink rotates
+    @property
+    def current_path(self):
+        return self.part_path(self.part)
+
+    def open(self, append):
+        path = self.part_path(self.part)
+        self.raw = open(path, "ab" if append else "wb")
+        if self.compression == "gzip":
+            stream = gzip.GzipFile(fileobj=self.raw, mode="ab")
+        elif self.compression == "zstd":
+            stream = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        else:
+            stream = self.raw
+        self.file = io.TextIOWrapper(stream, encoding="utf-8", write_through=False)
+        self.pending = 0
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.count += 1
+            self.pending += 1
+            if self.pending >= self.flush_every:
+                self.flush_locked()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        self.file.flush()
+        self.raw.flush()
+        if self.fsync:
+            os.fsync(self.raw.fileno())
+        self.pending = 0
+        # Flushed, so the compressor has handed its output to the file as well
+        if self.rotate_bytes and self.raw.tell() >= self.rotate_bytes:
+            self.close_locked()
+            self.part += 1
+            self.open(append=False)
+
+    # Everything written so far is on disk when this returns, whatever fsync
+    # says: callers commit their crawl state right after it
+    def checkpoint(self):
+        with self.lock:
+            self.file.flush()
+            self.raw.flush()
+            os.fsync(self.raw.fileno())
+            self.pending = 0
+
+    def close_locked(self):
+        if self.file.closed:
+            return
+        self.file.flush()
+        self.file.close()  # Ends the gzip member / zstd frame
+        if not self.raw.closed:
+            self.raw.flush()
+            if self.fsync:
+                os.fsync(self.raw.fileno())
+            self.raw.close()
+
+    def close(self):
+        with self.lock:
+            self.close_locked()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Records of one NDJSON file written by NdjsonSink, plain or compressed
+def read_records(path):
+    if path.endswith(".gz"):
+        file = gzip.open(path, "rt", encoding="utf-8")
+    elif path.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError(f"Reading {path} needs the zstandard package")
+        file = io.TextIOWrapper(
+            zstandard.ZstdDecompressor().stream_reader(
+                open(path, "rb"), read_across_frames=True
+            ),
+            encoding="utf-8",
+        )
+    else:
+        file = open(path, "r", encoding="utf-8")
+    with file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,49 @@
+import pytest
+
+import host_control
+from host_control import ERROR, OK, THROTTLED, HostController
+
+
+def test_slots_up_to_the_limit():
+    controller = HostController()
+    for _ in range(host_control.HOST_INITIAL_LIMIT):
+        assert controller.try_acquire("a.de")
+    assert not controller.try_acquire("a.de")
+    assert controller.try_acquire("b.de")  # Every host has its own limit
+
+    controller.release("a.de")  # Cancelled: slot back, limit unchanged
+    assert controller.snapshot()["a.de"]["limit"] == host_control.HOST_INITIAL_LIMIT
+    assert controller.try_acquire("a.de")
+
+
+def test_additive_increase():
+    controller = HostController()
+    controller.try_acquire("a.de")
+    controller.release("a.de", OK)
+    limit = host_control.HOST_INITIAL_LIMIT
+    assert controller.state("a.de").limit == pytest.approx(limit + 1 / limit)
+
+
+def test_one_decrease_per_cooldown(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(host_control.time, "monotonic", lambda: now[0])
+    controller = HostController()
+    for _ in range(3):
+        controller.try_acquire("a.de")
+    controller.release("a.de", THROTTLED)
+    controller.release("a.de", THROTTLED)  # Same burst, no second cut
+    assert controller.state("a.de").limit == host_control.HOST_INITIAL_LIMIT / 2
+
+    now[0] += host_control.HOST_COOLDOWN
+    controller.release("a.de", THROTTLED)
+    assert controller.state("a.de").limit == host_control.HOST_INITIAL_LIMIT / 4
+    assert controller.state("a.de").in_flight == 0
+
+
+def test_errors_keep_the_limit_and_in_flight_never_negative():
+    controller = HostController()
+    controller.release("a.de", ERROR)
+    state = controller.state("a.de")
+    assert state.in_flight == 0
+    assert state.limit == host_control.HOST_INITIAL_LIMIT
+    assert state.errors == 1
@@ -0,0 +1,112 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from http_cache import HttpCache
+from page_extract import TITLE
+
+PAGE = (
+    '<h1 class="page-title"><span>Ring</span></h1>'
+    '<script>var react_data = {"product_id": 7, "name": "Ring"};</script>'
+    + "<p>rest of the page</p>" * 50
+)
+FIELDS = ["product_id", "name", TITLE]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = HttpCache(str(tmp_path / "cache"))
+    yield cache
+    cache.close()
+
+
+def test_stored_fields_cover_a_subset(cache):
+    page_data = {"product_id": 7, "name": "Ring", TITLE: "Ring"}
+    cache.store("https://a.de/r.html", PAGE, fields=FIELDS, page_data=page_data)
+    entry = cache.lookup("https://A.de/r.html#top")  # Canonical URL
+    assert entry.covers(["name"])
+    assert cache.page(entry, ["name"]) == {"name": "Ring"}
+
+
+def test_cut_off_body_answers_only_for_fields_in_it(cache):
+    cut = PAGE[: PAGE.index("</script>")]
+    cache.store("https://a.de/r.html", cut, fields=[TITLE], complete=False)
+    entry = cache.lookup("https://a.de/r.html")
+    assert not entry.replayable(FIELDS)
+    assert cache.page(entry, FIELDS) == {"product_id": 7, "name": "Ring", TITLE: "Ring"}
+
+    cut = PAGE[: PAGE.index('"name"')]
+    cache.store("https://a.de/s.html", cut, fields=[TITLE], complete=False)
+    assert cache.page(cache.lookup("https://a.de/s.html"), FIELDS) is None
+
+
+def test_least_recently_used_pages_are_evicted(cache):
+    cache.max_bytes = 2500
+    bodies = {name: os.urandom(1000) for name in "abc"}  # Incompressible
+    cache.store("https://a.de/a", bodies["a"])
+    cache.store("https://a.de/b", bodies["b"])
+    cache.touch("https://a.de/a")  # b is now the least recently used
+    cache.store("https://a.de/c", bodies["c"])
+    assert cache.lookup("https://a.de/b") is None
+    assert cache.body(cache.lookup("https://a.de/a")) == bodies["a"]
+    assert cache.lookup("https://a.de/c") is not None
+
+
+def test_same_body_is_stored_once(cache):
+    cache.store("https://a.de/1", PAGE)
+    cache.store("https://b.de/1", PAGE)
+    assert "2 pages, 1 distinct bodies" in cache.summary()
+    cache.forget("https://a.de/1")
+    assert cache.body(cache.lookup("https://b.de/1")) is not None
+    assert "1 pages, 1 distinct bodies" in cache.summary()
+
+
+class NotModifiedSession:
+    def __init__(self):
+        self.sent = []
+
+    def get(self, url, headers, **kwargs):
+        self.sent.append(headers)
+        return SimpleNamespace(
+            status_code=304,
+            headers={},
+            elapsed=SimpleNamespace(total_seconds=lambda: 0.01),
+            close=lambda: None,
+        )
+
+
+@pytest.fixture
+def main_cache(cache, monkeypatch):
+    monkeypatch.setattr(main, "http_cache", cache)
+    monkeypatch.setattr(main, "USE_HTTP_CACHE", True)
+    monkeypatch.setattr(main, "CACHE_OFFLINE", False)
+    monkeypatch.setattr(main, "EXTRACT_FIELDS", FIELDS)
+    return cache
+
+
+def test_304_replays_the_cached_page(main_cache):
+    url = "https://a.de/r.html"
+    main_cache.store(url, PAGE, headers={"ETag": '"v1"'})
+    session = NotModifiedSession()
+    result = main.request_data(session, url, {"User-Agent": "ua"}, threading.Event())
+    assert session.sent[0]["If-None-Match"] == '"v1"'
+    assert result["success"].name == "Ring"
+
+
+def test_304_without_a_usable_entry_is_retried_without_validators(main_cache):
+    url = "https://a.de/r.html"
+    main_cache.store(url, PAGE, headers={"ETag": '"v1"'})
+    entry = main_cache.lookup(url)
+    os.remove(main_cache.blob_path(entry.digest, entry.suffix))  # Body gone
+
+    session = NotModifiedSession()
+    result = main.request_data(session, url, {"User-Agent": "ua"}, threading.Event())
+    assert result["kind"] == "retryable"
+    assert result["status"] == 304
+    assert main_cache.lookup(url) is None
+
+    main.request_data(session, url, {"User-Agent": "ua"}, threading.Event())
+    assert "If-None-Match" not in session.sent[1]
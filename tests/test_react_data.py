@@ -0,0 +1,40 @@
+from react_data import ReactDataScanner, extract_fields, find_react_data
+
+STRICT = 'x<script>var react_data = {"name": "a}b{", "sku": "S-1", "tags": [1, {"k": "]"}]};</script>'
+LOOSE = "<script>var react_data = {'product_id': 7, 'name': 'Ring }', 'tags': [1, 2,], 'qty': 3,};</script>"
+
+
+def test_span_ignores_braces_inside_strings():
+    start, end = find_react_data(STRICT)
+    assert STRICT[start] == "{"
+    assert STRICT[end:].startswith(";</script>")
+
+
+def test_strict_json_fields():
+    assert extract_fields(STRICT, ["name", "tags"]) == {
+        "name": "a}b{",
+        "tags": [1, {"k": "]"}],
+    }
+
+
+def test_js_style_object_with_trailing_commas():
+    assert extract_fields(LOOSE, ["product_id", "name", "tags", "qty"]) == {
+        "product_id": 7,
+        "name": "Ring }",
+        "tags": [1, 2],
+        "qty": 3,
+    }
+
+
+def test_missing_object():
+    assert extract_fields("<html>no data</html>", ["name"]) is None
+    assert find_react_data("var react_data = {'name': 'cut") is None
+
+
+def test_scanner_across_chunks():
+    scanner = ReactDataScanner()
+    # Split inside the marker, inside a string holding a brace and at the end
+    cuts = [10, STRICT.index("a}b") + 2, len(STRICT) - 12]
+    for cut in cuts:
+        assert not scanner.feed(STRICT[:cut])
+    assert scanner.feed(STRICT)
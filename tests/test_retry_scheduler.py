@@ -0,0 +1,35 @@
+from retry_scheduler import HostRetryBudget, RetryScheduler, parse_retry_after
+
+
+def test_max_retries_counts_attempts_per_url():
+    scheduler = RetryScheduler(3, backoff_factor=0)
+    assert scheduler.schedule("https://a.de/1", "first", retry_after=0)
+    assert scheduler.schedule("https://a.de/1", "second", retry_after=0)
+    assert not scheduler.schedule("https://a.de/1", "third", retry_after=0)
+    # Another URL has its own count
+    assert scheduler.schedule("https://a.de/2", "other", retry_after=0)
+    assert scheduler.pop_due() == ["first", "second", "other"]
+    assert not scheduler
+
+
+def test_host_budget_is_shared_between_urls():
+    scheduler = RetryScheduler(10, 0, host_budget=HostRetryBudget(max_retries=2))
+    assert scheduler.schedule("https://a.de/1", 1, retry_after=0)
+    assert scheduler.schedule("https://a.de/2", 2, retry_after=0)
+    assert not scheduler.schedule("https://a.de/3", 3, retry_after=0)
+    assert scheduler.schedule("https://b.de/1", 4, retry_after=0)
+
+
+def test_retry_after_delays_the_item():
+    scheduler = RetryScheduler(3, 0)
+    scheduler.schedule("https://a.de/1", "later", retry_after=60)
+    assert scheduler.pop_due() == []
+    assert 59 < scheduler.next_delay() <= 60
+    assert len(scheduler) == 1
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("5") == 5
+    assert parse_retry_after("100000") == 120
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
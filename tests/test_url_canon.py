@@ -0,0 +1,38 @@
+from url_canon import DedupReport, canonical_url, dedup_urls
+
+
+def test_host_port_fragment_and_path():
+    assert (
+        canonical_url("HTTPS://WWW.Glamira.DE:443//ring//a.html#reviews")
+        == "https://www.glamira.de/ring/a.html"
+    )
+    assert canonical_url("http://glamira.de:8080/") == "http://glamira.de:8080/"
+
+
+def test_tracking_params_dropped_and_query_sorted():
+    report = DedupReport()
+    url = "https://glamira.de/a.html?b=2&utm_source=x&a=1&gclid=z"
+    assert canonical_url(url, report) == "https://glamira.de/a.html?a=1&b=2"
+    assert report.tracking_params == 2
+
+
+def test_query_keeps_the_link_encoding():
+    url = "https://glamira.de/a.html?stone=a%20b&sizes=1,2&alloy=white+585"
+    assert (
+        canonical_url(url)
+        == "https://glamira.de/a.html?alloy=white+585&sizes=1,2&stone=a%20b"
+    )
+
+
+def test_dedup_urls_keeps_first_order():
+    report = DedupReport()
+    urls = [
+        "https://glamira.de/b.html?x=1&y=2",
+        "https://glamira.de/a.html",
+        "https://GLAMIRA.de/b.html?y=2&x=1&utm_medium=mail",
+    ]
+    assert dedup_urls(urls, report) == [
+        "https://glamira.de/b.html?x=1&y=2",
+        "https://glamira.de/a.html",
+    ]
+    assert (report.seen, report.kept) == (3, 2)
@@ -0,0 +1,94 @@
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup  # Lib to read HTML code
+from lxml import html
+
+TITLE_BACKEND = "partial"  # One of BACKENDS, used when no backend is given
+TITLE_CLASS = "page-title"
+NO_TITLE = "No title found"
+
+##-----------------------------------------------------------------------------------
+
+
+def title_bs4(text, features="html.parser"):
+    soup = BeautifulSoup(text, features)
+    page_title = soup.find("h1", class_=TITLE_CLASS)
+    return page_title.get_text(strip=True) if page_title else NO_TITLE
+
+
+def title_bs4_lxml(text):
+    return title_bs4(text, "lxml")
+
+
+def title_lxml(text):
+    tree = html.fromstring(text)
+    title = tree.xpath(f'//h1[contains(concat(" ", @class, " "), " {TITLE_CLASS} ")]')
+    if not title:
+        return NO_TITLE
+    return "".join(piece.strip() for piece in title[0].itertext())
+
+
+class StopParsing(Exception):
+    pass
+
+
+# Collect the text of the first <h1 class="page-title"> and abort the parse at
+# its closing tag, nothing after the title is tokenized
+class TitleParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.depth = 0
+        self.pieces = []
+        self.found = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.depth:
+            self.depth += tag == "h1"
+            return
+        if tag == "h1":
+            classes = (dict(attrs).get("class") or "").split()
+            if TITLE_CLASS in classes:
+                self.depth = 1
+                self.found = True
+
+    def handle_endtag(self, tag):
+        if self.depth and tag == "h1":
+            self.depth -= 1
+            if not self.depth:
+                raise StopParsing
+
+    def handle_data(self, data):
+        if self.depth:
+            piece = data.strip()
+            if piece:
+                self.pieces.append(piece)
+
+
+# Jump to the first <h1 that mentions page-title with plain string searches,
+# then parse only from there until the title closes
+def title_partial(text):
+    position = text.find(TITLE_CLASS)
+    while position >= 0:
+        tag_start = text.rfind("<", 0, position)
+        if text[tag_start : tag_start + 3].lower() == "<h1":
+            parser = TitleParser()
+            try:
+                parser.feed(text[tag_start:])
+                parser.close()
+            except StopParsing:
+                pass
+            if parser.found:
+                return "".join(parser.pieces)
+        position = text.find(TITLE_CLASS, position + len(TITLE_CLASS))
+    return NO_TITLE
+
+
+BACKENDS = {
+    "bs4": title_bs4,
+    "bs4-lxml": title_bs4_lxml,
+    "lxml": title_lxml,
+    "partial": title_partial,
+}
+
+
+def extract_title(text, backend=None):
+    return BACKENDS[backend or TITLE_BACKEND](text)
@@ -0,0 +1,275 @@
+import socket
+import threading
+import time
+from collections import deque
+from itertools import islice
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from host_control import HOST_MAX_LIMIT
+from retry_scheduler import host_of
+
+try:
+    import httpx  # Optional, only needed for TRANSPORT_HTTP2 (pip install httpx[http2])
+except ImportError:
+    httpx = None
+
+POOL_HOSTS = 100  # Host pools kept open at once, requests' default of 10 churns
+DNS_CACHE_TTL = 300  # Seconds a resolved glamira host is reused
+KEEPALIVE_TIMEOUT = 30  # Seconds an idle aiohttp connection is kept
+HOST_LOOKAHEAD = 1000  # Items read ahead by interleave_by_host
+TRANSPORT_HTTP2 = False  # Send requests over httpx with HTTP/2 multiplexing
+
+##-----------------------------------------------------------------------------------
+
+
+# Connections per host: as many as the crawler can have in flight, but never
+# more than host_control lets a single host have
+def pool_size(concurrency):
+    return max(min(concurrency, HOST_MAX_LIMIT), 1)
+
+
+dns_cache = {}  # getaddrinfo arguments -> (expires at, addresses)
+dns_lock = threading.Lock()
+
+
+# Every new connection to a glamira host resolves its name again through
+# socket.getaddrinfo. Cache the answers for `ttl` seconds, process-wide.
+def install_dns_cache(ttl=DNS_CACHE_TTL):
+    if getattr(socket.getaddrinfo, "cached", False):
+        return
+    resolve = socket.getaddrinfo
+
+    def cached_getaddrinfo(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with dns_lock:
+            entry = dns_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+        addresses = resolve(*args, **kwargs)
+        with dns_lock:
+            dns_cache[key] = (now + ttl, addresses)
+        return addresses
+
+    cached_getaddrinfo.cached = True
+    socket.getaddrinfo = cached_getaddrinfo
+
+
+# A requests.Session for the threaded crawlers: one keep-alive pool per host,
+# POOL_HOSTS hosts kept at once, each pool as large as the crawl's concurrency
+def make_session(concurrency, http2=TRANSPORT_HTTP2):
+    session = requests.Session()
+    if http2:
+        adapter = Http2Adapter(pool_size(concurrency))
+    else:
+        adapter = HTTPAdapter(
+            pool_connections=POOL_HOSTS, pool_maxsize=pool_size(concurrency)
+        )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Per host: connections opened and requests sent over them, from urllib3's pools
+def pool_stats(session):
+    stats = {}
+    for adapter in set(session.adapters.values()):
+        if isinstance(adapter, Http2Adapter):
+            stats.update(adapter.stats())
+            continue
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = stats.setdefault(pool.host, {"connections": 0, "requests": 0})
+            host["connections"] += pool.num_connections
+            host["requests"] += pool.num_requests
+    return stats
+
+
+def reuse_report(stats):
+    lines = []
+    for host, counts in sorted(stats.items()):
+        connections, sent = counts["connections"], counts["requests"]
+        if connections is None:
+            lines.append(f"{host}: {sent} requests (HTTP/2)")
+            continue
+        reused = 1 - connections / sent if sent else 0
+        lines.append(
+            f"{host}: {sent} requests on {connections} connections, "
+            f"{reused:.0%} reused"
+        )
+    return "\n".join(lines)
+
+
+##-----------------------------------------------------------------------------------
+
+
+# Response body of an httpx stream behind the small part of urllib3's
+# HTTPResponse that requests.Response uses (stream/read/tell/close)
+class Http2Body:
+    def __init__(self, response):
+        self.response = response
+
+    def stream(self, chunk_size=None, decode_content=True):
+        try:
+            yield from self.response.iter_bytes(chunk_size)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(e)
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(e)
+
+    def read(self, amt=None, decode_content=True):
+        return b"".join(self.stream())
+
+    def tell(self):
+        return self.response.num_bytes_downloaded
+
+    def close(self):
+        self.response.close()
+
+    def release_conn(self):
+        self.response.close()
+
+
+# requests transport adapter that sends through one httpx.Client with HTTP/2,
+# so request_data/souping_data keep their requests code and exceptions while
+# every glamira host gets one multiplexed connection
+class Http2Adapter(HTTPAdapter):
+    def __init__(self, max_connections):
+        if httpx is None:
+            raise ValueError("TRANSPORT_HTTP2 needs the httpx package with http2")
+        super().__init__()
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=POOL_HOSTS * max_connections,
+                max_keepalive_connections=POOL_HOSTS * max_connections,
+                keepalive_expiry=KEEPALIVE_TIMEOUT,
+            ),
+        )
+        self.requests = {}  # host -> requests sent
+        self.lock = threading.Lock()
+
+    def send(
+        self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None
+    ):
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        else:
+            timeout = httpx.Timeout(timeout)
+        host = host_of(request.url)
+        with self.lock:
+            self.requests[host] = self.requests.get(host, 0) + 1
+        try:
+            response = self.client.send(
+                self.client.build_request(
+                    request.method,
+                    request.url,
+                    headers=dict(request.headers),
+                    content=request.body,
+                    timeout=timeout,
+                ),
+                stream=True,
+            )
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(e, request=request)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(e, request=request)
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+
+        result = requests.Response()
+        result.status_code = response.status_code
+        result.headers = CaseInsensitiveDict(response.headers.items())
+        result.encoding = get_encoding_from_headers(result.headers)
+        result.reason = response.reason_phrase
+        result.raw = Http2Body(response)
+        result.url = request.url
+        result.request = request
+        result.connection = self
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {
+                host: {"connections": None, "requests": count}
+                for host, count in self.requests.items()
+            }
+
+    def close(self):
+        self.client.close()
+        super().close()
+
+
+##-----------------------------------------------------------------------------------
+
+
+# aiohttp connector with the same sizing: `concurrency` connections in total,
+# pool_size() per host, DNS answers cached for DNS_CACHE_TTL
+def make_connector(concurrency):
+    import aiohttp
+
+    return aiohttp.TCPConnector(
+        limit=concurrency,
+        limit_per_host=pool_size(concurrency),
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+
+
+# Connections opened and reused per host on an aiohttp session, through its
+# tracing signals (aiohttp keeps no such counters itself)
+class ConnectionReuse:
+    def __init__(self):
+        self.stats = {}  # host -> {"connections": n, "requests": n}
+
+    def count(self, host, new):
+        counts = self.stats.setdefault(host, {"connections": 0, "requests": 0})
+        counts["requests"] += 1
+        counts["connections"] += new
+
+    def trace_config(self):
+        import aiohttp
+
+        async def on_request_start(session, context, params):
+            context.host = params.url.host
+            context.new = False
+
+        async def on_connection_create_end(session, context, params):
+            context.new = True
+
+        async def on_request_headers_sent(session, context, params):
+            self.count(context.host, context.new)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_request_headers_sent.append(on_request_headers_sent)
+        return trace_config
+
+    def report(self):
+        return reuse_report(self.stats)
+
+
+# Reorder a stream of {"url": ...} docs so consecutive items go to different
+# hosts: read `lookahead` items at a time and hand them out round-robin over
+# their hosts. A window of in-flight requests is then spread over every host's
+# AIMD limit instead of queueing behind the one host it was filled with.
+def interleave_by_host(items, lookahead=HOST_LOOKAHEAD):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, lookahead))
+        if not chunk:
+            return
+        hosts = {}
+        for data in chunk:
+            hosts.setdefault(host_of(data.get("url")), deque()).append(data)
+        queues = list(hosts.values())
+        while queues:
+            for queue in queues:
+                yield queue.popleft()
+            queues = [queue for queue in queues if queue]
@@ -0,0 +1,96 @@
+from urllib.parse import urlsplit, urlunsplit, unquote_plus
+
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "dclid", "yclid", "gbraid", "wbraid"}
+TRACKING_PREFIXES = ("utm_", "itm_")  # utm_source, itm_medium, ...
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+##-----------------------------------------------------------------------------------
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+# Decoded (name, value) of one raw "name=value" query pair, the sort key
+def decoded_pair(pair):
+    name, _, value = pair.partition("=")
+    return unquote_plus(name), unquote_plus(value)
+
+
+# One spelling per page: lower-case scheme and host, no default port, no
+# fragment, no empty path segments, tracking params dropped and the query sorted.
+# The kept pairs are joined as the link encoded them (no %20 -> +, , -> %2C),
+# so the crawler fetches the original link and not a rewritten one.
+def canonical_url(url, report=None):
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except (AttributeError, ValueError):
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+
+    path = "/" + "/".join(segment for segment in parts.path.split("/") if segment)
+    if parts.path.endswith("/") and path != "/":
+        path += "/"
+
+    query = [pair for pair in parts.query.split("&") if pair]
+    kept = [pair for pair in query if not is_tracking_param(decoded_pair(pair)[0])]
+    kept.sort(key=decoded_pair)
+    if report is not None:
+        report.tracking_params += len(query) - len(kept)
+
+    return urlunsplit((scheme, host, path, "&".join(kept), ""))
+
+
+# Counts of what canonicalization removed, printed at the end of a run
+class DedupReport:
+    def __init__(self):
+        self.seen = 0
+        self.kept = 0
+        self.tracking_params = 0
+
+    def summary(self):
+        removed = self.seen - self.kept
+        share = removed / self.seen * 100 if self.seen else 0
+        return (
+            f"URLs read: {self.seen}, kept: {self.kept}, "
+            f"removed: {removed} ({share:.1f}%), "
+            f"tracking params stripped: {self.tracking_params}"
+        )
+
+
+# Canonical, order-preserving, duplicate-free copy of one product's URL list
+def dedup_urls(urls, report=None):
+    unique = {}
+    for url in urls:
+        unique.setdefault(canonical_url(url, report), None)
+    if report is not None:
+        report.seen += len(urls)
+        report.kept += len(unique)
+    return list(unique)
+
+
+# product_dict stream ({id: [urls]} per item) with every URL list deduplicated
+def dedup_products(id_url_stream, report=None):
+    for id_url in id_url_stream:
+        yield {id: dedup_urls(url_list, report) for id, url_list in id_url.items()}
+
+
+# Crawl input stream ({"id", "url", ...} per item): canonical URL in place, and
+# a URL already seen earlier in the stream is not yielded again
+def dedup_docs(docs, report=None, seen=None):
+    seen = set() if seen is None else seen
+    for doc in docs:
+        url = canonical_url(doc.get("url", ""), report)
+        if report is not None:
+            report.seen += 1
+        if url in seen:
+            continue
+        seen.add(url)
+        if report is not None:
+            report.kept += 1
+        yield {**doc, "url": url}
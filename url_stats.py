@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+from urllib.parse import urlsplit
+
+URL_STATS_PATH = "url_stats.json"  # Shared by every crawler, survives between runs
+MIN_ATTEMPTS = 5  # Below this a host+pattern falls back to the host-wide numbers
+LATENCY_ALPHA = 0.2  # Weight of the newest latency in the moving average
+DEFAULT_LATENCY = 1.0  # Seconds, for hosts never seen before
+
+##-----------------------------------------------------------------------------------
+
+
+# Kind of glamira URL, they behave differently on the same host
+def url_pattern(url):
+    path = urlsplit(url).path
+    if "/checkout/cart/configure/" in path:
+        return "configure"
+    if path.endswith(".html"):
+        return "product"
+    return "other"
+
+
+# Persistent success/latency index per host and per host+URL pattern. Every
+# crawl records into it, and rank() orders a product's candidate URLs by
+# expected cost (latency / chance of success), cheapest likely winner first.
+class UrlStatsIndex:
+    def __init__(self, path=URL_STATS_PATH):
+        self.path = path
+        self.stats = {}  # key -> [attempts, successes, latency moving average]
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    self.stats = json.load(file)
+            except Exception as e:
+                print(f"Error reading {path}: {e}")
+
+    @staticmethod
+    def keys(url):
+        host = urlsplit(url).hostname or ""
+        return host, f"{host}|{url_pattern(url)}"
+
+    def record(self, url, success, latency=None):
+        with self.lock:
+            for key in self.keys(url):
+                entry = self.stats.setdefault(key, [0, 0, DEFAULT_LATENCY])
+                entry[0] += 1
+                entry[1] += bool(success)
+                if latency is not None:
+                    entry[2] += LATENCY_ALPHA * (latency - entry[2])
+
+    def estimate(self, url):
+        host_key, pattern_key = self.keys(url)
+        with self.lock:
+            entry = self.stats.get(pattern_key)
+            if not entry or entry[0] < MIN_ATTEMPTS:
+                entry = self.stats.get(host_key)
+            if not entry:
+                return 0.5, DEFAULT_LATENCY
+            attempts, successes, latency = entry
+        # Beta(1, 1) prior keeps rarely seen hosts in the race
+        return (successes + 1) / (attempts + 2), latency
+
+    def expected_cost(self, url):
+        success_rate, latency = self.estimate(url)
+        return latency / success_rate
+
+    def rank(self, urls):
+        return sorted(urls, key=self.expected_cost)
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            data = json.dumps(self.stats)
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as file:
+                file.write(data)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            print(f"Error saving {self.path}: {e}")
@@ -0,0 +1,139 @@
+import json
+import os
+from array import array
+from collections.abc import Sequence
+from urllib.parse import urlsplit
+
+COMPACT_FORMAT = "compact-urls-1"
+
+##-----------------------------------------------------------------------------------
+
+
+# Interned pieces of every URL in a product_dict batch. A URL is stored as
+# integers: [origin, path, param count, param...], where origin is
+# "scheme://host", path is the whole path and each param is one "key=value"
+# pair, so "https://www.glamira.de", slugs and "alloy=white-585" are kept once
+# per batch instead of once per URL.
+class UrlTable:
+    def __init__(self, origins=None, paths=None, params=None):
+        self.origins = origins or []
+        self.paths = paths or []
+        self.params = params or []
+        self.origin_index = {value: i for i, value in enumerate(self.origins)}
+        self.path_index = {value: i for i, value in enumerate(self.paths)}
+        self.param_index = {value: i for i, value in enumerate(self.params)}
+
+    @staticmethod
+    def intern(values, index, value):
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(values)
+            values.append(value)
+        return code
+
+    def encode(self, url):
+        parts = urlsplit(url)
+        params = parts.query.split("&") if parts.query else []
+        return [
+            self.intern(
+                self.origins, self.origin_index, f"{parts.scheme}://{parts.netloc}"
+            ),
+            self.intern(self.paths, self.path_index, parts.path),
+            len(params),
+            *(self.intern(self.params, self.param_index, param) for param in params),
+        ]
+
+    # URL starting at codes[pos], and the position of the next one
+    def decode(self, codes, pos):
+        count = codes[pos + 2]
+        url = self.origins[codes[pos]] + self.paths[codes[pos + 1]]
+        if count:
+            params = codes[pos + 3 : pos + 3 + count]
+            url += "?" + "&".join(self.params[code] for code in params)
+        return url, pos + 3 + count
+
+
+# One product's candidate URLs as a flat array of codes into a shared UrlTable.
+# Behaves like a read-only list of URL strings, each decoded only when read.
+class CompactUrlList(Sequence):
+    __slots__ = ("table", "codes", "starts")
+
+    def __init__(self, table, codes):
+        self.table = table
+        self.codes = array("I", codes)
+        self.starts = array("I")
+        pos = 0
+        while pos < len(self.codes):
+            self.starts.append(pos)
+            pos += 3 + self.codes[pos + 2]
+
+    @classmethod
+    def from_urls(cls, table, urls):
+        codes = []
+        for url in urls:
+            codes.extend(table.encode(url))
+        return cls(table, codes)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.table.decode(self.codes, self.starts[index])[0]
+
+    def __repr__(self):
+        return f"CompactUrlList({len(self)} URLs)"
+
+
+# A batch of {id: urls} items as one self-contained compact file
+def save_compact_batch(batch, file_path):
+    table = UrlTable()
+    products = []
+    for id_url in batch:
+        for id, url_list in id_url.items():
+            codes = []
+            for url in url_list:
+                codes.extend(table.encode(url))
+            products.append([id, codes])
+    data = {
+        "format": COMPACT_FORMAT,
+        "origins": table.origins,
+        "paths": table.paths,
+        "params": table.params,
+        "products": products,
+    }
+    try:
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        print(f"Saved to {file_path}")
+    except Exception as e:
+        print(f"Error saving to JSON: {e}")
+
+
+def load_compact_batch(file_path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("format") != COMPACT_FORMAT:
+        raise ValueError(f"{file_path} is not a compact product batch")
+    table = UrlTable(data["origins"], data["paths"], data["params"])
+    return [{id: CompactUrlList(table, codes)} for id, codes in data["products"]]
+
+
+# Same items as streaming_json over plain product_dict batches, {id: urls}.
+# .cjson batches from group_by_product are canonical already and stay compact
+# while the batch waits, each table is freed with the last product of its
+# batch; a product's URLs are decoded once it starts. Plain .json batches are
+# only deduplicated, encoding them on the fly would be decoded right away.
+def stream_compact_products(file_pool, report=None):
+    from json_processing import streaming_json
+    from url_canon import dedup_products
+
+    for file_path in file_pool:
+        if os.path.splitext(file_path)[1] != ".cjson":
+            yield from dedup_products(streaming_json([file_path]), report)
+            continue
+        try:
+            yield from load_compact_batch(file_path)
+        except Exception as e:
+            print(f"Error reading file {file_path}: {e}")